@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""
+Compares the matches of lmh_tokenizer.ArgumentRegex (arguments read by scan_arg)
+with the token regexes of lmh_harvest.py and lmhtools2 (arguments matched with RE_ARG).
+
+The strings are random sequences of fragments of sTeX (without nested braces in arguments,
+which only ArgumentRegex supports), plus the regression cases in CASES.
+"""
+
+import os
+import random
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "lmhtools2"))
+import lmh_harvest
+import lmh_tokenizer
+import regexes
+
+
+FRAGMENTS = ["\\begin{omgroup}", "\\begin{blindomgroup}", "\\end{omgroup}", "\\begin{mhmodnl}", "\\begin{modsig}",
+             "\\defi", "\\defii", "\\trefi", "\\mtrefi", "\\symi", "\\symdef", "\\importmhmodule", "\\gimport",
+             "[id=intro]", "[name=set]", "[mhrepos=smglom/sets]", "{Introduction}", "{set}", "{en}", "{a}{b}",
+             "{\\bf Note}", "{$x$}", "$x$", "$", "{", "}", " ", "\n", "text", "%"]
+
+# strings for which ArgumentRegex once differed from the token regexes
+CASES = [
+    "\\begin{omgroup}[id=intro]{Introduction}\n{\\bf Note}",
+]
+
+def get_regexes():
+    """ the token regexes that are matched with ArgumentRegex """
+    result = []
+    for module in [lmh_harvest, regexes]:
+        for (name, value) in sorted(vars(module).items()):
+            if isinstance(value, re.Pattern):
+                argument_regex = lmh_tokenizer.ArgumentRegex.create(value)
+                if argument_regex:
+                    result.append((f"{module.__name__}.{name}", value, argument_regex))
+    return result
+
+def generate_string(rng, length):
+    """ a random string in which braces are not nested (unbalanced braces are fine) """
+    while True:
+        string = "".join(rng.choice(FRAGMENTS) for _ in range(length))
+        depth = 0
+        for c in string:
+            depth = max(depth + 1, 1) if c == "{" else depth - 1 if c == "}" else depth
+            if depth > 1:
+                break
+        else:
+            return string
+
+def get_matches(matcher, string):
+    matches = []
+    for pos in range(len(string)):
+        match = matcher.match(string, pos)
+        matches.append((match.span(), match.groupdict()) if match else None)
+    return matches
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Comparison of ArgumentRegex with the token regexes")
+    parser.add_argument("-n", "--strings", type=int, default=2000, help="number of random strings (default: 2000)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed for the random strings (default: 0)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    strings = CASES + [generate_string(rng, rng.randint(1, 12)) for _ in range(args.strings)]
+    mismatches = 0
+    for (name, regex, argument_regex) in get_regexes():
+        for string in strings:
+            if get_matches(regex, string) != get_matches(argument_regex, string):
+                mismatches += 1
+                print(f"{name} differs for {string!r}")
+    print(f"{mismatches} mismatches ({len(strings)} strings)")
+    sys.exit(1 if mismatches else 0)
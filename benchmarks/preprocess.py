@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Compares the comment stripping of lmh_source.strip_comment_lines
+with the previous implementation (applying a regex substitution until nothing changes).
+
+Files with long comment blocks (as in lecture notes) are generated for the comparison,
+but existing files can be passed as arguments as well.
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import lmh_source
+
+
+def preprocess_string_fixpoint(string):
+    """ the previous implementation of lmh_harvest.preprocess_string """
+    s = re.sub(r"(^|\n)[\t ]*\%[^\n]*\n", r"\1\n", string)
+    while s != string:
+        string = s
+        s = re.sub(r"(^|\n)[\t ]*\%[^\n]*\n", r"\1\n", string)
+    return string
+
+def generate_file(blocks, block_length):
+    """ generates a file with comment blocks of the given length """
+    parts = []
+    for i in range(blocks):
+        parts.append("\\begin{frame}\n  \\frametitle{Slide %d}\n  Some text about \\trefi[set]{set}.\n" % i)
+        parts.extend("  %% comment line %d of block %d\n" % (j, i) for j in range(block_length))
+        parts.append("\\end{frame}\n")
+    return "".join(parts)
+
+def measure(function, strings, repetitions):
+    best = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for string in strings:
+            function(string)
+        duration = time.perf_counter() - start
+        best = duration if best == None else min(best, duration)
+    return best
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark for the comment stripping")
+    parser.add_argument("-r", "--repetitions", type=int, default=3, help="number of repetitions (default: 3)")
+    parser.add_argument("FILE", nargs="*", help="files used for the benchmark (default: generated files)")
+    args = parser.parse_args()
+
+    if args.FILE:
+        inputs = []
+        for path in args.FILE:
+            with open(path, "r") as fp:
+                inputs.append((path, [fp.read()]))
+    else:
+        inputs = [(f"{blocks} blocks of {length} comment lines", [generate_file(blocks, length)])
+                    for (blocks, length) in [(100, 1), (50, 10), (20, 50), (5, 200)]]
+
+    for (name, strings) in inputs:
+        for string in strings:
+            assert preprocess_string_fixpoint(string) == lmh_source.strip_comment_lines(string)
+        old = measure(preprocess_string_fixpoint, strings, args.repetitions)
+        new = measure(lmh_source.strip_comment_lines, strings, args.repetitions)
+        print(f"{name}: fixpoint loop {old*1000:.2f}ms, single pass {new*1000:.2f}ms ({old/new:.1f}x)")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Compares the memory needed for the records of lmh_harvest.DataGatherer
+(classes with __slots__) with the previous representation (a dict per record).
+
+The records are generated for a synthetic corpus of module files,
+each of which has a few symdefs, defis and many trefis (as in SMGloM).
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import lmh_harvest
+import lmh_source
+
+
+def gather(files, symbols, trefis, as_dicts):
+    """ fills a DataGatherer with records for a synthetic corpus """
+    gatherer = lmh_harvest.DataGatherer()
+    ctx = lmh_harvest.HarvestContext(lmh_harvest.SimpleLogger(0), gatherer, "/MathHub")
+    ctx.mod_type = "module"
+    ctx.lang = "en"
+    ctx.positions = lmh_source.PositionIndex("\n" * 100)
+    for i in range(files):
+        ctx.repo = f"smglom/repo{i % 20}"
+        ctx.file = f"/MathHub/{ctx.repo}/source/module{i}.tex"
+        ctx.mod_name = f"module{i}"
+        params = lmh_harvest.get_params(f"mhrepos={ctx.repo}")
+        for j in range(symbols):
+            gatherer.push_symi(f"symbol{j}", 10 * j, "symdef", False, None, ctx, params)
+            gatherer.push_defi(f"symbol{j}", f"symbol {j}", 10 * j + 5, ctx, params)
+        for j in range(trefis):
+            gatherer.push_trefi(f"symbol{j % symbols}", f"module{j % 50}", False, 3 * j, ctx)
+    if as_dicts:
+        for name in ["symis", "defis", "trefis"]:
+            setattr(gatherer, name, [dict(zip(record.__slots__, (getattr(record, f) for f in record.__slots__)))
+                                       for record in getattr(gatherer, name)])
+    return gatherer
+
+def measure(files, symbols, trefis, as_dicts):
+    """ returns the memory used by the gathered data (in bytes) and the time needed for gathering """
+    tracemalloc.start()
+    start = time.perf_counter()
+    gatherer = gather(files, symbols, trefis, as_dicts)
+    duration = time.perf_counter() - start
+    (size, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    records = len(gatherer.symis) + len(gatherer.defis) + len(gatherer.trefis)
+    return (size, duration, records)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory comparison for the records of the DataGatherer")
+    parser.add_argument("-f", "--files", type=int, default=2000, help="number of files (default: 2000)")
+    parser.add_argument("-s", "--symbols", type=int, default=5, help="symbols per file (default: 5)")
+    parser.add_argument("-t", "--trefis", type=int, default=50, help="trefis per file (default: 50)")
+    args = parser.parse_args()
+
+    (old, _, records) = measure(args.files, args.symbols, args.trefis, True)
+    (new, duration, _) = measure(args.files, args.symbols, args.trefis, False)
+    print(f"{records} records: dicts {old/2**20:.1f}MiB ({old/records:.0f} bytes per record), "
+          f"slots {new/2**20:.1f}MiB ({new/records:.0f} bytes per record) ({old/new:.1f}x), "
+          f"gathering took {duration:.2f}s")
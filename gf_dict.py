@@ -2,22 +2,41 @@
 Very experimental tool to generate a GF (Grammatical Framework) Lexicon from SMGloM
 """
 
+import lmh_archive
 import lmh_harvest as harvest
+import lmh_records
+import lmh_snapshot
+import os
 import sys
 
 
 directories = sys.argv[1:]
-mathhub_dir = harvest.get_mathhub_dir(directories[0])
-ctx = harvest.HarvestContext(harvest.SimpleLogger(2), harvest.DataGatherer(), mathhub_dir)
-
-for directory in directories:
-    harvest.gather_data_for_all_repos(directory, ctx)
+# only the gfc annotations and the German and English defis are kept
+snapshot = None
+if os.path.isfile(directories[0]) and not lmh_archive.is_archive(directories[0]):
+    # a snapshot (see lmh_harvest.py --snapshot) instead of directories (or archives of them)
+    (snapshot, mathhub_dir) = lmh_snapshot.open_snapshot(directories.pop(0))
+else:
+    mathhub_dir = harvest.get_mathhub_dir(directories[0])
+ctx = harvest.HarvestContext(harvest.SimpleLogger(2), harvest.StreamingGatherer(), mathhub_dir)
+
+def get_records():
+    if snapshot != None:
+        for kind in lmh_records.RECORD_TYPES:
+            for record in getattr(snapshot, kind):
+                yield (kind, record)
+    for directory in directories:
+        yield from harvest.iter_records(directory, ctx)
 
 symi_dict = {}
-for symi in ctx.gatherer.symis:
-    symb = symi["mod_name"].replace("-", "_") + "_" + symi["name"].replace("-", "_")
-    if "gfc" in symi["params"]:
-        symi_dict[symb] = symi["params"]["gfc"]
+defis = []
+for (kind, record) in get_records():
+    if kind == "symis":
+        symb = record["mod_name"].replace("-", "_") + "_" + record["name"].replace("-", "_")
+        if "gfc" in record["params"]:
+            symi_dict[symb] = record["params"]["gfc"]
+    elif kind == "defis" and record["lang"] in ["de", "en"]:
+        defis.append(record)
 
 def umlautSubst(s):
     return s.replace("\"a", "ä")\
@@ -29,7 +48,7 @@ def umlautSubst(s):
             .replace("\"s", "ß")
 
 results = {}
-for defi in ctx.gatherer.defis:
+for defi in defis:
     lang = defi["lang"] 
     if lang not in ["de", "en"]:
         continue
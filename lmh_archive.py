@@ -0,0 +1,187 @@
+"""
+Harvesting of MathHub snapshots in tar or zip archives (e.g. snapshot.tar.gz) without extracting them
+(used by lmh_harvest.py if a directory that is harvested is an archive).
+
+The files in an archive get the paths they would have if the archive were extracted
+into a directory with the path of the archive (e.g. snapshot.tar.gz/MathHub/smglom/sets/source/sets.en.tex).
+Such a path of a directory in the archive can be harvested as well (e.g. snapshot.tar.gz/MathHub/smglom,
+see split_archive_path), which only harvests the repos in that directory.
+A directory in the archive is a repo if it contains .git or META-INF/MANIFEST.MF
+(repos in other repos and in directories called meta-inf are skipped, like in lmh_repos.py).
+
+The members of an archive are listed once (for a compressed tar archive, that requires decompressing it once).
+Afterwards, the files are read in the order of the archive
+(so the whole archive is only decompressed once more, see Archive.read_blob).
+"""
+
+import functools
+import os
+import tarfile
+import zipfile
+
+import lmh_repos
+import lmh_source
+
+
+def is_archive(path):
+    """ returns True if path is a tar archive (possibly compressed) or a zip archive """
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+def split_archive_path(path):
+    """ returns (archive path, member path) if path is an archive or a path in an archive
+        (e.g. (".../snapshot.tar.gz", "MathHub/smglom") for .../snapshot.tar.gz/MathHub/smglom),
+        and (None, None) otherwise """
+    path = os.path.abspath(path)
+    archive_path = path
+    while not os.path.exists(archive_path):
+        archive_path = os.path.dirname(archive_path)
+    if not is_archive(archive_path):
+        return (None, None)
+    return (archive_path, get_member_path(os.path.relpath(path, archive_path).replace(os.sep, "/")))
+
+def get_member_path(name):
+    """ the path of a member relative to the root of the archive (e.g. without "./") """
+    parts = [part for part in name.split("/") if part not in ["", "."]]
+    return "/".join(parts)
+
+@functools.lru_cache(maxsize = 8)
+def open_archive(path):
+    """ returns the Archive at an absolute path (which is only listed once) """
+    return Archive(path)
+
+def get_mathhub_dir(path):
+    """ the path of the first directory called MathHub in an archive (or the path of the archive if there is none) """
+    archive = open_archive(split_archive_path(path)[0])
+    for member in archive.paths:
+        parts = member.split("/")
+        if "MathHub" in parts:
+            return archive.get_path("/".join(parts[:parts.index("MathHub") + 1]))
+    return archive.path
+
+
+class Archive(object):
+    """ The members of a tar or zip archive (see the module documentation) """
+    def __init__(self, path):
+        self.path = path
+        self.paths = []         # the paths of all members (including directories)
+        self.files = []         # the paths of the regular files (the index is used to read them)
+        self.preambles = {}     # index -> content of a lib/preamble.tex file (read while the archive is listed)
+        self.zip = None
+        self.tar = None         # the tar archive that is read (as a stream)
+        self.position = 0       # index of the next file in self.tar
+
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            self.infos = []
+            for info in self.zip.infolist():
+                self.paths.append(get_member_path(info.filename))
+                if not info.is_dir():
+                    self.files.append(self.paths[-1])
+                    self.infos.append(info)
+        else:
+            with tarfile.open(path, "r|*") as tar:
+                for member in tar:
+                    self.paths.append(get_member_path(member.name))
+                    if member.isfile():
+                        if self.paths[-1].endswith("lib/preamble.tex"):
+                            self.preambles[len(self.files)] = tar.extractfile(member).read()
+                        self.files.append(self.paths[-1])
+
+        self.repos = self.find_repos()
+
+    def get_repos(self, member_path):
+        """ returns the ArchiveRepoFiles for the repos in a directory of the archive ("" for all of them) """
+        if member_path and member_path not in self.paths and not any(path.startswith(member_path + "/") for path in self.paths):
+            raise Exception(f"{self.get_path(member_path)} does not exist in {self.path}")
+        return [repo for repo in self.repos
+                    if not member_path or repo.member_path == member_path or repo.member_path.startswith(member_path + "/")]
+
+    def get_path(self, member_path):
+        """ the path that a member would have if the archive were extracted """
+        return os.path.join(self.path, *member_path.split("/"))
+
+    def find_repos(self):
+        """ returns the ArchiveRepoFiles for the repos in the archive (in the order of their first members) """
+        candidates = set()
+        for member in self.paths:
+            parts = member.split("/")
+            for (i, part) in enumerate(parts):
+                if part == ".git" or (part == "META-INF" and parts[i + 1:] == ["MANIFEST.MF"]):
+                    candidates.add("/".join(parts[:i]))
+                    break
+
+        repos = {}      # member path of a repo -> ArchiveRepoFiles
+        def get_repo(member):
+            parts = member.split("/")
+            for i in range(len(parts) + 1):
+                prefix = "/".join(parts[:i])
+                if prefix in candidates:
+                    if any(lmh_repos.skip_meta_inf(None, part) for part in parts[:i]):
+                        return None
+                    if prefix not in repos:
+                        repos[prefix] = ArchiveRepoFiles(self, prefix)
+                    return repos[prefix]
+            return None
+
+        for member in self.paths:
+            get_repo(member)
+        for (index, member) in enumerate(self.files):
+            repo = get_repo(member)
+            if repo != None:
+                repo.add_file(index, member)
+        return list(repos.values())
+
+    def read_blob(self, index):
+        """ returns the content (bytes) of a file """
+        if self.zip != None:
+            return self.zip.read(self.infos[index])
+        if index in self.preambles:
+            return self.preambles[index]
+        if self.tar == None or index < self.position:
+            # the files are read in the order of the archive, so that it only has to be read once
+            if self.tar != None:
+                self.tar.close()
+            self.tar = tarfile.open(self.path, "r|*")
+            self.position = 0
+        while True:
+            member = self.tar.next()
+            if member == None:
+                raise Exception(f"Failed to read {self.files[index]} from {self.path}")
+            if member.isfile():
+                self.position += 1
+                if self.position - 1 == index:
+                    return self.tar.extractfile(member).read()
+
+
+class ArchiveRepoFiles(object):
+    """ The files of a repo in an Archive (like lmh_git.GitRepoFiles) """
+    def __init__(self, archive, member_path):
+        self.archive = archive
+        self.member_path = member_path
+        self.directory = archive.get_path(member_path) if member_path else archive.path
+        self.files = []         # (root, file name, index) for the files in the source directory
+        self.indices = {}       # path in the repo -> index
+
+    def add_file(self, index, member):
+        path = member[len(self.member_path) + 1:] if self.member_path else member
+        self.indices[path] = index
+        if path.startswith("source/"):
+            (directory, file_name) = path.rsplit("/", 1)
+            self.files.append((os.path.join(self.directory, *directory.split("/")), file_name, index))
+
+    def close(self):
+        pass
+
+    def iter_files(self):
+        """ yields (root, file_name, index) for the files in the source directory (in the order of the archive) """
+        return iter(self.files)
+
+    def read_blob(self, index):
+        """ returns the content (bytes) of a file from iter_files """
+        return self.archive.read_blob(index)
+
+    def read_file(self, path):
+        """ returns the content of a file in the repo (e.g. lib/preamble.tex), or None if it doesn't exist """
+        if path not in self.indices:
+            return None
+        return lmh_source.decode_content(self.archive.read_blob(self.indices[path]))
@@ -0,0 +1,158 @@
+"""
+A persistent cache for the harvest of files (used by lmh_harvest.py).
+
+For every harvested file, the records that were added to the DataGatherer
+and the messages that were logged are stored in the cache directory.
+When the file is harvested again, they are replayed instead of harvesting the file,
+as long as the file hasn't changed (same modification time and size, or at least the same content)
+and the harvesting code hasn't changed either.
+
+The cache is used if a cache directory is set (e.g. with the --cache option of lmh_debug.py)
+or if the environment variable LMH_CACHE is set to a cache directory.
+"""
+
+import copyreg
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import types
+
+import lmh_tokenizer
+
+
+DEFAULT_DIRECTORY = ".lmhcache"
+
+# if one of these files changes, the cached harvests are outdated
+SOURCES = ["lmh_harvest.py", "lmh_records.py", "lmh_tokenizer.py", "lmh_lexer.py", "lmh_source.py", "lmh_cache.py"]
+
+def get_version():
+    """ returns a hash of the harvesting code and the tokenizer backend """
+    h = hashlib.sha1(lmh_tokenizer.get_tokenizer.backend.encode("utf-8"))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for source in SOURCES:
+        with open(os.path.join(directory, source), "rb") as fp:
+            h.update(fp.read())
+    return h.hexdigest()
+
+def get_default_cache():
+    """ returns a HarvestCache for the directory in $LMH_CACHE (or None if it isn't set) """
+    directory = os.environ.get("LMH_CACHE")
+    return HarvestCache(directory) if directory else None
+
+
+def record_harvest(string, ctx, harvest):
+    """
+    harvests the string (with harvest(string)) and returns an entry with the records that were added
+    and the messages that were logged, which can be replayed later (see replay_harvest).
+    A recording that is already going on is suspended in the meantime.
+    """
+    outer = (ctx.gatherer.added, ctx.logged)
+    records = []
+    logs = []
+    ctx.gatherer.added = records
+    ctx.logged = logs
+    try:
+        harvest(string)
+    finally:
+        (ctx.gatherer.added, ctx.logged) = outer
+    return {
+        "records" : records,
+        "logs" : logs,
+        "final" : (ctx.mod_name, ctx.mod_type, ctx.lang),
+    }
+
+def replay_harvest(entry, ctx):
+    """ adds the records of an entry (see record_harvest) and logs its messages again """
+    for (kind, record) in entry["records"]:
+        ctx.gatherer.add(kind, ctx.gatherer.intern_record(record))
+    replay_logs(entry, ctx)
+
+def replay_logs(entry, ctx):
+    """ logs the messages of an entry again and restores the state of ctx after the harvest """
+    for (positions, args) in entry["logs"]:
+        ctx.positions = positions
+        ctx.log(*args)
+    (ctx.mod_name, ctx.mod_type, ctx.lang) = entry["final"]
+
+
+def _make_params(entries):
+    return types.MappingProxyType(entries)
+
+class CachePickler(pickle.Pickler):
+    """ A pickler that can store the (read-only) parameter dictionaries of records """
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[types.MappingProxyType] = lambda params : (_make_params, (dict(params),))
+
+
+class HarvestCache(object):
+    """ Caches the harvest of files in a directory (one pickle file per harvested file) """
+    def __init__(self, directory = DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.version = get_version()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry_path(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".pickle")
+
+    def load(self, entry_path):
+        try:
+            with open(entry_path, "rb") as fp:
+                return pickle.load(fp)
+        except Exception:   # missing or broken entries are just misses
+            return None
+
+    def store(self, entry_path, entry):
+        directory = os.path.dirname(entry_path)
+        os.makedirs(directory, exist_ok = True)
+        (fd, tmp_path) = tempfile.mkstemp(dir = directory)
+        with os.fdopen(fd, "wb") as fp:
+            CachePickler(fp, pickle.HIGHEST_PROTOCOL).dump(entry)
+        os.replace(tmp_path, entry_path)
+
+    def harvest_file(self, path, ctx, harvest, read=None):
+        """
+        harvest(string) harvests the content of the file at path (using ctx).
+        If the file is in the cache, the records and log messages from the cache are replayed instead.
+        If read is given, it returns the content of the file (or None if it can't be read).
+        """
+        stat = os.stat(path)
+        entry_path = self.get_entry_path(path)
+        entry = self.load(entry_path)
+        # the harvest of a file also depends on the context
+        state = (self.version, path, ctx.mathhub_path, ctx.repo, ctx.lang)
+        if entry != None and entry["state"] != state:
+            entry = None
+
+        if entry != None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            self.replay(entry, ctx)
+            return
+
+        if read != None:
+            string = read()
+            if string == None:
+                return
+        else:
+            with open(path, "r") as fp:
+                string = fp.read()
+        content_hash = hashlib.sha1(string.encode("utf-8", "surrogateescape")).hexdigest()
+        if entry != None and entry["hash"] == content_hash:
+            self.replay(entry, ctx)
+        else:
+            self.misses += 1
+            entry = record_harvest(string, ctx, harvest)
+            entry["state"] = state
+            entry["hash"] = content_hash
+
+        # files that were modified just now could be modified again without changing the mtime,
+        # so the content is checked again next time
+        entry["mtime"] = stat.st_mtime_ns if time.time_ns() - stat.st_mtime_ns > 2 * 10**9 else None
+        entry["size"] = stat.st_size
+        self.store(entry_path, entry)
+
+    def replay(self, entry, ctx):
+        self.hits += 1
+        replay_harvest(entry, ctx)
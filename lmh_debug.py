@@ -10,7 +10,12 @@ The verbosity level changes what kind of errors are displayed.
 """
 
 import os
+import lmh_cache
+import lmh_incremental
 import lmh_harvest as harvest
+import lmh_snapshot
+import lmh_sqlite
+import lmh_tokenizer
 
 class EmacsLogger(object):
     def __init__(self, verbosity, path):
@@ -59,14 +64,14 @@ def check_data(gatherer, verbosity, logger):
     """
 
     # partition data for efficient look-up
-    repo_part = partition(gatherer.repos, lambda e : e["repo"])
-    sigf_part = partition(gatherer.sigfiles, lambda e : (e["repo"], e["mod_name"]))
-    langf_part = partition(gatherer.langfiles, lambda e : (e["repo"], e["mod_name"], e["lang"]))
-    symi_part = partition(gatherer.symis, lambda e : (e["repo"], e["mod_name"], e["name"]))
-    defi_part = partition(gatherer.defis, lambda e : (e["repo"], e["mod_name"], e["name"], e["lang"]))
+    repo_part = gatherer.index("repos", "repo")
+    sigf_part = gatherer.index("sigfiles", "repo", "mod_name")
+    langf_part = gatherer.index("langfiles", "repo", "mod_name", "lang")
+    symi_part = gatherer.index("symis", "repo", "mod_name", "name")
+    defi_part = gatherer.index("defis", "repo", "mod_name", "name", "lang")
 
-    symi_part2 = partition(gatherer.symis, lambda e : (e["repo"], e["mod_name"]))
-    sigf_part2 = partition(gatherer.sigfiles, lambda e : e["repo"])
+    symi_part2 = gatherer.index("symis", "repo", "mod_name")
+    sigf_part2 = gatherer.index("sigfiles", "repo")
 
 
     # Check that for every language file there is a corresponding signature file
@@ -169,9 +174,9 @@ def check_data(gatherer, verbosity, logger):
 
 
 def check_mvx(gatherer, logger):
-    langf_part = partition(gatherer.langfiles, lambda e : (e["repo"], e["mod_name"], e["lang"]))
-    symi_part = partition(gatherer.symis, lambda e : (e["repo"], e["mod_name"]))
-    defi_part = partition(gatherer.defis, lambda e : (e["repo"], e["mod_name"], e["name"], e["lang"]))
+    langf_part = gatherer.index("langfiles", "repo", "mod_name", "lang")
+    symi_part = gatherer.index("symis", "repo", "mod_name")
+    defi_part = gatherer.index("defis", "repo", "mod_name", "name", "lang")
 
     for langfk in langf_part:
         if (langfk[0], langfk[1]) not in symi_part:  # no symbols introduced
@@ -184,10 +189,10 @@ def check_mvx(gatherer, logger):
                     filepath=langf['path'])
 
 def check_mvlang(gatherer, lang, logger):
-    sigf_part = partition(gatherer.sigfiles, lambda e : (e["repo"], e["mod_name"]))
-    langf_part = partition(gatherer.langfiles, lambda e : (e["repo"], e["mod_name"], e["lang"]))
-    symi_part = partition(gatherer.symis, lambda e : (e["repo"], e["mod_name"]))
-    defi_part = partition(gatherer.defis, lambda e : (e["repo"], e["mod_name"], e["name"], e["lang"]))
+    sigf_part = gatherer.index("sigfiles", "repo", "mod_name")
+    langf_part = gatherer.index("langfiles", "repo", "mod_name", "lang")
+    symi_part = gatherer.index("symis", "repo", "mod_name")
+    defi_part = gatherer.index("defis", "repo", "mod_name", "name", "lang")
 
     for (repo, modname) in symi_part:
         if (repo, modname, lang) not in langf_part:
@@ -207,8 +212,8 @@ def check_mvlang(gatherer, lang, logger):
             covered.append(symi["name"])
 
 def check_ma(gatherer, logger):
-    sigf_part = partition(gatherer.sigfiles, lambda e : e["repo"])
-    symi_part = partition(gatherer.symis, lambda e : (e["repo"], e["mod_name"]))
+    sigf_part = gatherer.index("sigfiles", "repo")
+    symi_part = gatherer.index("symis", "repo", "mod_name")
     for repo in gatherer.repos:
         if not repo["namespace"]:
             logger.log(f"Repository '{repo['repo']}' has no namespace set in preamble")
@@ -236,10 +241,26 @@ if __name__ == "__main__":
     parser.add_argument("-mv", "--missing-verbalizations", type=str, metavar="LANG", nargs="*", help="show missing verbalizations for these languages(e.g. en de all)")
     parser.add_argument("-im", "--incomplete-mhmodnl", action="store_true", help="show verbalizations missing in existing mhmodnls")
     parser.add_argument("-e", "--emacs", action="store_true")
-    parser.add_argument("DIRECTORY", nargs="+", help="git repo or higher level directory which is debugged")
+    parser.add_argument("-t", "--tokenizer", choices=lmh_tokenizer.BACKENDS,
+            help="the tokenizer backend (default: regex, or the value of $LMH_TOKENIZER)")
+    parser.add_argument("-C", "--cache", metavar="DIR",
+            help="cache the harvest of files in DIR (e.g. .lmhcache; default: the value of $LMH_CACHE)")
+    parser.add_argument("-I", "--incremental", metavar="DIR",
+            help="only harvest the files of git repos that have changed since the last run with the same DIR (e.g. .lmhstate)")
+    parser.add_argument("-D", "--database", metavar="FILE",
+            help="store the harvested data in the SQLite database FILE instead of in memory")
+    parser.add_argument("-S", "--snapshot", metavar="FILE",
+            help="load the data from a snapshot (see lmh_harvest.py --snapshot) instead of harvesting it")
+    harvest.add_jobs_argument(parser)
+    harvest.add_dedup_argument(parser)
+    parser.add_argument("DIRECTORY", nargs="*", help="git repo or higher level directory which is debugged")
     args = parser.parse_args()
+    if not args.DIRECTORY and not args.snapshot:
+        parser.error("a DIRECTORY or a --snapshot is required")
 
     verbosity = args.verbosity
+    if args.tokenizer:
+        lmh_tokenizer.set_backend(args.tokenizer)
 
     if args.emacs:
         import datetime
@@ -249,10 +270,29 @@ if __name__ == "__main__":
         logger = harvest.SimpleLogger(verbosity)
 
     logger.log("GATHERING DATA\n", minverbosity=2)
-    mathhub_dir = harvest.get_mathhub_dir(args.DIRECTORY[0])
-    ctx = harvest.HarvestContext(logger, harvest.DataGatherer(), mathhub_dir)
+    if args.snapshot and not args.DIRECTORY and not args.database:
+        # nothing is added to the data, so a binary snapshot can be used without copying it
+        (gatherer, mathhub_dir) = lmh_snapshot.open_snapshot(args.snapshot)
+    else:
+        gatherer = lmh_sqlite.SqliteGatherer(args.database) if args.database \
+                   else harvest.DataGatherer(indexes=harvest.DataGatherer.INDEXES)
+        if args.snapshot:
+            mathhub_dir = lmh_snapshot.load_snapshot(args.snapshot, gatherer)
+        else:
+            mathhub_dir = harvest.get_mathhub_dir(args.DIRECTORY[0])
+    ctx = harvest.HarvestContext(logger, gatherer, mathhub_dir)
+    if args.cache:
+        ctx.cache = lmh_cache.HarvestCache(args.cache)
+    if args.incremental:
+        ctx.incremental = lmh_incremental.IncrementalHarvest(args.incremental)
+    ctx.jobs = args.jobs
+    if args.dedup:
+        ctx.dedup = harvest.FileDeduplicator()
     for directory in args.DIRECTORY:
         harvest.gather_data_for_all_repos(directory, ctx)
+    if args.database:
+        gatherer.commit()   # the records are only committed when the next repo starts
+    harvest.log_statistics(logger, ctx.cache, ctx.dedup, ctx.incremental, ctx.suppressed)
 
     logger.log("\n\nCHECKING DATA\n", minverbosity=2)
     check_data(ctx.gatherer, verbosity, logger)
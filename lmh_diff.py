@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""
+Compares two snapshots of harvested data (see lmh_harvest.py --snapshot),
+e.g. of two nightly harvests.
+
+The records of both snapshots are grouped by their identity (IDENTITY_KEYS),
+e.g. defis by (repo, mod_name, name, lang), which takes linear time.
+The repo in an identity is qualified with its group (e.g. smglom/sets instead of sets),
+so that repos with the same name in different groups (e.g. forks) are not mixed up.
+Identities that only occur in the new snapshot are added, the ones that only occur
+in the old snapshot are removed, and the others are changed if their records differ
+(ignoring the positions in the files, which change with every edit).
+Additionally, trefis that refer to a symbol that doesn't exist (anymore) are reported
+if they weren't broken in the old snapshot already.
+"""
+
+import collections
+import collections.abc
+import os
+
+import lmh_records
+import lmh_snapshot
+
+
+# the fields that identify a record of a kind
+IDENTITY_KEYS = {
+    "repos" : ("repo",),
+    "sigfiles" : ("repo", "mod_name"),
+    "modules" : ("repo", "mod_name"),
+    "langfiles" : ("repo", "mod_name", "lang"),
+    "defis" : ("repo", "mod_name", "name", "lang"),
+    "symis" : ("repo", "mod_name", "name"),
+    "trefis" : ("repo", "path", "target_mod", "name"),
+    "importmhmodules" : ("repo", "path", "dest_repo", "dest_path"),
+    "mhinputrefs" : ("repo", "path", "dest_repo", "dest_path"),
+    "textfiles" : ("repo", "path"),
+    "gimports" : ("repo", "path", "dest_repo", "dest_mod"),
+}
+
+# fields that are not compared
+IGNORED_FIELDS = ["pos"]
+
+# kinds whose identity contains the repo qualified with its group (see Snapshot.get_qualified_repos)
+QUALIFIED_KINDS = ["repos", "sigfiles", "modules", "langfiles", "defis", "symis"]
+
+# fields that can contain absolute paths (which are made relative to the MathHub directory)
+PATH_FIELDS = ["path", "dest_repo", "dest_path"]
+
+
+class Snapshot(object):
+    """ The records of a snapshot file grouped by kind """
+    def __init__(self, path):
+        (gatherer, self.mathhub_dir) = lmh_snapshot.open_snapshot(path)
+        self.records = {kind : getattr(gatherer, kind) for kind in lmh_records.RECORD_TYPES}
+
+    def get_value(self, record, field):
+        """ returns a hashable value of a field (paths are relative to the MathHub directory) """
+        value = record[field]
+        if field in PATH_FIELDS and value != None and self.mathhub_dir != None \
+                and value.startswith(self.mathhub_dir + os.sep):
+            return os.path.relpath(value, self.mathhub_dir)
+        if isinstance(value, collections.abc.Mapping):
+            return tuple(sorted(value.items()))
+        if isinstance(value, list):
+            return tuple(value)
+        return value
+
+    def get_qualified_repo(self, record):
+        """ the repo of a record with a path, qualified with its group (e.g. smglom/sets),
+            i.e. the path relative to the MathHub directory up to "source" """
+        parts = self.get_value(record, "path").split(os.sep)
+        if "source" not in parts:
+            return record["repo"]
+        return "/".join(parts[:parts.index("source")])
+
+    def get_qualified_repos(self, kind):
+        """ returns the qualified repos of the records of a kind (in the same order).
+            Repo records don't have a path, so they get the qualified repos of the other records with their name:
+            a repo record whose namespace ends with a qualified repo gets that one, the others get the remaining ones in order. """
+        if kind != "repos":
+            return [self.get_qualified_repo(record) for record in self.records[kind]]
+        candidates = {}     # repo name -> set of qualified repos
+        for other in QUALIFIED_KINDS[1:]:
+            for record in self.records[other]:
+                candidates.setdefault(record["repo"], set()).add(self.get_qualified_repo(record))
+        remaining = {name : sorted(repos) for (name, repos) in candidates.items()}
+        result = [None] * len(self.records["repos"])
+        for (i, record) in enumerate(self.records["repos"]):
+            for repo in remaining.get(record["repo"], []):
+                if (record["namespace"] or "").endswith("/" + repo):
+                    result[i] = repo
+                    remaining[record["repo"]].remove(repo)
+                    break
+        for (i, record) in enumerate(self.records["repos"]):
+            if result[i] == None:
+                repos = remaining.get(record["repo"])
+                # without other records (or with more repo records than qualified repos), the name is used
+                result[i] = repos.pop(0) if repos else record["repo"]
+        return result
+
+    def group(self, kind):
+        """ returns { identity : Counter of the contents of the records with that identity } """
+        key_fields = IDENTITY_KEYS[kind]
+        content_fields = get_content_fields(kind)
+        qualified_repos = self.get_qualified_repos(kind) if kind in QUALIFIED_KINDS else None
+        groups = {}
+        for (i, record) in enumerate(self.records[kind]):
+            key = tuple(qualified_repos[i] if qualified_repos != None and field == "repo" else self.get_value(record, field)
+                        for field in key_fields)
+            content = tuple(self.get_value(record, field) for field in content_fields)
+            if key not in groups:
+                groups[key] = collections.Counter()
+            groups[key][content] += 1
+        return groups
+
+    def get_broken_trefis(self):
+        """ returns the identities of the trefis whose target symbol doesn't exist """
+        symbols = set((symi["mod_name"], symi["name"]) for symi in self.records["symis"])
+        return [tuple(self.get_value(trefi, field) for field in IDENTITY_KEYS["trefis"])
+                    for trefi in self.records["trefis"]
+                    if trefi["name"] != None and (trefi["target_mod"], trefi["name"]) not in symbols]
+
+def get_content_fields(kind):
+    return [field for field in lmh_records.RECORD_TYPES[kind].__slots__
+                if field not in IDENTITY_KEYS[kind] and field not in IGNORED_FIELDS]
+
+
+class KindDiff(object):
+    """ The differences between the records of a kind in two snapshots """
+    def __init__(self, kind, old, new):
+        self.kind = kind
+        self.content_fields = get_content_fields(kind)
+        old_groups = old.group(kind)
+        new_groups = new.group(kind)
+        self.added = [key for key in new_groups if key not in old_groups]
+        self.removed = [key for key in old_groups if key not in new_groups]
+        self.changed = []   # (key, contents only in old, contents only in new)
+        for key in old_groups:
+            if key in new_groups and old_groups[key] != new_groups[key]:
+                self.changed.append((key, list((old_groups[key] - new_groups[key]).elements()),
+                                          list((new_groups[key] - old_groups[key]).elements())))
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.changed)
+
+    def format_content(self, content):
+        return " ".join(f"{field}={value!r}" for (field, value) in zip(self.content_fields, content))
+
+    def print(self, summary_only):
+        print(f"{self.kind}: {len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed")
+        if summary_only:
+            return
+        for key in self.added:
+            print(f"    + {format_key(key)}")
+        for key in self.removed:
+            print(f"    - {format_key(key)}")
+        for (key, old_contents, new_contents) in self.changed:
+            print(f"    ~ {format_key(key)}")
+            for content in old_contents:
+                print(f"        - {self.format_content(content)}")
+            for content in new_contents:
+                print(f"        + {self.format_content(content)}")
+
+def format_key(key):
+    return " ".join(str(value) for value in key)
+
+
+def diff_snapshots(old, new):
+    """ returns the KindDiffs of all kinds and the newly broken trefis """
+    diffs = [KindDiff(kind, old, new) for kind in lmh_records.RECORD_TYPES]
+    old_broken = set(old.get_broken_trefis())
+    broken = [key for key in new.get_broken_trefis() if key not in old_broken]
+    return (diffs, list(dict.fromkeys(broken)))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Script for comparing two snapshots of harvested data",
+            epilog="Example call: lmh_diff.py old.jsonl new.jsonl")
+    parser.add_argument("-s", "--summary", action="store_true", help="only print the number of differences")
+    parser.add_argument("OLD", help="the old snapshot (see lmh_harvest.py --snapshot)")
+    parser.add_argument("NEW", help="the new snapshot")
+    args = parser.parse_args()
+
+    (diffs, broken) = diff_snapshots(Snapshot(args.OLD), Snapshot(args.NEW))
+    for diff in diffs:
+        if not diff.is_empty():
+            diff.print(args.summary)
+    if broken:
+        print(f"newly broken trefis: {len(broken)}")
+        if not args.summary:
+            for key in broken:
+                print(f"    ! {format_key(key)}")
+
+    # like diff: 1 if there are differences
+    sys.exit(1 if broken or not all(diff.is_empty() for diff in diffs) else 0)
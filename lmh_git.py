@@ -0,0 +1,134 @@
+"""
+Reading the files of a repo directly from the git object storage
+(used by lmh_harvest.py if ctx.git_ref is set, e.g. with the option --ref REF),
+so that any branch or tag can be harvested without a checkout,
+including bare repositories and clones without a working tree.
+
+The tree of the ref is listed once (git ls-tree) and the files are read through
+one long-lived `git cat-file --batch` process per repo (see CatFile),
+instead of starting a git process for every file.
+"""
+
+import os
+import subprocess
+
+import lmh_source
+
+
+def run_git(repo_directory, *args):
+    """ returns the output of a git command in a repo (or None if it fails) """
+    try:
+        result = subprocess.run(["git", "-C", repo_directory] + list(args),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:     # git isn't installed
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+def get_work_tree_path(repo_directory):
+    """ the directory of the files of a repo if it were checked out (e.g. sets for a bare repo sets.git) """
+    if repo_directory.endswith(".git") and not os.path.isdir(os.path.join(repo_directory, ".git")):
+        return repo_directory[:-len(".git")]
+    return repo_directory
+
+
+class CatFile(object):
+    """ A `git cat-file --batch` process for reading the objects of a repo """
+    def __init__(self, repo_directory):
+        self.repo_directory = repo_directory
+        self.process = subprocess.Popen(["git", "-C", repo_directory, "cat-file", "--batch"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read(self, name):
+        """ returns the content of a blob (name is e.g. an object id or "REF:path"), or None if there is no such blob """
+        self.process.stdin.write(name.encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline()
+        if not header:
+            raise Exception(f"git cat-file --batch failed in {self.repo_directory}")
+        if header.endswith(b" missing\n") or header.endswith(b" ambiguous\n"):
+            return None
+        fields = header.split()
+        content = self.process.stdout.read(int(fields[2]) + 1)[:-1]     # (followed by a newline)
+        return content if fields[1] == b"blob" else None
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class GitRepoFiles(object):
+    """ The files of a repo at a git ref (like lmh_harvest.iter_repo_files for the working tree) """
+    def __init__(self, repo_directory, ref):
+        self.repo_directory = repo_directory
+        self.directory = get_work_tree_path(repo_directory)     # the paths of the files are relative to it
+        self.ref = ref
+        self.commit = None
+        self.cat_file = None    # started when the first file is read
+
+    def open(self):
+        """ resolves the ref and starts the cat-file process (if that hasn't happened yet) """
+        if self.cat_file == None:
+            commit = run_git(self.repo_directory, "rev-parse", "--verify", "-q", self.ref + "^{commit}")
+            if commit == None:
+                raise Exception(f"Failed to find the git ref {self.ref!r}")
+            self.commit = commit.decode("utf-8").strip()
+            self.cat_file = CatFile(self.repo_directory)
+
+    def close(self):
+        if self.cat_file != None:
+            self.cat_file.close()
+            self.cat_file = None
+
+    def iter_files(self):
+        """ yields (root, file_name, object id) for the files in the source directory
+            (the files of a directory before the ones in its subdirectories, like os.walk) """
+        self.open()
+        listing = run_git(self.repo_directory, "ls-tree", "-r", "-z", "--full-tree", self.commit, "--", "source")
+        if listing == None:
+            raise Exception(f"Failed to list the files of {self.commit} in {self.repo_directory}")
+        files = {}      # directory -> [(file name, object id)]
+        subdirs = {}    # directory -> [subdirectory]
+        def add_directory(directory):
+            if directory not in files:
+                files[directory] = []
+                subdirs[directory] = []
+                if "/" in directory:
+                    parent = directory.rsplit("/", 1)[0]
+                    add_directory(parent)
+                    subdirs[parent].append(directory)
+
+        for item in listing.split(b"\0"):
+            if not item:
+                continue
+            (info, path) = item.split(b"\t", 1)
+            (mode, type_, object_id) = info.split()
+            if type_ != b"blob" or mode == b"120000":   # submodules and symbolic links are skipped
+                continue
+            path = os.fsdecode(path)
+            if "/" not in path:         # source isn't a directory
+                continue
+            (directory, file_name) = path.rsplit("/", 1)
+            add_directory(directory)
+            files[directory].append((file_name, object_id.decode("ascii")))
+
+        def walk(directory):
+            root = os.path.join(self.directory, *directory.split("/"))
+            for (file_name, object_id) in files[directory]:
+                yield (root, file_name, object_id)
+            for subdir in subdirs[directory]:
+                yield from walk(subdir)
+        if "source" in files:
+            yield from walk("source")
+
+    def read_blob(self, object_id):
+        """ returns the content (bytes) of a file from iter_files """
+        return self.cat_file.read(object_id)
+
+    def read_file(self, path):
+        """ returns the content of a file in the repo (e.g. lib/preamble.tex), or None if it doesn't exist """
+        self.open()
+        content = self.cat_file.read(f"{self.commit}:{path}")
+        return lmh_source.decode_content(content) if content != None else None
@@ -17,73 +17,101 @@ Note that the LaTeX is not parsed properly - instead, regular expressions are
 used, which come with their natural limitiations.
 """
 
+import collections
+import hashlib
+import itertools
+import operator
 import os
 import re
+import sys
 import traceback
 
+import lmh_cache
+import lmh_records
+import lmh_repos
+import lmh_source
+import lmh_tokenizer
+
 def parse(string, regexes):
     """
     Assumes that regexes is a list of pairs (regex, token_type).
     Returns tokens from a string as pairs (match, token_type),
     sorted according to the match start.
+    The tokens are found in a single pass (see lmh_tokenizer.py).
     """
-    tokens = []
-    for (regex, token_type) in regexes:
-        tokens += [(match, token_type) for match in re.finditer(regex, string)]
-    return sorted(tokens, key = lambda e : e[0].start())
+    return lmh_tokenizer.tokenize(string, regexes)
 
-def get_params(param_str):
-    """ returns dictionary of comma-separated key=value pairs """
-    if param_str == None:
-        return { }
+def iter_parse(string, regexes):
+    """ Like parse, but the tokens are found lazily while they are consumed """
+    return lmh_tokenizer.iter_tokens(string, regexes)
+
+def peek_tokens(tokens):
+    """ returns None if the token iterator is empty, and an equivalent iterator otherwise """
+    first = next(tokens, None)
+    if first == None:
+        return None
+    return itertools.chain([first], tokens)
+
+def log_statistics(logger, cache=None, dedup=None, incremental=None, suppressed=None):
+    """ logs how many regex scans were skipped because the anchors of the regexes didn't occur,
+        how many parameter strings were found in the get_params cache,
+        how many files were found in the harvest cache (if one is given),
+        how many files weren't harvested again because of identical files (if a FileDeduplicator is given),
+        how many files were unchanged since the last incremental harvest (if an IncrementalHarvest is given)
+        and how many messages were below the verbosity (on stderr, if HarvestContext.suppressed is given) """
+    stats = lmh_tokenizer.tokenize.statistics
+    logger.log(f"Tokenized {stats['strings']} strings: {stats['scans']} regex scans, "
+               f"{stats['skipped scans']} skipped (anchor not found)", minverbosity=3)
+    info = lmh_source.get_params.cache_info()
+    workers = lmh_source.get_params.other_processes
+    logger.log(f"Parsed parameters: {info.hits + workers['hits']} cache hits, "
+               f"{info.misses + workers['misses']} misses", minverbosity=3)
+    if cache != None:
+        logger.log(f"Harvested files: {cache.hits} from the cache ({cache.directory}), {cache.misses} not", minverbosity=3)
+    if dedup != None:
+        logger.log(f"Deduplicated files: {dedup.hits} identical to an earlier file "
+                   f"({dedup.saved} characters not harvested again)", minverbosity=3)
+    if incremental != None:
+        logger.log(f"Incremental harvest: {incremental.reused} files unchanged, {incremental.harvested} harvested again",
+                   minverbosity=3)
+    if suppressed and logger.verbosity >= 1:
+        # (shown from verbosity 1 on, so that it is clear that more messages can be shown,
+        # but on stderr, so that it isn't mixed with the data on stdout)
+        counts = ", ".join(f"{suppressed[level]} of verbosity {level}" for level in sorted(suppressed))
+        print(f"Suppressed messages: {sum(suppressed.values())} below the verbosity ({counts})", file=sys.stderr)
 
-    return {
-            param.group("key") : param.group("val")
-                for param in re.finditer(get_params.re_param, param_str)
-        }
+def get_params(param_str):
+    """ returns a (read-only) dictionary of comma-separated key=value pairs
+        (the results are cached, see lmh_source.get_params) """
+    return lmh_source.get_params(param_str)
 
-get_params.re_param = re.compile(
-        r"(?P<key>[a-zA-Z0-9_-]+)"
-        r"(?:=(?P<val>(?:[^\{\},]+)|(?:\{[^\{\}]+\})))?")
 
+def get_position_index(string):
+    """ returns a PositionIndex for the string (the index for the last string is cached) """
+    if get_position_index.cached_string != string:
+        get_position_index.cached_string = string
+        get_position_index.cached_index = lmh_source.PositionIndex(string)
+    return get_position_index.cached_index
+get_position_index.cached_string = ""
+get_position_index.cached_index = lmh_source.PositionIndex("")
 
 def get_file_position(string, offset):
     """ can be used to get linenumber and character offset for a string offset """
-    if get_file_position.cached_string == string:
-        return get_file_position.cached_positions[offset]
-    get_file_position.cached_string = string
-    get_file_position.cached_positions = []
-    linenumber = 1
-    charnumber = 1
-    for c in string:
-        get_file_position.cached_positions.append((linenumber, charnumber))
-        if c == "\n":
-            linenumber += 1
-            charnumber = 1
-        else:
-            charnumber += 1
-    return get_file_position.cached_positions[offset]
-get_file_position.cached_string = ""
-get_file_position.cached_positions = []
+    return get_position_index(string).get_position(offset)
 
 def get_file_pos_str(string, offset):
     (line, char) = get_file_position(string, offset)
     return f"{line}:{char}"
 
 def pos_str_to_int_tuple(offset_string):
+    """ parses a "line:col" string (records provide get_position() instead) """
     l = offset_string.split(":")
     assert len(l) == 2
     return (int(l[0]), int(l[1]))
 
 def preprocess_string(string):
-    """ removes comment lines, but keeps linebreaks to maintain line numbers
-        TODO: Implement this in a cleaner way!
-    """
-    s = re.sub("(^|\n)[\t ]*\%[^\n]*\n", "\\1\n", string)
-    while s != string:
-        string = s
-        s = re.sub("(^|\n)[\t ]*\%[^\n]*\n", "\\1\n", string)
-    return string
+    """ removes comment lines, but keeps linebreaks to maintain line numbers """
+    return lmh_source.strip_comment_lines(string)
 
 def exception_to_string(excp):
     """ from stackoverflow """
@@ -131,14 +159,43 @@ class HarvestContext(object):
         self.file = None
         self.mathhub_path = mathhub_path
 
-    def log(self, message, minverbosity=1, offsetstr=None, forfile = True):
+        self.positions = None       # PositionIndex of the current file content
+        self.suppressed = {}        # minimal verbosity -> number of messages that were below the verbosity
+
+        self.cache = lmh_cache.get_default_cache()  # HarvestCache (or None)
+        self.dedup = None           # FileDeduplicator that reuses the harvest of identical files (e.g. with --dedup)
+        self.logged = None          # if it is a list, log calls are recorded in it (for the cache)
+        self.defer_logs = False     # if set, log calls are only recorded (and logged when they are replayed)
+        self.jobs = 1               # number of processes that harvest files (see lmh_parallel.py)
+        self.inventory = None       # RepoInventory of the repos that were found (see get_repo_inventory)
+        self.incremental = None     # IncrementalHarvest of git repos (see lmh_incremental.py)
+        self.git_ref = None         # if set, the files are read from this git ref (see lmh_git.py)
+
+    def log(self, message, minverbosity=1, offsetstr=None, forfile = True, pos=None, args=()):
+        """ If args are given, the message is a template for str.format.
+            pos is an offset in the current file content (an alternative to offsetstr).
+            The message is only formatted and pos only converted to "line:col"
+            if the verbosity is high enough. Otherwise, the message is counted in self.suppressed. """
+        if self.logged != None:
+            self.logged.append((self.positions if pos != None else None,
+                                (message, minverbosity, offsetstr, forfile, pos, args)))
+            if self.defer_logs:
+                return
+        if self.logger.verbosity < minverbosity:
+            self.suppressed[minverbosity] = self.suppressed.get(minverbosity, 0) + 1
+            return
+        if args:
+            message = message.format(*args)
+        if pos != None and offsetstr == None:
+            offsetstr = self.positions.get_pos_str(pos)
         self.logger.log(message, minverbosity,
                         filepath=self.file if forfile else None,
                         offset=offsetstr)
 
+
 class DataGatherer(object):
     """ The DataGatherer collects all the data from the files """
-    def __init__(self):
+    def __init__(self, indexes = None):
         self.defis = []
         self.trefis = []
         self.symis = []
@@ -151,131 +208,243 @@ class DataGatherer(object):
         self.importmhmodules = []  # also contains usemhmodules!
         self.mhinputrefs = []      # also contains inputs!
 
+        # the same repos, paths, module names, ... occur in many records,
+        # so only one instance of each string is kept (see intern)
+        self.symbols = {}
+
+        self.added = None           # if it is a list, added records are recorded in it (for the cache)
+
+        # indexes (see index), which are updated when records are added
+        self.indexes = {}           # (kind, fields) -> { key : [record, ...] }
+        self.kind_indexes = {}      # kind -> [(key function, index), ...]
+        if indexes != None:         # the indexes that are maintained from the start (e.g. DataGatherer.INDEXES)
+            for kind in indexes:
+                for fields in indexes[kind]:
+                    self.create_index(kind, fields)
+
+    # the indexes that lmh_debug and lmh_stats maintain from the start (DataGatherer(indexes=DataGatherer.INDEXES))
+    INDEXES = {
+        "repos" : [("repo",)],
+        "sigfiles" : [("repo",), ("repo", "mod_name")],
+        "langfiles" : [("repo",), ("repo", "mod_name", "lang")],
+        "symis" : [("repo",), ("repo", "mod_name"), ("repo", "mod_name", "name")],
+        "defis" : [("lang",), ("repo", "lang"), ("repo", "mod_name", "name", "lang")],
+        "trefis" : [("repo",)],
+    }
+
+    def create_index(self, kind, fields):
+        """ creates an index of the records of a kind by the values of the fields (see index) """
+        index = {}
+        get_key = operator.attrgetter(*fields)
+        for record in getattr(self, kind):
+            key = get_key(record)
+            if key in index:
+                index[key].append(record)
+            else:
+                index[key] = [record]
+        self.indexes[(kind, fields)] = index
+        if kind not in self.kind_indexes:
+            self.kind_indexes[kind] = []
+        self.kind_indexes[kind].append((get_key, index))
+        return index
+
+    def add(self, kind, record):
+        """ adds a record of a kind (e.g. "defis") and updates the indexes """
+        getattr(self, kind).append(record)
+        if self.added != None:
+            self.added.append((kind, record))
+        for (get_key, index) in self.kind_indexes.get(kind, []):
+            key = get_key(record)
+            if key in index:
+                index[key].append(record)
+            else:
+                index[key] = [record]
+
+    def index(self, kind, *fields):
+        """ returns the records of a kind partitioned by the values of the fields,
+            e.g. index("symis", "repo", "mod_name") returns { (repo, mod_name) : [symi, ...] }.
+            For a single field, the keys are the values themselves, e.g. index("trefis", "repo").
+            The index is kept up-to-date when more records are added,
+            and it must not be modified.
+            Indexes that weren't passed to the constructor are created on demand. """
+        if (kind, fields) in self.indexes:
+            return self.indexes[(kind, fields)]
+        return self.create_index(kind, fields)
+
+    def lookup(self, kind, **key):
+        """ returns the records of a kind with the given values,
+            e.g. lookup("symis", repo=repo, mod_name=mod_name) """
+        values = tuple(key.values())
+        return self.index(kind, *key).get(values if len(values) > 1 else values[0], [])
+
+    def intern(self, string):
+        """ returns the instance of string that is shared by all records """
+        if string == None:
+            return None
+        return self.symbols.setdefault(string, string)
+
+    # the fields that are interned in the push_* methods
+    INTERNED = ["repo", "path", "mod_name", "lang", "target_mod", "dest_repo", "dest_path", "dest_mod"]
+
+    interned_fields = {}    # record type -> the fields of INTERNED that it has
+
+    def intern_record(self, record):
+        """ interns the fields of a record that was created elsewhere (e.g. loaded from the cache) """
+        fields = DataGatherer.interned_fields.get(type(record))
+        if fields == None:
+            fields = [field for field in DataGatherer.INTERNED if field in record.__slots__]
+            DataGatherer.interned_fields[type(record)] = fields
+        for field in fields:
+            setattr(record, field, self.intern(getattr(record, field)))
+        return record
+
     def push_repo(self, namespace, ctx):
-        self.repos.append({
-            "repo" : ctx.repo,
-            "namespace" : namespace,
-        })
+        self.add("repos", lmh_records.RepoRecord(
+            repo = self.intern(ctx.repo),
+            namespace = namespace,
+        ))
 
     def push_sigfile(self, align, ctx):
         assert ctx.mod_type in ["modsig", "gviewsig"]
-        self.sigfiles.append({
-            "type" : ctx.mod_type,
-            "path" : ctx.file,
-            "repo" : ctx.repo,
-            "align" : align,
-            "mod_name" : ctx.mod_name,
-        })
+        self.add("sigfiles", lmh_records.SigfileRecord(
+            type = ctx.mod_type,
+            path = self.intern(ctx.file),
+            repo = self.intern(ctx.repo),
+            align = align,
+            mod_name = self.intern(ctx.mod_name),
+        ))
 
     def push_module(self, ctx):
         assert ctx.mod_type == "module"
-        self.modules.append({
-            "path" : ctx.file,
-            "repo" : ctx.repo,
-            "mod_name" : ctx.mod_name,
-        })
+        self.add("modules", lmh_records.ModuleRecord(
+            path = self.intern(ctx.file),
+            repo = self.intern(ctx.repo),
+            mod_name = self.intern(ctx.mod_name),
+        ))
 
     def push_langfile(self, ctx):
         assert ctx.mod_type in ["mhmodnl", "gviewnl"]
-        self.langfiles.append({
-            "type" : ctx.mod_type,
-            "path" : ctx.file,
-            "repo" : ctx.repo,
-            "mod_name" : ctx.mod_name,
-            "lang" : ctx.lang,
-        })
-
-    def push_defi(self, name, string, offset_str, ctx, params):
+        self.add("langfiles", lmh_records.LangfileRecord(
+            type = ctx.mod_type,
+            path = self.intern(ctx.file),
+            repo = self.intern(ctx.repo),
+            mod_name = self.intern(ctx.mod_name),
+            lang = self.intern(ctx.lang),
+        ))
+
+    def push_defi(self, name, string, pos, ctx, params):
         assert ctx.mod_type in ["mhmodnl", "module"]
-        entry = {
-                "mod_name" : ctx.mod_name,
-                "repo" : ctx.repo,
-                "lang" : ctx.lang,
-                "name" : name,
-                "string" : string,
-                "offset" : offset_str,
-                "path" : ctx.file,
-                "params" : params,
-            }
-        self.defis.append(entry)
-
-    def push_symi(self, name, offset_str, type_, noverb, align, ctx, params, implicit=False):
+        entry = lmh_records.DefiRecord(ctx.positions,
+                mod_name = self.intern(ctx.mod_name),
+                repo = self.intern(ctx.repo),
+                lang = self.intern(ctx.lang),
+                name = name,
+                string = string,
+                pos = pos,
+                path = self.intern(ctx.file),
+                params = params,
+            )
+        self.add("defis", entry)
+
+    def push_symi(self, name, pos, type_, noverb, align, ctx, params, implicit=False):
         assert ctx.mod_type in ["modsig", "module"]
         assert type_ in ["symi", "symdef"]
-        entry = {
-                "mod_name" : ctx.mod_name,
-                "repo" : ctx.repo,
-                "name" : name,
-                "offset" : offset_str,
-                "path" : ctx.file,
-                "type" : type_,
-                "noverb" : noverb,
-                "align" : align,
-                "params" : params,
-                "implicit" : implicit,
-            }
-        self.symis.append(entry)
-
-    def push_trefi(self, name, targetmodule, isdrefi, offset_str, ctx):
-        self.trefis.append(
-            {
-                "mod_name" : ctx.mod_name,
-                "mod_type" : ctx.mod_type,
-                "repo" : ctx.repo,
-                "offset" : offset_str,
-                "lang" : ctx.lang,
-                "path" : ctx.file,
-                "name" : name,
-                "target_mod" : (targetmodule if targetmodule else ctx.mod_name),
-                "drefi" : isdrefi,
-            }
+        entry = lmh_records.SymiRecord(ctx.positions,
+                mod_name = self.intern(ctx.mod_name),
+                repo = self.intern(ctx.repo),
+                name = name,
+                pos = pos,
+                path = self.intern(ctx.file),
+                type = type_,
+                noverb = noverb,
+                align = align,
+                params = params,
+                implicit = implicit,
+            )
+        self.add("symis", entry)
+
+    def push_trefi(self, name, targetmodule, isdrefi, pos, ctx):
+        self.add("trefis", lmh_records.TrefiRecord(ctx.positions,
+                mod_name = self.intern(ctx.mod_name),
+                mod_type = ctx.mod_type,
+                repo = self.intern(ctx.repo),
+                pos = pos,
+                lang = self.intern(ctx.lang),
+                path = self.intern(ctx.file),
+                name = name,
+                target_mod = self.intern(targetmodule if targetmodule else ctx.mod_name),
+                drefi = isdrefi,
+            )
         )
 
     def push_importmhmodule(self, repo, file_, type_, ctx):  # also for usemhmodule
-        self.importmhmodules.append(
-            {
-                "mod_name" : ctx.mod_name,  # can be None
-                "repo" : ctx.repo,
-                "path" : ctx.file,
-                "type" : type_,    # "usemhmodule" or "importmhmodule"
-                "dest_repo" : repo,
-                "dest_path" : file_,
-            }
+        self.add("importmhmodules",
+            lmh_records.ImportmhmoduleRecord(
+                mod_name = self.intern(ctx.mod_name),  # can be None
+                repo = self.intern(ctx.repo),
+                path = self.intern(ctx.file),
+                type = type_,    # "usemhmodule" or "importmhmodule"
+                dest_repo = self.intern(repo),
+                dest_path = self.intern(file_),
+            )
         )
 
     def push_mhinputref(self, repo, file_, ctx):  # also for input
-        self.mhinputrefs.append(
-            {
-                "mod_name" : ctx.mod_name,  # can be None
-                "repo" : ctx.repo,
-                "path" : ctx.file,
-                "dest_repo" : repo,
-                "dest_path" : file_,
-            }
+        self.add("mhinputrefs",
+            lmh_records.MhinputrefRecord(
+                mod_name = self.intern(ctx.mod_name),  # can be None
+                repo = self.intern(ctx.repo),
+                path = self.intern(ctx.file),
+                dest_repo = self.intern(repo),
+                dest_path = self.intern(file_),
+            )
         )
 
     def push_textfile(self, ctx):
-        self.textfiles.append(
-            {
-                "repo" : ctx.repo,
-                "path" : ctx.file,
-            }
+        self.add("textfiles",
+            lmh_records.TextfileRecord(
+                repo = self.intern(ctx.repo),
+                path = self.intern(ctx.file),
+            )
         )
 
     def push_gimport(self, repo, mod_name, type_, ctx):  # also for guses
-        self.gimports.append(
-            {
-                "mod_name" : ctx.mod_name,
-                "mod_type" : ctx.mod_type,
-                "repo" : ctx.repo,
-                "path" : ctx.file,
-                "type" : type_,     # "guse" or "gimport"
-                "dest_repo" : repo,
-                "dest_mod" : mod_name,
-            }
+        self.add("gimports",
+            lmh_records.GimportRecord(
+                mod_name = self.intern(ctx.mod_name),
+                mod_type = ctx.mod_type,
+                repo = self.intern(ctx.repo),
+                path = self.intern(ctx.file),
+                type = type_,     # "guse" or "gimport"
+                dest_repo = self.intern(repo),
+                dest_mod = self.intern(mod_name),
+            )
         )
 
 
+class StreamingGatherer(DataGatherer):
+    """
+    A DataGatherer that doesn't keep the records (the record lists and indexes stay empty).
+    Instead, the records that were added since the last call of take_records are returned by it
+    (see iter_records), so that records can be processed with constant memory.
+    """
+    def __init__(self):
+        DataGatherer.__init__(self)
+        self.pending = []           # (kind, record) pairs that haven't been taken yet
+
+    def add(self, kind, record):
+        self.pending.append((kind, record))
+        if self.added != None:
+            self.added.append((kind, record))
+
+    def take_records(self):
+        """ returns the (kind, record) pairs that were added since the last call """
+        records = self.pending
+        self.pending = []
+        # the strings are only shared by the records of the same file
+        self.symbols = {}
+        return records
+
 
 TOKEN_BEGIN_MHMODNL  = 0
 TOKEN_END_MHMODNL    = 1
@@ -309,6 +478,7 @@ re_end_mhmodnl = re.compile(
         r"\\end\s*\{mhmodnl\}"
         )
 
+# when tokenizing, arguments are read by lmh_tokenizer.scan_arg instead (which supports nested braces)
 re_arg = r"(?:[^\{\}\$]|(?:\$[^\$]+\$)|(\{[^\{\}\$]*\}))+"
 
 re_def = re.compile(
@@ -485,14 +655,15 @@ def get_args(match, is_symi, string, ctx):
 
     arity = {"i" : 1, "ii" : 2, "iii" : 3, "iv" : 4}[match.group("arity")]
     if len(args) != arity:
-        ctx.log(f"Arity mismatch (needs {one_plus}{arity} arguments, but found {one_plus}{len(args)}): '{match.group(0)}'",
-                2, get_file_pos_str(string, match.start()))
+        ctx.log("Arity mismatch (needs {0}{1} arguments, but found {0}{2}): '{3}'",
+                2, pos=match.start(), args=(one_plus, arity, len(args), match.group(0)))
     return args
 
 def harvest_sig(string, name, ctx):
     """ harvests the data from signature file content """
-    tokens = parse(string, regexes)
-    if len(tokens) == 0:
+    ctx.positions = get_position_index(string)
+    tokens = peek_tokens(iter_parse(string, regexes))
+    if tokens == None:
         ctx.log("No matches found in file", 3)
         return
     
@@ -503,29 +674,29 @@ def harvest_sig(string, name, ctx):
     for (match, token_type) in tokens:
         if token_type == TOKEN_SYM:
             if required_end_sig == None:
-                ctx.log(f"Require \\begin{{modsig}} or \\begin{{gviewsig}} before token: '{match.group(0)}'",
-                        1, get_file_pos_str(string, match.start()))
+                ctx.log("Require \\begin{{modsig}} or \\begin{{gviewsig}} before token: '{}'",
+                        1, pos=match.start(), args=(match.group(0),))
                 continue
 
             args = get_args(match, True, string, ctx) 
             tname = "-".join(args)
             params = get_params(match.group("params"))
-            ctx.gatherer.push_symi(tname, get_file_pos_str(string, match.start()), "symi", get_noverb(params), get_align(params, tname), ctx, params)
+            ctx.gatherer.push_symi(tname, match.start(), "symi", get_noverb(params), get_align(params, tname), ctx, params)
         elif token_type == TOKEN_SYMDEF:
             if required_end_sig == None:
-                ctx.log("Require \\begin{modsig} or \\begin{gviewsig} before token: " + f"'{match.group(0)}'",
-                        1, get_file_pos_str(string, match.start()))
+                ctx.log("Require \\begin{{modsig}} or \\begin{{gviewsig}} before token: '{}'",
+                        1, pos=match.start(), args=(match.group(0),))
                 continue
             params = get_params(match.group("params"))
             arg = match.group("arg0")
             tname = params["name"] if "name" in params else arg
-            ctx.gatherer.push_symi(tname, get_file_pos_str(string, match.start()), "symdef", get_noverb(params), get_align(params, tname), ctx, params)
+            ctx.gatherer.push_symi(tname, match.start(), "symdef", get_noverb(params), get_align(params, tname), ctx, params)
         elif token_type == TOKEN_BEGIN_MODSIG:
             isacceptablefile = True
             required_end_sig = TOKEN_END_MODSIG
             if match.group("name") != name:
-                ctx.log(f"Name '{match.group('name')}' does not match file name",
-                        2, get_file_pos_str(string, match.start()))
+                ctx.log("Name '{}' does not match file name",
+                        2, pos=match.start(), args=(match.group("name"),))
             ctx.mod_type = "modsig"
             ctx.mod_name = match.group("name")
             params = get_params(match.group("params"))
@@ -534,8 +705,8 @@ def harvest_sig(string, name, ctx):
             isacceptablefile = True
             required_end_sig = TOKEN_END_GVIEWSIG
             if match.group("name") != name:
-                ctx.log(f"Name '{match.group('name')}' does not match file name",
-                        2, get_file_pos_str(string, match.start()))
+                ctx.log("Name '{}' does not match file name",
+                        2, pos=match.start(), args=(match.group("name"),))
             ctx.mod_type = "gviewsig"
             ctx.mod_name = match.group("name")
         elif token_type == required_end_sig:
@@ -548,7 +719,7 @@ def harvest_sig(string, name, ctx):
             mod_name = match.group("arg")
             ctx.gatherer.push_gimport(repo, mod_name, "gimport", ctx)
         else:
-            ctx.log(f"Unexpected token: '{match.group(0)}'", 2, get_file_pos_str(string, match.start()))
+            ctx.log("Unexpected token: '{}'", 2, pos=match.start(), args=(match.group(0),))
 
     if required_end_sig:
         ctx.log("\\end{gviewsig} or \\end{modsig} missing", 1)
@@ -562,8 +733,9 @@ def harvest_sig(string, name, ctx):
 
 def harvest_nl(string, name, lang, ctx):
     """ harvests the data from file content """
-    tokens = parse(string, regexes)
-    if len(tokens) == 0:
+    ctx.positions = get_position_index(string)
+    tokens = peek_tokens(iter_parse(string, regexes))
+    if tokens == None:
         ctx.log("No matches found in file", 3)
         return
 
@@ -573,8 +745,8 @@ def harvest_nl(string, name, lang, ctx):
     for (match, token_type) in tokens:
         if token_type == TOKEN_DEF:
             if required_end_module == None or required_end_module == TOKEN_END_GVIEWNL:
-                ctx.log(f"Require \\begin{{mhmodnl}} before token: '{match.group(0)}'",
-                        1, get_file_pos_str(string, match.start()))
+                ctx.log("Require \\begin{{mhmodnl}} before token: '{}'",
+                        1, pos=match.start(), args=(match.group(0),))
                 continue
             params = get_params(match.group("params"))
 
@@ -583,11 +755,11 @@ def harvest_nl(string, name, lang, ctx):
             tname = params["name"] if "name" in params else "-".join(args)
             val  = " ".join(args)
 
-            ctx.gatherer.push_defi(tname, val, get_file_pos_str(string, match.start()), ctx, params)
+            ctx.gatherer.push_defi(tname, val, match.start(), ctx, params)
         elif token_type == TOKEN_TREF:
             if required_end_module == None:
-                ctx.log(f"Require \\begin{{mhmodnl}} or \\begin{{gviewnl}} before token: '{match.group(0)}'",
-                        1, get_file_pos_str(string, match.start()))
+                ctx.log("Require \\begin{{mhmodnl}} or \\begin{{gviewnl}} before token: '{}'",
+                        1, pos=match.start(), args=(match.group(0),))
                 continue
             params = match.group("params")
             args = get_args(match, False, string, ctx)
@@ -604,14 +776,14 @@ def harvest_nl(string, name, lang, ctx):
 #                         ctx.log(f"Expected mtrefi or drefi for '{match.group(0)}'", 1,
 #                                 get_file_pos_str(string, match.start()))
 
-            ctx.gatherer.push_trefi(tname, targetmodule, isdrefi, get_file_pos_str(string, match.start()), ctx)
+            ctx.gatherer.push_trefi(tname, targetmodule, isdrefi, match.start(), ctx)
         elif token_type == TOKEN_BEGIN_MHMODNL:
             isacceptablefile = True
             required_end_module = TOKEN_END_MHMODNL
             if match.group("name") != name:
-                ctx.log(f"Name '{match.group('name')}' does not match file name", 1, get_file_pos_str(string, match.start()))
+                ctx.log("Name '{}' does not match file name", 1, pos=match.start(), args=(match.group("name"),))
             if match.group("lang") != lang:
-                ctx.log(f"Language '{match.group('lang')}' does not match file name", 1, get_file_pos_str(string, match.start()))
+                ctx.log("Language '{}' does not match file name", 1, pos=match.start(), args=(match.group("lang"),))
             ctx.lang = match.group("lang")
             ctx.mod_name = match.group("name")
             ctx.mod_type = "mhmodnl"
@@ -619,9 +791,9 @@ def harvest_nl(string, name, lang, ctx):
             isacceptablefile = True
             required_end_module = TOKEN_END_GVIEWNL
             if match.group("name") != name:
-                ctx.log(f"Name '{match.group('name')}' does not match file name", 1, get_file_pos_str(string, match.start()))
+                ctx.log("Name '{}' does not match file name", 1, pos=match.start(), args=(match.group("name"),))
             if match.group("lang") != lang:
-                ctx.log(f"Language '{match.group('lang')}' does not match file name", 1, get_file_pos_str(string, match.start()))
+                ctx.log("Language '{}' does not match file name", 1, pos=match.start(), args=(match.group("lang"),))
             ctx.lang = match.group("lang")
             ctx.mod_name = match.group("name")
             ctx.mod_type = "gviewnl"
@@ -635,7 +807,7 @@ def harvest_nl(string, name, lang, ctx):
             mod_name = match.group("arg")
             ctx.gatherer.push_gimport(repo, mod_name, "guse", ctx)
         else:
-            ctx.log(f"Unexpected token: '{match.group(0)}'", 2, get_file_pos_str(string, match.start()))
+            ctx.log("Unexpected token: '{}'", 2, pos=match.start(), args=(match.group(0),))
 
     if required_end_module:
         ctx.log("\\end{gviewnl} or \\end{mhmodnl} missing", 1)
@@ -649,9 +821,10 @@ def harvest_nl(string, name, lang, ctx):
 
 def harvest_mono(string, name, ctx):
     """ harvests the data from file content """
+    ctx.positions = get_position_index(string)
 
-    tokens = parse(string, regexes)
-    if len(tokens) == 0:
+    tokens = peek_tokens(iter_parse(string, regexes))
+    if tokens == None:
         ctx.log("No matches found in file", 2)
         return
 
@@ -661,8 +834,8 @@ def harvest_mono(string, name, ctx):
     for (match, token_type) in tokens:
         if token_type == TOKEN_DEF:
             if not in_named_module:
-                ctx.log("Require \\begin{module}[id=...] before token: '" + match.group(0) + "'",
-                        1, get_file_pos_str(string, match.start()))
+                ctx.log("Require \\begin{{module}}[id=...] before token: '{}'",
+                        1, pos=match.start(), args=(match.group(0),))
                 continue
             params = get_params(match.group("params"))
 
@@ -671,12 +844,12 @@ def harvest_mono(string, name, ctx):
             name = params["name"] if "name" in params else "-".join(args)
             val  = " ".join(args)
 
-            ctx.gatherer.push_defi(name, val, get_file_pos_str(string, match.start()), ctx, params)
-            ctx.gatherer.push_symi(name, get_file_pos_str(string, match.start()), "symi", get_noverb(params), get_align(params, name), ctx, params, implicit=True)
+            ctx.gatherer.push_defi(name, val, match.start(), ctx, params)
+            ctx.gatherer.push_symi(name, match.start(), "symi", get_noverb(params), get_align(params, name), ctx, params, implicit=True)
         elif token_type == TOKEN_TREF:
             if not in_module:
-                ctx.log("Require \\begin{module} before token: '" + match.group(0) + "'",
-                        2, get_file_pos_str(string, match.start()))
+                ctx.log("Require \\begin{{module}} before token: '{}'",
+                        2, pos=match.start(), args=(match.group(0),))
                 continue
             params = match.group("params")
             args = get_args(match, False, string, ctx)
@@ -693,17 +866,17 @@ def harvest_mono(string, name, ctx):
 #                         ctx.log(f"Expected mtrefi or drefi for '{match.group(0)}'", 1,
 #                                 get_file_pos_str(string, match.start()))
 
-            ctx.gatherer.push_trefi(tname, targetmodule, isdrefi, get_file_pos_str(string, match.start()), ctx)
+            ctx.gatherer.push_trefi(tname, targetmodule, isdrefi, match.start(), ctx)
         elif token_type in [TOKEN_IMPORTMHMODULE, TOKEN_USEMHMODULE, TOKEN_MHINPUTREF]:
             if not in_module:
                 if token_type == TOKEN_IMPORTMHMODULE:
-                    ctx.log("Require \\begin{module} before token: '" + match.group(0) + "'",
-                            2, get_file_pos_str(string, match.start()))
+                    ctx.log("Require \\begin{{module}} before token: '{}'",
+                            2, pos=match.start(), args=(match.group(0),))
                     continue
             params = get_params(match.group("params"))
             repo = ctx.repo
             if "repos" in params:
-                ctx.log("Warning: Use of parameter 'repos' is deprecated -- use mhrepos instead: ", 2, get_file_pos_str(string, match.start()))
+                ctx.log("Warning: Use of parameter 'repos' is deprecated -- use mhrepos instead: ", 2, pos=match.start())
                 repo = os.path.join(ctx.mathhub_path, params["repos"])
             if "mhrepos" in params:
                 repo = os.path.join(ctx.mathhub_path, params["mhrepos"])
@@ -727,7 +900,7 @@ def harvest_mono(string, name, ctx):
         elif token_type == TOKEN_BEGIN_MODULE:
             if in_module:
                 ctx.log("Nested modules are not yet fully supported",
-                        2, get_file_pos_str(string, match.start()))
+                        2, pos=match.start())
                 in_module += 1
                 continue
 
@@ -738,9 +911,9 @@ def harvest_mono(string, name, ctx):
                 ctx.mod_name = params["id"]
                 in_named_module = True
                 if ctx.mod_name != name:
-                    ctx.log(f"Name '{params['id']}' does not match file name", 2, get_file_pos_str(string, match.start()))
+                    ctx.log("Name '{}' does not match file name", 2, pos=match.start(), args=(params["id"],))
             else:
-                ctx.log("Warning: Inferring module id from file name", 2, get_file_pos_str(string, match.start()))
+                ctx.log("Warning: Inferring module id from file name", 2, pos=match.start())
                 ctx.mod_name = os.path.split(ctx.file)[1][:-4]
                 # in_named_module = False
                 in_named_module = True
@@ -760,7 +933,7 @@ def harvest_mono(string, name, ctx):
         else:
             if token_type == TOKEN_SYMDEF and in_named_module:
                 continue
-            ctx.log(f"Unexpected token: '{match.group(0)}'", 2, get_file_pos_str(string, match.start()))
+            ctx.log("Unexpected token: '{}'", 2, pos=match.start(), args=(match.group(0),))
 
     if in_module:
         ctx.log("\\end{module} missing", 1)
@@ -768,15 +941,16 @@ def harvest_mono(string, name, ctx):
 
 def harvest_text(string, ctx):
     """ harvests the trefis etc. from unidentified file content """
+    ctx.positions = get_position_index(string)
 
-    tokens = parse(string, regexes)
+    tokens = iter_parse(string, regexes)
     assert ctx.mod_name == None
     ctx.gatherer.push_textfile(ctx)
 
     for (match, token_type) in tokens:
         if token_type == TOKEN_TREF:
             #ctx.log("Warning: Found trefi token in unidentified file",
-            #        3, get_file_pos_str(string, match.start()))
+            #        3, pos=match.start())
             params = match.group("params")
             args = get_args(match, False, string, ctx)
             isdrefi = "d" in match.group("start").lower()
@@ -792,12 +966,12 @@ def harvest_text(string, ctx):
 #                         ctx.log(f"Expected mtrefi or drefi for '{match.group(0)}'", 1,
 #                                 get_file_pos_str(string, match.start()))
 
-            ctx.gatherer.push_trefi(tname, targetmodule, isdrefi, get_file_pos_str(string, match.start()), ctx)
+            ctx.gatherer.push_trefi(tname, targetmodule, isdrefi, match.start(), ctx)
         elif token_type == TOKEN_USEMHMODULE or token_type == TOKEN_MHINPUTREF:
             params = get_params(match.group("params"))
             repo = ctx.repo
             if "repos" in params:
-                ctx.log("Warning: Use of parameter 'repos' is deprecated -- use mhrepos instead: ", 2, get_file_pos_str(string, match.start()))
+                ctx.log("Warning: Use of parameter 'repos' is deprecated -- use mhrepos instead: ", 2, pos=match.start())
                 repo = os.path.join(ctx.mathhub_path, params["repos"])
             if "mhrepos" in params:
                 repo = os.path.join(ctx.mathhub_path, params["mhrepos"])
@@ -824,7 +998,7 @@ def harvest_text(string, ctx):
             mod_name = match.group("arg")
             ctx.gatherer.push_gimport(repo, mod_name, "guse", ctx)
         else:
-            ctx.log(f"Unexpected token in unidentified file: '{match.group(0)}'", 2, get_file_pos_str(string, match.start()))
+            ctx.log("Unexpected token in unidentified file: '{}'", 2, pos=match.start(), args=(match.group(0),))
     
 
 def identify_file(content):
@@ -841,89 +1015,293 @@ def identify_file(content):
 
 identify_file.regex = re.compile(r"\\begin\s*\{(?P<mod>(module)|(modsig)|(mhmodnl)|(gviewnl)|(gviewsig))\}")
 
-def harvest_repo_metadata(repo_directory, ctx):
-    preamble_path = os.path.join(repo_directory, "lib", "preamble.tex")
-    namespace = ""
-    if os.path.isfile(preamble_path):
-        with open(preamble_path, "r") as fp:
-            content = fp.read()
-            match = re_namespace.search(content)
-            if match:
-                namespace = match.group("arg")
-    ctx.gatherer.push_repo(namespace, ctx)
-
-def harvest_file(root, file_name, ctx):
+def get_namespace(preamble):
+    match = re_namespace.search(preamble)
+    if match:
+        return match.group("arg")
+    return ""
+
+def read_namespace(preamble_path):
+    with open(preamble_path, "r") as fp:
+        return get_namespace(fp.read())
+
+def harvest_repo_metadata(repo_directory, ctx, files=None):
+    """ files (e.g. lmh_git.GitRepoFiles, see iter_repos) provides lib/preamble.tex if it isn't read from the file system """
+    if files != None:
+        preamble = files.read_file("lib/preamble.tex")
+        namespace = get_namespace(preamble) if preamble != None else None
+    else:
+        preamble_path = os.path.join(repo_directory, "lib", "preamble.tex")
+        namespace = get_repo_inventory(ctx).get_file_data("namespace", preamble_path, read_namespace)
+    ctx.gatherer.push_repo(namespace if namespace != None else "", ctx)
+
+def harvest_file(root, file_name, ctx, read=None):
+    """ harvests the file root/file_name.
+        If read is given, it returns the content of the file instead of the file system (e.g. from git or an archive). """
     m = harvest_file.file_regex.match(file_name)
     if m == None:
         return
     name = m.group("name")
     lang = m.group("lang")
-    full_name = name
-    if lang: full_name += "." + lang
 
     file_path = os.path.join(root, f"{name}.{lang}.tex" if lang else f"{name}.tex")
     if name in ["all", "localpaths"]:
         return
 
-    with open(file_path, "r") as fp:
-        ctx.file = file_path
-        ctx.mod_name = None
-        ctx.mod_type = None
+    def harvest(string):
+        if ctx.dedup != None:
+            ctx.dedup.harvest_file(string, ctx, lambda string : harvest_file_content(string, name, lang, ctx))
+        else:
+            harvest_file_content(string, name, lang, ctx)
+
+    def read_content():
+        # decoding the file can fail like the harvest of its content, which is logged in the same way
+        # (see harvest_file_content; a file that doesn't exist is still an error for the caller)
+        fp = open(file_path, "r") if read == None else None
         try:
-            string = preprocess_string(fp.read())
-            file_type = identify_file(string)
-            if not file_type:
-                ctx.mod_type = "text"
-                harvest_text(string, ctx)
-            elif file_type == "nl":
-                if lang:
-                    harvest_nl(string, name, lang, ctx)
-                else:
-                    ctx.log("It appears to be a language file, but the filename doesn't indicate that", 2)
-            elif lang and file_type != "nl" and len(lang) in [2,3]:
-                ctx.log("Doesn't appear to be a language file - skipping it", 2)
-                return
-            elif file_type == "sig":
-                harvest_sig(string, full_name, ctx)
-            elif file_type == "mono":
-                harvest_mono(string, full_name, ctx)
-            else:
-                raise Exception("An internal error occured while trying to identify the file")
+            return read() if read != None else fp.read()
         except Exception as ex:
             ctx.log(f"An internal error occured during processing:\n'{exception_to_string(ex)}'", 0)
-            return
+            return None
+        finally:
+            if fp != None:
+                fp.close()
+
+    ctx.file = file_path
+    ctx.mod_name = None
+    ctx.mod_type = None
+    if read == None and ctx.incremental != None and ctx.incremental.current != None:
+        ctx.incremental.harvest_file(file_path, ctx, harvest, read_content)
+    elif read == None and ctx.cache != None:
+        ctx.cache.harvest_file(file_path, ctx, harvest, read_content)
+    else:
+        string = read_content()
+        if string != None:
+            harvest(string)
 
 harvest_file.file_regex = re.compile(r"^(?P<name>[a-zA-Z0-9-]+)(\.(?P<lang>[a-zA-Z]+))?\.tex$")
 
+class FileDeduplicator(object):
+    """
+    Reuses the harvest of a file for later files with the same content and file name
+    (e.g. copied lecture fragments, mirrors and forks).
+    Files are harvested with placeholders for the repo and the directory of the file,
+    which are replaced by the actual ones for every file with that content.
+    As that costs time for every file (hashing it and harvesting it with placeholders),
+    it is only done if HarvestContext.dedup is set (e.g. with --dedup).
+    The harvests of the last max_entries distinct files are kept,
+    so that the memory doesn't grow with the number of files (e.g. with a StreamingGatherer or an SqliteGatherer).
+    """
+    REPO = "\0repo\0"
+    DIRECTORY = "\0directory\0"
+    # the fields that can contain the placeholders
+    FIELDS = ["repo", "path", "dest_repo", "dest_path"]
+    MAX_ENTRIES = 1024
+
+    def __init__(self, max_entries = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()    # (content hash, file name, context) -> lmh_cache.record_harvest entry
+        self.hits = 0
+        self.saved = 0      # number of characters that weren't harvested again
+
+    def harvest_file(self, string, ctx, harvest):
+        """ harvest(string) harvests the content of the current file (ctx.file),
+            unless a file with the same content was harvested before """
+        (directory, file_name) = os.path.split(ctx.file)
+        if ctx.repo == None or not directory:
+            harvest(string)
+            return
+        key = (hashlib.sha1(string.encode("utf-8", "surrogateescape")).digest(), file_name, ctx.lang, ctx.mathhub_path)
+        if key in self.entries:
+            self.hits += 1
+            self.saved += len(string)
+            self.entries.move_to_end(key)
+        else:
+            self.entries[key] = self.record(string, ctx, harvest)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)      # the least recently used one
+        self.replay(self.entries[key], ctx)
+
+    def record(self, string, ctx, harvest):
+        """ harvests the string with placeholders (the records are not added to ctx.gatherer) """
+        (repo, path, gatherer) = (ctx.repo, ctx.file, ctx.gatherer)
+        ctx.repo = FileDeduplicator.REPO
+        ctx.file = os.path.join(FileDeduplicator.DIRECTORY, os.path.basename(path))
+        ctx.gatherer = StreamingGatherer()
+        ctx.gatherer.intern = gatherer.intern   # the other fields are the same for every file
+        ctx.defer_logs = True
+        try:
+            return lmh_cache.record_harvest(string, ctx, harvest)
+        finally:
+            (ctx.repo, ctx.file, ctx.gatherer) = (repo, path, gatherer)
+            ctx.defer_logs = False
+
+    def replay(self, entry, ctx):
+        directory = os.path.dirname(ctx.file)
+        def substitute(value):
+            if value == None:
+                return None
+            return ctx.gatherer.intern(value.replace(FileDeduplicator.REPO, ctx.repo)
+                                            .replace(FileDeduplicator.DIRECTORY, directory))
+        for (kind, record) in entry["records"]:
+            changes = {field : substitute(getattr(record, field))
+                            for field in FileDeduplicator.FIELDS if field in record.__slots__}
+            ctx.gatherer.add(kind, record.replace(**changes))
+        lmh_cache.replay_logs(entry, ctx)
+
+def harvest_file_content(string, name, lang, ctx):
+    """ harvests the content of a file (ctx.file) """
+    full_name = name
+    if lang: full_name += "." + lang
 
-def gather_data_for_repo(repo_directory, ctx):
-    harvest_repo_metadata(repo_directory, ctx)
+    try:
+        string = preprocess_string(string)
+        file_type = identify_file(string)
+        if not file_type:
+            ctx.mod_type = "text"
+            harvest_text(string, ctx)
+        elif file_type == "nl":
+            if lang:
+                harvest_nl(string, name, lang, ctx)
+            else:
+                ctx.log("It appears to be a language file, but the filename doesn't indicate that", 2)
+        elif lang and file_type != "nl" and len(lang) in [2,3]:
+            ctx.log("Doesn't appear to be a language file - skipping it", 2)
+            return
+        elif file_type == "sig":
+            harvest_sig(string, full_name, ctx)
+        elif file_type == "mono":
+            harvest_mono(string, full_name, ctx)
+        else:
+            raise Exception("An internal error occured while trying to identify the file")
+    except Exception as ex:
+        ctx.log(f"An internal error occured during processing:\n'{exception_to_string(ex)}'", 0)
+        return
+
+
+def iter_repo_files(repo_directory):
+    """ yields (root, file_name) for the files in the source directory of a repo """
     dir_path = os.path.join(repo_directory, "source")
     for root, dirs, files in os.walk(dir_path):
         for file_name in files:
-            harvest_file(root, file_name, ctx)
+            yield (root, file_name)
+
+def iter_repo_directories(directory, inventory=None, bare=False):
+    """ recursively finds git repos in directory (see lmh_repos.RepoInventory.find_repos) """
+    if inventory == None:
+        inventory = lmh_repos.RepoInventory()
+    yield from inventory.find_repos(directory, bare=bare)
+
+def get_repo_inventory(ctx):
+    """ returns the RepoInventory of ctx, which is stored in the cache directory if there is one """
+    if ctx.inventory == None:
+        ctx.inventory = lmh_repos.RepoInventory(
+                os.path.join(ctx.cache.directory, lmh_repos.CACHE_FILE) if ctx.cache != None else None)
+    return ctx.inventory
+
+def iter_repos(directory, ctx):
+    """ recursively finds the repos in directory and yields (repo directory, files),
+        where files provides the files of the repo if they aren't read from the working tree
+        (lmh_git.GitRepoFiles if ctx.git_ref is set,
+        lmh_archive.ArchiveRepoFiles if directory is an archive or a directory in an archive) """
+    inventory = get_repo_inventory(ctx)
+    if not os.path.isdir(directory):
+        import lmh_archive
+        (archive_path, member_path) = lmh_archive.split_archive_path(directory)
+        if archive_path != None:
+            for files in lmh_archive.open_archive(archive_path).get_repos(member_path):
+                yield (files.directory, files)
+            return
+    for repo_directory in iter_repo_directories(directory, inventory, ctx.git_ref != None):
+        if ctx.git_ref != None:
+            import lmh_git
+            yield (repo_directory, lmh_git.GitRepoFiles(repo_directory, ctx.git_ref))
+        else:
+            yield (repo_directory, None)
+
+def harvest_repo(repo_directory, ctx, files=None):
+    """ harvests a repo step by step: yields after the metadata and after every file
+        (from the working tree, or from files if it is given, see iter_repos) """
+    if files != None:
+        try:
+            ctx.repo = get_repo_name(files.directory)
+            harvest_repo_metadata(files.directory, ctx, files)
+            yield
+            for (root, file_name, key) in files.iter_files():
+                harvest_file(root, file_name, ctx, lambda : lmh_source.decode_content(files.read_blob(key)))
+                yield
+        finally:
+            files.close()
+        return
+
+    harvest_repo_metadata(repo_directory, ctx)
+    yield
+    if ctx.incremental != None:
+        ctx.incremental.begin_repo(repo_directory)
+    for (root, file_name) in iter_repo_files(repo_directory):
+        harvest_file(root, file_name, ctx)
+        yield
+    if ctx.incremental != None:
+        ctx.incremental.end_repo()
+
+def gather_data_for_repo(repo_directory, ctx, files=None):
+    for _ in harvest_repo(repo_directory, ctx, files):
+        pass
+
+def get_repo_name(repo_directory):
+    return repo_directory.split("/")[-1]   ## TODO: Do this system-independently
+
+def log_repo_error(repo_directory, ex, ctx):
+    ctx.log("Error while obtaining statistics for repo " + repo_directory + ":\n" + exception_to_string(ex), forfile=False)
 
 def gather_data_for_all_repos(directory, ctx):
-    """ recursively finds git repos and calls gather_data_for_all_repos on them """
-    if os.path.isdir(os.path.join(directory, ".git")):  ## TODO: Is there a better way?
+    """ recursively finds git repos and calls gather_data_for_repo on them
+        (or harvests them with several processes if ctx.jobs > 1, see lmh_parallel.py) """
+    if ctx.jobs > 1:
+        import lmh_parallel
+        lmh_parallel.gather_data_for_all_repos(directory, ctx)
+        return
+    for (repo_directory, files) in iter_repos(directory, ctx):
         try:
-            ctx.repo = directory.split("/")[-1]   ## TODO: Do this system-independently
-            gather_data_for_repo(directory, ctx)
+            ctx.repo = get_repo_name(repo_directory)
+            gather_data_for_repo(repo_directory, ctx, files)
         except Exception as ex:
-            ctx.log("Error while obtaining statistics for repo " + os.path.join(directory, repo) + ":\n" + exception_to_string(ex), forfile=False)
-        return
+            log_repo_error(repo_directory, ex, ctx)
+    ctx.inventory.save()
 
-    for subdir in os.listdir(directory):
-        if subdir == "meta-inf":
-            # if ctx.verbosity >= 4:
-            #     print("Skipping meta-inf")
-            continue
-        subdirpath = os.path.join(directory, subdir)
-        if os.path.isdir(subdirpath):
-            gather_data_for_all_repos(subdirpath, ctx)
+def iter_records(directory, ctx):
+    """
+    Like gather_data_for_all_repos, but yields the records as (kind, record) pairs
+    (e.g. ("defis", defi)) after every harvested file, instead of collecting them.
+    ctx.gatherer has to be a StreamingGatherer.
+    While the records of a file are yielded, ctx.repo and ctx.file are still set to that repo and file.
+    """
+    for (repo_directory, files) in iter_repos(directory, ctx):
+        try:
+            ctx.repo = get_repo_name(repo_directory)
+            for _ in harvest_repo(repo_directory, ctx, files):
+                yield from ctx.gatherer.take_records()
+        except Exception as ex:
+            log_repo_error(repo_directory, ex, ctx)
+    ctx.inventory.save()
+
+def add_dedup_argument(parser):
+    """ adds the option --dedup (for HarvestContext.dedup) to an argparse parser """
+    parser.add_argument("--dedup", action="store_true",
+            help="reuse the harvest of files with the same content and name (e.g. in mirrors and forks)")
+
+def add_jobs_argument(parser):
+    """ adds the option -j N (for HarvestContext.jobs) to an argparse parser """
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+            help="harvest the files with N processes (default: 1)")
 
 def get_mathhub_dir(path, mayContainSymbLinks = True):
-    """ Extracts the MathHub directory from a path """
+    """ Extracts the MathHub directory from a path (or from an archive, see lmh_archive.py) """
+    if not os.path.isdir(path):
+        import lmh_archive
+        (archive_path, member_path) = lmh_archive.split_archive_path(path)
+        if archive_path != None and "MathHub" not in member_path.split("/"):
+            return lmh_archive.get_mathhub_dir(archive_path)
     mathhub_dir = os.path.abspath(path)
     while not mathhub_dir.endswith("MathHub"):
         new = os.path.split(mathhub_dir)[0]
@@ -955,24 +1333,58 @@ if __name__ == "__main__":
             epilog="Example call: lmh_harvest.py -v1 defi /path/to/MathHub/smglom")
     parser.add_argument("-v", "--verbosity", type=int, default=1, choices=range(4),
             help="the verbosity (default: 1)")
-    parser.add_argument("COMMAND", choices=["repo", "defi", "trefi", "symi", "sigfile", "langfile"],
-            help="print this type of data")
+    parser.add_argument("-t", "--tokenizer", choices=lmh_tokenizer.BACKENDS,
+            help="the tokenizer backend (default: regex, or the value of $LMH_TOKENIZER)")
+    parser.add_argument("-C", "--cache", metavar="DIR",
+            help="cache the harvest of files in DIR (e.g. .lmhcache; default: the value of $LMH_CACHE)")
+    parser.add_argument("-I", "--incremental", metavar="DIR",
+            help="only harvest the files of git repos that have changed since the last run with the same DIR (e.g. .lmhstate)")
+    parser.add_argument("-s", "--snapshot", metavar="FILE",
+            help="write all the gathered data to FILE (JSON Lines), which can be loaded by e.g. lmh_debug.py")
+    parser.add_argument("--binary-snapshot", metavar="FILE",
+            help="write all the gathered data to FILE (binary, see lmh_snapshot.BinarySnapshot)")
+    parser.add_argument("--ref", metavar="REF",
+            help="harvest the files of the git ref REF (e.g. a branch or a tag) instead of the working trees "
+                 "(bare repositories are harvested as well)")
+    add_jobs_argument(parser)
+    add_dedup_argument(parser)
+    parser.add_argument("COMMAND", choices=["repo", "defi", "trefi", "symi", "sigfile", "langfile", "none"],
+            help="print this type of data (none: e.g. for --snapshot)")
     parser.add_argument("DIRECTORY", nargs="+",
             help="git repo or higher level directory from which data is gathered")
     args = parser.parse_args()
 
     verbosity = args.verbosity
+    if args.tokenizer:
+        lmh_tokenizer.set_backend(args.tokenizer)
     if verbosity >= 2:
         print("GATHERING DATA\n")
 
     mathhub_dir = get_mathhub_dir(args.DIRECTORY[0])
     logger = SimpleLogger(verbosity)
     ctx = HarvestContext(logger, DataGatherer(), mathhub_dir)
+    if args.cache:
+        ctx.cache = lmh_cache.HarvestCache(args.cache)
+    if args.incremental:
+        import lmh_incremental
+        ctx.incremental = lmh_incremental.IncrementalHarvest(args.incremental)
+    ctx.jobs = args.jobs
+    if args.dedup:
+        ctx.dedup = FileDeduplicator()
+    ctx.git_ref = args.ref
 
     for directory in args.DIRECTORY:
         gather_data_for_all_repos(directory, ctx)
+    log_statistics(logger, ctx.cache, ctx.dedup, ctx.incremental, ctx.suppressed)
+
+    if args.snapshot or args.binary_snapshot:
+        import lmh_snapshot
+        if args.snapshot:
+            lmh_snapshot.write_snapshot(ctx.gatherer, args.snapshot, mathhub_dir)
+        if args.binary_snapshot:
+            lmh_snapshot.write_binary_snapshot(ctx.gatherer, args.binary_snapshot, mathhub_dir)
 
-    if verbosity >= 2 or logger.something_was_logged:
+    if (verbosity >= 2 or logger.something_was_logged) and args.COMMAND != "none":
         print("\n\nRESULTS\n")
 
     command = args.COMMAND
@@ -0,0 +1,148 @@
+"""
+Incremental harvesting of git repositories (used by lmh_harvest.py if ctx.incremental is set,
+e.g. with the option -I DIR of lmh_debug.py).
+
+For every repo, the harvest of its files (the records that were added and the messages that were logged,
+see lmh_cache.record_harvest) is stored in the state directory together with the HEAD commit of the repo.
+In the next run (e.g. after a git pull), git is asked which files in the source directory
+differ from that commit (committed, staged or unstaged changes and untracked files),
+and only those files are harvested again. The stored harvest is replayed for the other files.
+Files that were deleted are not walked anymore, so their records are dropped,
+and a renamed file is only harvested under its new path.
+Files that differed from the commit when the state was stored are always harvested again.
+
+Repos for which git fails (e.g. without any commits) are harvested as usual.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import lmh_cache
+import lmh_git
+
+
+DEFAULT_DIRECTORY = ".lmhstate"
+
+def get_changed_paths(repo_directory, commit):
+    """ returns the paths (relative to the repo) of the files in the source directory
+        that differ from a commit or are untracked (or None if git can't tell) """
+    diff = lmh_git.run_git(repo_directory, "diff", "--name-only", "--no-renames", "-z", commit, "--", "source")
+    untracked = lmh_git.run_git(repo_directory, "ls-files", "--others", "-z", "--", "source")
+    if diff == None or untracked == None:
+        return None
+    return set(os.fsdecode(path) for path in (diff + untracked).split(b"\0") if path)
+
+
+class RepoState(object):
+    """ The stored harvest of the files of a repo and the paths that have changed since then """
+    def __init__(self, directory, head, stored, changed):
+        self.directory = directory
+        self.head = head
+        self.stored = stored        # path -> entry (see lmh_cache.record_harvest)
+        self.changed = changed      # paths for which the stored entries are outdated
+        self.entries = {}           # path -> entry for the current harvest
+
+    def get_path(self, file_path):
+        return os.path.relpath(file_path, self.directory).replace(os.sep, "/")
+
+    def is_unchanged(self, file_path):
+        """ returns True if the stored harvest of a file can be replayed
+            (as long as the state of the context is the same) """
+        path = self.get_path(file_path)
+        return path in self.stored and path not in self.changed
+
+
+class IncrementalHarvest(object):
+    """ Stores the harvest of git repos in a directory (one pickle file per repo, see the module documentation) """
+    def __init__(self, directory = DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.version = lmh_cache.get_version()
+        self.current = None         # RepoState of the repo that is harvested (None if it isn't a git repo)
+        self.reused = 0
+        self.harvested = 0
+
+    def get_state_path(self, repo_directory):
+        key = hashlib.sha1(os.path.abspath(repo_directory).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get_repo_state(self, repo_directory):
+        """ loads the stored harvest of a repo and asks git what has changed since then """
+        head = lmh_git.run_git(repo_directory, "rev-parse", "--verify", "-q", "HEAD")
+        if head == None:
+            return None
+        head = head.decode("utf-8").strip()
+        try:
+            with open(self.get_state_path(repo_directory), "rb") as fp:
+                state = pickle.load(fp)
+        except Exception:   # a missing or broken state means that everything is harvested again
+            state = None
+        changed = get_changed_paths(repo_directory, state["head"]) \
+                    if state != None and state["version"] == self.version else None
+        if changed == None:
+            return RepoState(repo_directory, head, {}, set())
+        return RepoState(repo_directory, head, state["files"], changed | state["dirty"])
+
+    def begin_repo(self, repo_directory):
+        self.current = self.get_repo_state(repo_directory)
+
+    def end_repo(self):
+        """ stores the harvest of the current repo (after all of its files were harvested) """
+        repo = self.current
+        self.current = None
+        if repo == None:
+            return
+        # the files that differ from HEAD now can't be trusted in the next run
+        dirty = get_changed_paths(repo.directory, repo.head)
+        if dirty == None:
+            return
+        os.makedirs(self.directory, exist_ok = True)
+        (fd, tmp_path) = tempfile.mkstemp(dir = self.directory)
+        with os.fdopen(fd, "wb") as fp:
+            lmh_cache.CachePickler(fp, pickle.HIGHEST_PROTOCOL).dump(
+                    {"version" : self.version, "head" : repo.head, "dirty" : dirty, "files" : repo.entries})
+        os.replace(tmp_path, self.get_state_path(repo.directory))
+
+    def get_context_state(self, file_path, ctx):
+        # the harvest of a file also depends on the context
+        # (and on the path as it was given, e.g. relative or absolute, which is stored in the records)
+        return (file_path, ctx.mathhub_path, ctx.repo, ctx.lang)
+
+    def replay(self, file_path, ctx):
+        """ replays the stored harvest of a file if it is still valid (returns False otherwise) """
+        repo = self.current
+        path = repo.get_path(file_path)
+        entry = repo.stored.get(path)
+        if entry == None or path in repo.changed or entry["state"] != self.get_context_state(file_path, ctx):
+            return False
+        self.reused += 1
+        lmh_cache.replay_harvest(entry, ctx)
+        repo.entries[path] = entry
+        return True
+
+    def record(self, file_path, ctx, harvest):
+        """ harvests a file with harvest() and keeps the harvest for the next run """
+        repo = self.current
+        state = self.get_context_state(file_path, ctx)
+        self.harvested += 1
+        entry = lmh_cache.record_harvest(None, ctx, lambda string : harvest())
+        entry["state"] = state
+        repo.entries[repo.get_path(file_path)] = entry
+
+    def harvest_file(self, file_path, ctx, harvest, read=None):
+        """
+        harvest(string) harvests the content of the file at file_path (using ctx).
+        If the file hasn't changed, the stored harvest is replayed instead.
+        If read is given, it returns the content of the file (or None if it can't be read).
+        """
+        if self.replay(file_path, ctx):
+            return
+        if read != None:
+            string = read()
+            if string == None:
+                return
+        else:
+            with open(file_path, "r") as fp:
+                string = fp.read()
+        self.record(file_path, ctx, lambda : harvest(string))
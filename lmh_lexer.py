@@ -0,0 +1,376 @@
+"""
+Hand-written lexer for sTeX token lists.
+
+This is an alternative backend for lmh_tokenizer.py
+(select it with `lmh_tokenizer.set_backend("lexer")` or
+the environment variable LMH_TOKENIZER=lexer).
+Instead of running regular expressions, the lexer jumps from backslash to backslash,
+reads the name of the control sequence and dispatches through a dictionary
+to the rules of the tokens with that name.
+A rule is a list of small parsers for things like whitespace, [params] and {arg} groups.
+
+The rules are derived from the token regexes (e.g. lmh_harvest.re_defi)
+and the lexer returns match-like objects for them,
+so the results are the same as with the regex engine.
+Only the regex features used by the sTeX token regexes are supported.
+For other token lists, lmh_tokenizer falls back to the regex engine.
+Note that the parsers are greedy and don't backtrack,
+which is fine for the token regexes, as they are unambiguous in this respect.
+"""
+
+import re
+
+import lmh_tokenizer
+
+
+# the argument regex used by the token regexes (see lmh_harvest.re_arg)
+RE_ARG = lmh_tokenizer.RE_ARG
+
+_re_control_word = re.compile(r"[a-zA-Z]*")
+_re_group_opener = re.compile(r"\((?:\?:|\?P<(?P<name>\w+)>|(?!\?))")
+
+# elements of rules
+E_LIT     = 0       # literal string
+E_OPTLIT  = 1       # optional literal string (possibly in a group)
+E_ALT     = 2       # alternative of literal strings (only in the control sequence name)
+E_OPEN    = 3       # start of a named group
+E_CLOSE   = 4       # end of a named group
+E_WS      = 5       # \s*
+E_PARAMS  = 6       # optional [params]
+E_ARG     = 7       # {arg}
+E_OPTARG  = 8       # optional {arg}, possibly preceded by whitespace
+E_CLASS   = 9       # sequence of characters from a character class (at least one)
+E_ARGBODY = 10      # (only during the compilation of a rule)
+
+
+# the lexer returns the same match-like objects as lmh_tokenizer.ArgumentRegex
+LexerMatch = lmh_tokenizer.TokenMatch
+
+
+def _is_word_char(c):
+    return c.isalnum() or c == "_"
+
+def _class_predicate(content):
+    """ returns a predicate for a character class like '[\\w\\.-]' (or None if it isn't supported) """
+    if not (content.startswith("[") and content.endswith("]")) or content[1:2] == "^":
+        return None
+    content = content[1:-1]
+    chars = ""
+    word = False
+    i = 0
+    while i < len(content):
+        if content[i] == "\\":
+            if content[i+1] == "w":
+                word = True
+            elif content[i+1].isalnum():
+                return None
+            else:
+                chars += content[i+1]
+            i += 2
+        elif content[i] == "-" and 0 < i < len(content) - 1:
+            return None     # ranges aren't supported
+        else:
+            chars += content[i]
+            i += 1
+    if word:
+        return lambda c : c in chars or _is_word_char(c)
+    return lambda c : c in chars
+
+def _literal_text(items):
+    """ returns the string matched by a sequence of literal items (or None) """
+    text = ""
+    for (atom, quantifier) in items:
+        if quantifier:
+            return None
+        if atom[0] == "\\" and len(atom) == 2 and not atom[1].isalnum():
+            text += atom[1]
+        elif len(atom) == 1 and atom not in ".^$()[]":
+            text += atom
+        else:
+            return None
+    return text
+
+def _flatten(items):
+    """ translates a sequence of (atom, quantifier) pairs into elements (None if not supported) """
+    elements = []
+    for (atom, quantifier) in items:
+        if atom[0] == "(":
+            opener = _re_group_opener.match(atom)
+            if not opener:
+                return None
+            name = opener.group("name")
+            content = atom[opener.end():-1]
+            alternatives = lmh_tokenizer._split(content)
+            if quantifier == "":
+                if name and content == RE_ARG:
+                    elements.append((E_ARGBODY, name))
+                    continue
+                if len(alternatives) == 1 and len(alternatives[0]) == 1 and alternatives[0][0][1] == "+":
+                    predicate = _class_predicate(alternatives[0][0][0])
+                    if predicate == None:
+                        return None
+                    elements.append((E_CLASS, name, predicate))
+                    continue
+                if len(alternatives) > 1:
+                    texts = [_literal_text(alternative) for alternative in alternatives]
+                    if None in texts:
+                        return None
+                    inner = [(E_ALT, texts)]
+                else:
+                    inner = _flatten(alternatives[0])
+                    if inner == None:
+                        return None
+                elements += ([(E_OPEN, name)] + inner + [(E_CLOSE, name)]) if name else inner
+            elif quantifier == "?":
+                if len(alternatives) != 1:
+                    return None
+                element = _optional_element(alternatives[0], name)
+                if element == None:
+                    return None
+                elements.append(element)
+            else:
+                return None
+        else:
+            text = _literal_text([(atom, "")])
+            if atom == "\\s" and quantifier == "*":
+                elements.append((E_WS,))
+            elif text == None:
+                return None
+            elif quantifier == "":
+                elements.append((E_LIT, text))
+            elif quantifier == "?":
+                elements.append((E_OPTLIT, text, None))
+            else:
+                return None
+    return elements
+
+def _optional_element(items, name):
+    """ translates the content of an optional group (None if not supported) """
+    # [params]
+    if len(items) == 3 and items[0] == ("\\[", "") and items[2] == ("\\]", ""):
+        if items[1] == ("[^\\]]", "*"):
+            return (E_PARAMS, None)
+        opener = _re_group_opener.match(items[1][0])
+        if opener and opener.group("name") and items[1] == (opener.group() + "[^\\]]*)", ""):
+            return (E_PARAMS, opener.group("name"))
+        return None
+    # {arg}
+    ws = items[:1] == [("\\s", "*")]
+    if ws:
+        items = items[1:]
+    if len(items) == 3 and items[0] == ("\\{", "") and items[2] == ("\\}", ""):
+        opener = _re_group_opener.match(items[1][0])
+        if opener and opener.group("name") and items[1] == (opener.group() + RE_ARG + ")", ""):
+            return (E_OPTARG, opener.group("name"), ws)
+        return None
+    if ws:
+        return None
+    # literal
+    text = _literal_text(items)
+    if text:
+        return (E_OPTLIT, text, name)
+    return None
+
+def _compile_rule(regex):
+    """ Compiles a regex into a rule for the lexer.
+        Returns a list of heads (name, spans, open groups) and the steps (None if not supported). """
+    if regex.flags != re.UNICODE or not isinstance(regex.pattern, str):
+        return None
+    alternatives = lmh_tokenizer._split(regex.pattern)
+    if len(alternatives) != 1 or not alternatives[0] or alternatives[0][0] != ("\\\\", ""):
+        return None
+    elements = _flatten(alternatives[0][1:])
+    if elements == None:
+        return None
+
+    # the name of the control sequence (and the groups in it)
+    heads = [("", {}, {})]
+    k = 0
+    for element in elements:
+        if element[0] == E_LIT and element[1].isalpha() and element[1].isascii():
+            heads = [(name + element[1], spans, opened) for (name, spans, opened) in heads]
+        elif element[0] == E_OPTLIT and element[1].isalpha() and element[1].isascii():
+            text, group = element[1], element[2]
+            new_heads = []
+            for (name, spans, opened) in heads:
+                new_heads.append((name + text, dict(spans, **({group : (len(name), len(name) + len(text))} if group else {})), opened))
+                new_heads.append((name, dict(spans, **({group : None} if group else {})), opened))
+            heads = new_heads
+        elif element[0] == E_ALT and all(text.isalpha() and text.isascii() for text in element[1]):
+            heads = [(name + text, spans, opened) for (name, spans, opened) in heads for text in element[1]]
+        elif element[0] == E_OPEN:
+            heads = [(name, spans, dict(opened, **{element[1] : len(name)})) for (name, spans, opened) in heads]
+        elif element[0] == E_CLOSE and all(element[1] in opened for (_, _, opened) in heads):
+            heads = [(name, dict(spans, **{element[1] : (opened[element[1]], len(name))}),
+                      {g : s for (g, s) in opened.items() if g != element[1]})
+                        for (name, spans, opened) in heads]
+        else:
+            break
+        k += 1
+    if not heads[0][0]:
+        return None
+
+    # the steps after the name
+    steps = []
+    for element in elements[k:]:
+        if element[0] == E_ALT:
+            return None
+        if element[0] == E_ARGBODY:
+            if not steps or steps[-1][0] != E_LIT or not steps[-1][1].endswith("{"):
+                return None
+            steps[-1] = (E_LIT, steps[-1][1][:-1])
+            if not steps[-1][1]:
+                steps.pop()
+            steps.append((E_ARG, element[1]))
+        elif element[0] == E_LIT and steps and steps[-1][0] == E_LIT:
+            steps[-1] = (E_LIT, steps[-1][1] + element[1])
+        else:
+            steps.append(element)
+    # the closing brace of an argument is part of the E_ARG step
+    compiled = []
+    for step in steps:
+        if step[0] == E_LIT and compiled and compiled[-1][0] == E_ARG:
+            if not step[1].startswith("}"):
+                return None
+            if len(step[1]) > 1:
+                compiled.append((E_LIT, step[1][1:]))
+        else:
+            compiled.append(step)
+    return (heads, compiled)
+
+def _is_name_char(c):
+    return c.isascii() and c.isalpha()
+
+def _may_continue_word(steps):
+    """ checks if a rule can match if the control sequence name continues with letters
+        (like \\covereduptohere, which also matches \\covereduptohereX) """
+    for step in steps:
+        if step[0] == E_LIT:
+            return _is_name_char(step[1][0])
+        if step[0] == E_OPTLIT and _is_name_char(step[1][0]) or step[0] == E_CLASS:
+            return True
+        if step[0] == E_ARG:
+            return False
+    return True
+
+
+def _match_steps(steps, string, i, spans, opened):
+    """ matches the steps of a rule at position i.
+        Returns the end of the match (or -1) and puts the groups into spans """
+    n = len(string)
+    for step in steps:
+        kind = step[0]
+        if kind == E_WS:
+            while i < n and string[i].isspace():
+                i += 1
+        elif kind == E_LIT:
+            if not string.startswith(step[1], i):
+                return -1
+            i += len(step[1])
+        elif kind == E_ARG:
+            if i >= n or string[i] != "{":
+                return -1
+            end = lmh_tokenizer.scan_arg(string, i + 1)
+            if end < 0:
+                return -1
+            spans[step[1]] = (i + 1, end)
+            i = end + 1
+        elif kind == E_PARAMS:
+            end = string.find("]", i + 1) if string.startswith("[", i) else -1
+            if step[1]:
+                spans[step[1]] = (i + 1, end) if end >= 0 else None
+            if end >= 0:
+                i = end + 1
+        elif kind == E_OPTARG:
+            j = i
+            if step[2]:
+                while j < n and string[j].isspace():
+                    j += 1
+            end = lmh_tokenizer.scan_arg(string, j + 1) if string.startswith("{", j) else -1
+            spans[step[1]] = (j + 1, end) if end >= 0 else None
+            if end >= 0:
+                i = end + 1
+        elif kind == E_OPTLIT:
+            found = string.startswith(step[1], i)
+            if step[2]:
+                spans[step[2]] = (i, i + len(step[1])) if found else None
+            if found:
+                i += len(step[1])
+        elif kind == E_CLASS:
+            j = i
+            predicate = step[2]
+            while j < n and predicate(string[j]):
+                j += 1
+            if j == i:
+                return -1
+            if step[1]:
+                spans[step[1]] = (i, j)
+            i = j
+        elif kind == E_OPEN:
+            opened[step[1]] = i
+        elif kind == E_CLOSE:
+            spans[step[1]] = (opened[step[1]], i)
+    return i
+
+
+class Lexer(object):
+    """ Finds the tokens of a token list in a string (without regexes) """
+    def __init__(self, regexes):
+        self.regexes = [(re.compile(regex), token_type) for (regex, token_type) in regexes]
+        self.rules = {}             # control sequence name -> list of (regex index, name length, head spans, open groups, steps)
+        self.prefix_rules = []      # (name, rule) for rules that also match longer names
+        self.supported = True
+        for (index, (regex, _)) in enumerate(self.regexes):
+            compiled = _compile_rule(regex)
+            if compiled == None:
+                self.supported = False
+                return
+            (heads, steps) = compiled
+            for (name, spans, opened) in heads:
+                rules = self.rules.setdefault(name, [])
+                if rules and rules[-1][0] == index:
+                    continue        # the regex would prefer the first alternative anyway
+                rule = (index, len(name), spans, opened, steps)
+                rules.append(rule)
+                if _may_continue_word(steps):
+                    self.prefix_rules.append((name, rule))
+        self.prefix_names = tuple(name for (name, _) in self.prefix_rules)
+
+    def tokenize(self, string):
+        """ Returns tokens from a string as pairs (match-like object, token_type),
+            sorted according to the match start (the order of the regexes breaks ties). """
+        return list(self.iter_tokens(string))
+
+    def iter_tokens(self, string):
+        """ Like tokenize, but yields the tokens one by one as they are found """
+        lmh_tokenizer.tokenize.statistics["strings"] += 1
+        regexes = self.regexes
+        rules = self.rules
+        blocked_until = [0] * len(regexes)
+        pos = string.find("\\")
+        while pos >= 0:
+            name_end = _re_control_word.match(string, pos + 1).end()
+            name = string[pos+1:name_end]
+            candidates = rules.get(name)
+            if self.prefix_names and name.startswith(self.prefix_names):
+                extra = [rule for (prefix, rule) in self.prefix_rules if len(name) > len(prefix) and name.startswith(prefix)]
+                if extra:
+                    candidates = sorted((candidates or []) + extra, key = lambda rule : rule[0])
+            if candidates:
+                for (index, name_length, head_spans, opened, steps) in candidates:
+                    if pos < blocked_until[index]:
+                        continue
+                    start = pos + 1
+                    step_spans = {}
+                    end = _match_steps(steps, string, start + name_length, step_spans,
+                                       {group : start + offset for (group, offset) in opened.items()} if opened else None)
+                    if end < 0:
+                        continue
+                    spans = dict.fromkeys(regexes[index][0].groupindex)
+                    for (group, span) in head_spans.items():
+                        spans[group] = (start + span[0], start + span[1]) if span else None
+                    spans.update(step_spans)
+                    spans[0] = (pos, end)
+                    yield (LexerMatch(string, regexes[index][0], spans), regexes[index][1])
+                    blocked_until[index] = end
+            pos = string.find("\\", pos + 1)
@@ -0,0 +1,239 @@
+"""
+Parallel harvesting of files with a pool of worker processes
+(used by lmh_harvest.gather_data_for_all_repos if ctx.jobs > 1, e.g. with the option -j N).
+
+The files are distributed to the workers, which harvest them with their own HarvestContext.
+A worker doesn't log anything. Instead, it returns the records and the log calls of a file,
+which are replayed by the main process in the order of a serial harvest,
+so that the results and messages are the same.
+The only state that is passed from file to file is the language (ctx.lang),
+so the workers harvest files with a placeholder for it,
+which is replaced by the actual language when the results are replayed.
+"""
+
+import collections
+import multiprocessing
+import multiprocessing.reduction
+import os
+import pickle
+import types
+
+import lmh_cache
+import lmh_harvest as harvest
+import lmh_source
+import lmh_tokenizer
+
+
+LANG = "\0lang\0"
+
+# the files of a repo are sent to the workers in chunks of this size
+CHUNK_SIZE = 32
+
+# number of chunks per process that are harvested ahead of the replay
+LOOKAHEAD = 4
+
+# the parameter dictionaries of records are read-only (MappingProxyType), which can't be pickled otherwise
+multiprocessing.reduction.ForkingPickler.register(types.MappingProxyType,
+        lambda params : (lmh_cache._make_params, (dict(params),)))
+
+
+class WorkerContext(harvest.HarvestContext):
+    """ The HarvestContext of a worker, which records the log calls instead of logging them """
+    def __init__(self, mathhub_path):
+        harvest.HarvestContext.__init__(self, None, harvest.StreamingGatherer(), mathhub_path)
+        self.calls = []             # the log calls for the current file
+
+    def log(self, message, minverbosity=1, offsetstr=None, forfile = True, pos=None, args=()):
+        call = (self.positions if pos != None else None, (message, minverbosity, offsetstr, forfile, pos, args))
+        if self.logged != None:
+            self.logged.append(call)
+        if not self.defer_logs:
+            self.calls.append(call)
+
+worker_ctx = None
+
+def init_worker(mathhub_path, cache_directory, dedup, backend):
+    global worker_ctx
+    lmh_tokenizer.set_backend(backend)
+    worker_ctx = WorkerContext(mathhub_path)
+    worker_ctx.cache = lmh_cache.HarvestCache(cache_directory) if cache_directory != None else None
+    if not dedup:
+        worker_ctx.dedup = None
+
+def get_counters(ctx):
+    """ returns the statistics of the harvest so far (see harvest.log_statistics) """
+    counters = dict(lmh_tokenizer.tokenize.statistics)
+    info = lmh_source.get_params.cache_info()
+    counters["params hits"] = info.hits
+    counters["params misses"] = info.misses
+    if ctx.cache != None:
+        counters["cache hits"] = ctx.cache.hits
+        counters["cache misses"] = ctx.cache.misses
+    if ctx.dedup != None:
+        counters["dedup hits"] = ctx.dedup.hits
+        counters["dedup saved"] = ctx.dedup.saved
+    return counters
+
+def harvest_file_job(root, file_name, repo, content=None):
+    """ harvests a file in a worker and returns the result (see replay_result).
+        content is the content of the file (as bytes) if it isn't read from the file system (e.g. from git or an archive) """
+    ctx = worker_ctx
+    before = get_counters(ctx)
+    ctx.repo = repo
+    ctx.file = None
+    ctx.lang = LANG
+    ctx.calls = []
+    error = None
+    try:
+        harvest.harvest_file(root, file_name, ctx, (lambda : lmh_source.decode_content(content)) if content != None else None)
+    except Exception as ex:
+        error = ex
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = Exception(f"{type(ex).__name__}: {ex}")
+    after = get_counters(ctx)
+    return {
+        "file" : ctx.file,      # None if the file wasn't harvested
+        "records" : ctx.gatherer.take_records(),
+        "logs" : ctx.calls,
+        "final" : (ctx.mod_name, ctx.mod_type, ctx.lang),
+        "error" : error,
+        "counters" : {key : after[key] - before[key] for key in after},
+    }
+
+def harvest_chunk_job(repo, files):
+    """ harvests the files ((root, file_name, content) triples) of a repo in a worker """
+    return [harvest_file_job(root, file_name, repo, content) for (root, file_name, content) in files]
+
+def replay_result(result, ctx):
+    """ adds the records of a file that was harvested by a worker and logs its messages """
+    counters = result["counters"]
+    for key in lmh_tokenizer.tokenize.statistics:
+        lmh_tokenizer.tokenize.statistics[key] += counters[key]
+    lmh_source.get_params.other_processes["hits"] += counters["params hits"]
+    lmh_source.get_params.other_processes["misses"] += counters["params misses"]
+    if ctx.cache != None:
+        ctx.cache.hits += counters["cache hits"]
+        ctx.cache.misses += counters["cache misses"]
+    if ctx.dedup != None:
+        ctx.dedup.hits += counters["dedup hits"]
+        ctx.dedup.saved += counters["dedup saved"]
+
+    if result["file"] != None:
+        ctx.file = result["file"]
+    for (kind, record) in result["records"]:
+        if getattr(record, "lang", None) == LANG:
+            record.lang = ctx.lang
+        ctx.gatherer.add(kind, ctx.gatherer.intern_record(record))
+    for (positions, args) in result["logs"]:
+        ctx.positions = positions
+        ctx.log(*args)
+    if result["file"] != None:
+        (ctx.mod_name, ctx.mod_type, lang) = result["final"]
+        if lang != LANG:
+            ctx.lang = lang
+    if result["error"] != None:
+        raise result["error"]
+
+
+def gather_data_for_all_repos(directory, ctx):
+    """ like harvest.gather_data_for_all_repos, but the files are harvested by ctx.jobs processes
+        (in an incremental harvest, only the files that have changed, see lmh_incremental.py) """
+    settings = (ctx.mathhub_path, ctx.cache.directory if ctx.cache != None else None,
+                ctx.dedup != None, lmh_tokenizer.get_tokenizer.backend)
+    with multiprocessing.Pool(ctx.jobs, init_worker, settings) as pool:
+        # (repo directory, action, value) with the actions
+        # "begin" (value: (RepoState or None, files or None, see harvest.iter_repos)), "chunk" (AsyncResult for a chunk of files),
+        # "file" ((root, file_name) of an unchanged file, which is replayed by the main process),
+        # "end" (files or None) and "error" (an exception that occurred while the files of the repo were listed or read)
+        steps = collections.deque()
+        failed = set()              # repos for which an error occurred
+        opened = []                 # the files of the repos (see harvest.iter_repos), which are closed in the end
+        def add_step(step):
+            steps.append(step)
+            while len(steps) > LOOKAHEAD * ctx.jobs:
+                process_step(steps.popleft(), ctx, failed)
+        def submit(repo_directory, repo, files):
+            add_step((repo_directory, "chunk", pool.apply_async(harvest_chunk_job, (repo, files))))
+        def walk_repo(repo_directory, repo_files):
+            state = None
+            if repo_files != None:
+                opened.append(repo_files)
+                repo = harvest.get_repo_name(repo_files.directory)
+                file_list = repo_files.iter_files()
+            else:
+                if ctx.incremental != None:
+                    state = ctx.incremental.get_repo_state(repo_directory)
+                repo = harvest.get_repo_name(repo_directory)
+                file_list = ((root, file_name, None) for (root, file_name) in harvest.iter_repo_files(repo_directory))
+            steps.append((repo_directory, "begin", (state, repo_files)))
+            files = []
+            for (root, file_name, key) in file_list:
+                if not harvest.harvest_file.file_regex.match(file_name):
+                    continue
+                if state != None and state.is_unchanged(os.path.join(root, file_name)):
+                    if files:
+                        submit(repo_directory, repo, files)
+                        files = []
+                    add_step((repo_directory, "file", (root, file_name)))
+                    continue
+                files.append((root, file_name, repo_files.read_blob(key) if repo_files != None else None))
+                if len(files) == CHUNK_SIZE:
+                    submit(repo_directory, repo, files)
+                    files = []
+            if files:
+                submit(repo_directory, repo, files)
+            steps.append((repo_directory, "end", repo_files))
+        try:
+            for (repo_directory, repo_files) in harvest.iter_repos(directory, ctx):
+                try:
+                    walk_repo(repo_directory, repo_files)
+                except Exception as ex:
+                    add_step((repo_directory, "error", ex))
+        except Exception:
+            # a serial harvest would have processed the files before the error
+            while steps:
+                process_step(steps.popleft(), ctx, failed)
+            raise
+        else:
+            while steps:
+                process_step(steps.popleft(), ctx, failed)
+        finally:
+            for repo_files in opened:
+                repo_files.close()
+    ctx.inventory.save()
+
+def process_step(step, ctx, failed):
+    (repo_directory, action, value) = step
+    if repo_directory in failed:
+        return
+    try:
+        if action == "begin":
+            (state, files) = value
+            if files != None:
+                ctx.repo = harvest.get_repo_name(files.directory)
+                harvest.harvest_repo_metadata(files.directory, ctx, files)
+            else:
+                ctx.repo = harvest.get_repo_name(repo_directory)
+                harvest.harvest_repo_metadata(repo_directory, ctx)
+            if ctx.incremental != None:
+                ctx.incremental.current = state
+        elif action == "chunk":
+            for file_result in value.get():
+                if ctx.incremental != None and ctx.incremental.current != None and file_result["file"] != None:
+                    ctx.incremental.record(file_result["file"], ctx, lambda : replay_result(file_result, ctx))
+                else:
+                    replay_result(file_result, ctx)
+        elif action == "file":
+            harvest.harvest_file(*value, ctx)
+        elif action == "end":
+            if ctx.incremental != None:
+                ctx.incremental.end_repo()
+            if value != None:
+                value.close()
+        elif action == "error":
+            raise value
+    except Exception as ex:
+        failed.add(repo_directory)
+        harvest.log_repo_error(repo_directory, ex, ctx)
@@ -0,0 +1,119 @@
+"""
+The records that are collected by the DataGatherer of lmh_harvest.py
+(in a separate module, so that they can be pickled independently of which script is run).
+"""
+
+import collections.abc
+
+
+class Record(collections.abc.Mapping):
+    """ Base class for the records of the DataGatherer (e.g. a defi).
+        The fields are stored in __slots__, which takes much less memory than a dict per record
+        (there are a lot of trefis in MathHub).
+        For compatibility, records can still be used like (read-only) dictionaries,
+        e.g. record["name"] or record.get("lang").
+        The keys are the __slots__ of the subclass (in that order).
+        For a memory comparison with dicts run benchmarks/records.py. """
+    __slots__ = ()
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.fields = tuple(cls.__slots__) + cls.computed_fields
+        # the slots of the class and its base classes
+        cls.all_slots = tuple(slot for c in cls.__mro__ for slot in getattr(c, "__slots__", ()))
+
+    computed_fields = ()    # fields that are properties of the class instead of slots
+
+    def __init__(self, **entries):
+        for field in self.__slots__:
+            setattr(self, field, entries[field])
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def replace(self, **changes):
+        """ returns a copy of the record with the given fields changed """
+        record = object.__new__(type(self))
+        for field in self.all_slots:
+            setattr(record, field, changes[field] if field in changes else getattr(self, field))
+        return record
+
+class PositionedRecord(Record):
+    """ A record for something at a position in a file.
+        The position is stored as integer offset ("pos") into the (preprocessed) file content.
+        For compatibility, record["offset"] still returns "line:col",
+        but it is only computed when it is requested. """
+    __slots__ = ("positions",)
+    computed_fields = ("offset",)
+
+    def __init__(self, positions, **entries):
+        Record.__init__(self, **entries)
+        self.positions = positions
+
+    @property
+    def offset(self):
+        return self.positions.get_pos_str(self.pos)
+
+    def get_position(self):
+        """ returns (line, column) of the record """
+        return self.positions.get_position(self.pos)
+
+class RepoRecord(Record):
+    __slots__ = ("repo", "namespace")
+
+class SigfileRecord(Record):
+    __slots__ = ("type", "path", "repo", "align", "mod_name")
+
+class ModuleRecord(Record):
+    __slots__ = ("path", "repo", "mod_name")
+
+class LangfileRecord(Record):
+    __slots__ = ("type", "path", "repo", "mod_name", "lang")
+
+class DefiRecord(PositionedRecord):
+    __slots__ = ("mod_name", "repo", "lang", "name", "string", "pos", "path", "params")
+
+class SymiRecord(PositionedRecord):
+    __slots__ = ("mod_name", "repo", "name", "pos", "path", "type", "noverb", "align", "params", "implicit")
+
+class TrefiRecord(PositionedRecord):
+    __slots__ = ("mod_name", "mod_type", "repo", "pos", "lang", "path", "name", "target_mod", "drefi")
+
+class ImportmhmoduleRecord(Record):
+    __slots__ = ("mod_name", "repo", "path", "type", "dest_repo", "dest_path")
+
+class MhinputrefRecord(Record):
+    __slots__ = ("mod_name", "repo", "path", "dest_repo", "dest_path")
+
+class TextfileRecord(Record):
+    __slots__ = ("repo", "path")
+
+class GimportRecord(Record):
+    __slots__ = ("mod_name", "mod_type", "repo", "path", "type", "dest_repo", "dest_mod")
+
+# the record type for every list of the DataGatherer
+RECORD_TYPES = {
+    "repos" : RepoRecord,
+    "sigfiles" : SigfileRecord,
+    "modules" : ModuleRecord,
+    "langfiles" : LangfileRecord,
+    "defis" : DefiRecord,
+    "symis" : SymiRecord,
+    "trefis" : TrefiRecord,
+    "importmhmodules" : ImportmhmoduleRecord,
+    "mhinputrefs" : MhinputrefRecord,
+    "textfiles" : TextfileRecord,
+    "gimports" : GimportRecord,
+}
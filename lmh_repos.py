@@ -0,0 +1,176 @@
+"""
+Discovery of the git repositories in MathHub (used by lmh_harvest.py, minimathhub.py and lmhtools2).
+
+A directory is a repository if it contains a .git directory
+(or, if bare repositories are searched as well, if it is a bare repository).
+The repositories are found by walking the directories with os.scandir,
+which provides the types of the entries without an extra stat call per entry,
+and the walk doesn't descend into a repository once it is found.
+
+The RepoInventory remembers the result of the walk (for every directory: is it a repository,
+is it a bare repository, and which subdirectories does it have) together with the modification time of the directory.
+As adding or removing an entry changes the modification time of a directory,
+a later walk only has to stat the directories (instead of listing them) as long as nothing has changed.
+Data that is read from the files of the repositories (e.g. META-INF/MANIFEST.MF, see get_manifest)
+is remembered together with the modification time and size of the file.
+If the inventory has a cache file (e.g. repos.json in the harvest cache directory),
+it is loaded from it and stored in it again with save().
+"""
+
+import json
+import os
+import re
+import stat
+import tempfile
+import time
+
+
+FORMAT = "lmh-repos"
+VERSION = 2
+
+CACHE_FILE = "repos.json"
+
+MANIFEST = os.path.join("META-INF", "MANIFEST.MF")
+
+def get_default_cache_file():
+    """ returns the cache file in the directory $LMH_CACHE (or None if it isn't set, see lmh_cache.py) """
+    directory = os.environ.get("LMH_CACHE")
+    return os.path.join(directory, CACHE_FILE) if directory else None
+
+def skip_meta_inf(directory, name):
+    """ the default for which subdirectories are not searched for repositories """
+    return name == "meta-inf"
+
+def is_stable(mtime):
+    """ files and directories that were modified just now could be modified again without changing the mtime,
+        so they are checked again next time """
+    return time.time_ns() - mtime > 2 * 10**9
+
+
+def read_manifest(path):
+    """ returns the properties (e.g. "id" or "dependencies") in a META-INF/MANIFEST.MF file """
+    properties = {}
+    with open(path, "r") as fp:
+        for line in fp:
+            if ":" not in line:
+                continue
+            properties[line[:line.index(":")].strip()] = line[line.index(":")+1:].strip()
+    return properties
+
+
+class RepoInventory(object):
+    """ Finds repositories and remembers them (see the module documentation) """
+    def __init__(self, cache_file = None):
+        self.cache_file = cache_file
+        self.directories = {}       # absolute path -> {"mtime" : ..., "repo" : bool, "bare" : bool, "subdirs" : [names]}
+        self.files = {}             # name of the data -> absolute path -> [stamp of the file, data]
+        self.changed = False
+        if cache_file != None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as fp:
+                content = json.load(fp)
+        except Exception:   # a missing or broken cache file is just empty
+            return
+        if content.get("format") == FORMAT and content.get("version") == VERSION:
+            self.directories = content["directories"]
+            self.files = content["files"]
+
+    def save(self):
+        """ stores the inventory in the cache file (if there is one and something has changed) """
+        if self.cache_file == None or not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(directory, exist_ok = True)
+        (fd, tmp_path) = tempfile.mkstemp(dir = directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            json.dump({"format" : FORMAT, "version" : VERSION,
+                       "directories" : self.directories, "files" : self.files}, fp)
+        os.replace(tmp_path, self.cache_file)
+        self.changed = False
+
+    def get_directory(self, directory, status):
+        """ returns the entry of a directory (status is the result of os.stat) """
+        key = os.path.abspath(directory)
+        entry = self.directories.get(key)
+        if entry != None and entry["mtime"] == status.st_mtime_ns:
+            return entry
+
+        is_repo = False
+        has_head = False
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for dir_entry in entries:
+                if dir_entry.is_dir():
+                    if dir_entry.name == ".git":
+                        is_repo = True
+                    subdirs.append(dir_entry.name)
+                elif dir_entry.name == "HEAD":
+                    has_head = True
+        entry = {
+            "mtime" : status.st_mtime_ns if is_stable(status.st_mtime_ns) else None,
+            "repo" : is_repo,
+            "bare" : not is_repo and has_head and "objects" in subdirs and "refs" in subdirs,
+            "subdirs" : [] if is_repo else subdirs,
+        }
+        self.directories[key] = entry
+        self.changed = True
+        return entry
+
+    def find_repos(self, directory, skip = skip_meta_inf, bare = False):
+        """ recursively finds git repos in directory and yields their paths (in the order of os.scandir).
+            Subdirectories for which skip(directory, name) is true are not searched.
+            If bare is set, bare repositories are found as well. """
+        status = os.stat(directory)
+        yield from self.walk(directory, status, skip, bare)
+
+    def walk(self, directory, status, skip, bare):
+        entry = self.get_directory(directory, status)
+        if entry["repo"] or (bare and entry["bare"]):
+            yield directory
+            return
+
+        for name in entry["subdirs"]:
+            if skip(directory, name):
+                continue
+            subdirpath = os.path.join(directory, name)
+            try:
+                status = os.stat(subdirpath)
+            except OSError:     # removed in the meantime (or a broken symbolic link)
+                continue
+            if stat.S_ISDIR(status.st_mode):
+                yield from self.walk(subdirpath, status, skip, bare)
+
+    def get_file_data(self, name, path, read):
+        """ returns read(path) for a file, which is remembered (as name) as long as the file doesn't change.
+            The data has to be JSON-serializable. Returns None if there is no such file. """
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(status.st_mode):
+            return None
+        stamp = [status.st_mtime_ns, status.st_size]
+        key = os.path.abspath(path)
+        cached = self.files.get(name, {}).get(key)
+        if cached != None and cached[0] == stamp:
+            return cached[1]
+
+        data = read(path)
+        if is_stable(status.st_mtime_ns):
+            self.files.setdefault(name, {})[key] = [stamp, data]
+            self.changed = True
+        return data
+
+    def get_manifest(self, repo_directory):
+        """ returns the properties in the META-INF/MANIFEST.MF file of a repo (or None if it doesn't exist) """
+        return self.get_file_data("manifest", os.path.join(repo_directory, MANIFEST), read_manifest)
+
+    def get_dependencies(self, repo_directory):
+        """ returns the repos in the dependencies of the manifest of a repo """
+        manifest = self.get_manifest(repo_directory)
+        if not manifest or not manifest.get("dependencies"):
+            return []
+        return re.split(r",\s*", manifest["dependencies"])
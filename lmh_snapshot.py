@@ -0,0 +1,302 @@
+"""
+Snapshots of harvested data.
+
+A snapshot is created with `lmh_harvest.py --snapshot FILE ...` (JSON Lines)
+or `lmh_harvest.py --binary-snapshot FILE ...` and can be loaded by other scripts
+(e.g. `lmh_debug.py --snapshot FILE`) instead of harvesting MathHub again.
+
+JSON Lines snapshots:
+The first line is a header (with the MathHub directory).
+Every other line is a JSON object with a "kind":
+either a kind of record (e.g. "defis", see lmh_records.RECORD_TYPES) with the fields of the record,
+or "positions" with the line starts of a file, which are referenced by the records from that file
+(so that record["offset"] still works after loading).
+
+Binary snapshots:
+They are meant to be memory-mapped (see BinarySnapshot), so that several processes
+can share one copy through the page cache and records are only decoded when they are accessed.
+The file starts with BINARY_MAGIC, the length of a JSON header (4 bytes)
+and the JSON header, which describes the sections of the file (offset and size in bytes).
+All strings are stored only once in a string table (the "string_offsets" and "string_data" sections).
+For every kind of record, there is a section with a fixed-width row per record,
+which has an unsigned 32-bit integer for every column (see get_binary_columns):
+string fields are stored as indices into the string table (NO_STRING for None),
+"pos" as an integer, and the lists, dictionaries and booleans as JSON in the string table.
+The line starts of the files are stored in the "lines" section
+and referenced by the "positions" section (start, count, length per file).
+"""
+
+import collections.abc
+import functools
+import json
+import mmap
+import sys
+import types
+from array import array
+
+import lmh_records
+import lmh_source
+
+
+FORMAT = "lmh-snapshot"
+VERSION = 1
+
+def encode_value(value):
+    if isinstance(value, types.MappingProxyType):
+        return dict(value)
+    return value
+
+def write_snapshot(gatherer, path, mathhub_dir = None):
+    """ writes all records of the gatherer to a snapshot file """
+    positions_ids = {}      # id(PositionIndex) -> id in the snapshot
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(json.dumps({"format" : FORMAT, "version" : VERSION, "mathhub" : mathhub_dir}) + "\n")
+        for kind in lmh_records.RECORD_TYPES:
+            for record in getattr(gatherer, kind):
+                line = {"kind" : kind}
+                if isinstance(record, lmh_records.PositionedRecord):
+                    positions = record.positions
+                    if id(positions) not in positions_ids:
+                        positions_ids[id(positions)] = len(positions_ids)
+                        fp.write(json.dumps({
+                                "kind" : "positions",
+                                "id" : positions_ids[id(positions)],
+                                "length" : positions.length,
+                                "line_starts" : positions.line_starts.tolist(),
+                            }) + "\n")
+                    line["positions"] = positions_ids[id(positions)]
+                for field in record.__slots__:
+                    line[field] = encode_value(getattr(record, field))
+                fp.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+def is_binary_snapshot(path):
+    with open(path, "rb") as fp:
+        return fp.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def open_snapshot(path):
+    """ returns (gatherer, MathHub directory) for a snapshot file,
+        where the gatherer must not be modified (e.g. for lmh_debug.py --snapshot FILE without directories).
+        A binary snapshot is used directly (see BinarySnapshot), so that its records are not copied.
+        The records of a JSON Lines snapshot are loaded into an lmh_harvest.DataGatherer. """
+    if is_binary_snapshot(path):
+        snapshot = BinarySnapshot(path)
+        return (snapshot, snapshot.mathhub_dir)
+    import lmh_harvest
+    gatherer = lmh_harvest.DataGatherer()
+    return (gatherer, load_snapshot(path, gatherer))
+
+def load_snapshot(path, gatherer):
+    """ adds the records from a snapshot file (JSON Lines or binary) to the gatherer
+        (e.g. a new lmh_harvest.DataGatherer, or see open_snapshot if it isn't modified afterwards).
+        Returns the MathHub directory from the header. """
+    if is_binary_snapshot(path):
+        snapshot = BinarySnapshot(path)
+        for kind in lmh_records.RECORD_TYPES:
+            for record in getattr(snapshot, kind):
+                gatherer.add(kind, gatherer.intern_record(record))
+        return snapshot.mathhub_dir
+
+    positions = {}      # id in the snapshot -> PositionIndex
+    with open(path, "r", encoding="utf-8") as fp:
+        header = json.loads(fp.readline())
+        if header.get("format") != FORMAT or header.get("version") != VERSION:
+            raise Exception(f"{path} is not a snapshot (version {VERSION})")
+        for line in fp:
+            entries = json.loads(line)
+            kind = entries.pop("kind")
+            if kind == "positions":
+                positions[entries["id"]] = lmh_source.PositionIndex.from_line_starts(entries["line_starts"], entries["length"])
+                continue
+            record_type = lmh_records.RECORD_TYPES[kind]
+            if "params" in entries:
+                entries["params"] = types.MappingProxyType(entries["params"])
+            if issubclass(record_type, lmh_records.PositionedRecord):
+                record = record_type(positions[entries.pop("positions")], **entries)
+            else:
+                record = record_type(**entries)
+            gatherer.add(kind, gatherer.intern_record(record))
+    return header["mathhub"]
+
+
+BINARY_MAGIC = b"LMHSNAP\0"
+BINARY_VERSION = 1
+NO_STRING = 0xFFFFFFFF
+
+# fields that are not stored as strings
+INTEGER_FIELDS = ["pos"]
+JSON_FIELDS = ["params", "noverb", "implicit", "drefi"]
+
+def get_binary_columns(kind):
+    """ the columns of the rows of a kind in a binary snapshot """
+    record_type = lmh_records.RECORD_TYPES[kind]
+    if issubclass(record_type, lmh_records.PositionedRecord):
+        return ("positions",) + record_type.__slots__
+    return record_type.__slots__
+
+def write_binary_snapshot(gatherer, path, mathhub_dir = None):
+    """ writes all records of the gatherer to a binary snapshot file """
+    strings = {}            # string -> index in the string table
+    def get_string_id(string):
+        if string == None:
+            return NO_STRING
+        if string not in strings:
+            strings[string] = len(strings)
+        return strings[string]
+
+    positions_ids = {}      # id(PositionIndex) -> index in the positions section
+    positions_rows = array("Q")
+    lines = array("q")
+    tables = {}
+    for kind in lmh_records.RECORD_TYPES:
+        table = array("I")
+        for record in getattr(gatherer, kind):
+            for column in get_binary_columns(kind):
+                if column == "positions":
+                    positions = record.positions
+                    if id(positions) not in positions_ids:
+                        positions_ids[id(positions)] = len(positions_ids)
+                        positions_rows.extend([len(lines), len(positions.line_starts), positions.length])
+                        lines.extend(array("q", positions.line_starts))
+                    table.append(positions_ids[id(positions)])
+                elif column in INTEGER_FIELDS:
+                    table.append(getattr(record, column))
+                elif column in JSON_FIELDS:
+                    table.append(get_string_id(json.dumps(encode_value(getattr(record, column)), ensure_ascii=False)))
+                else:
+                    table.append(get_string_id(getattr(record, column)))
+        tables[kind] = table
+
+    string_offsets = array("Q", [0])
+    string_data = bytearray()
+    for string in strings:
+        string_data += string.encode("utf-8")
+        string_offsets.append(len(string_data))
+
+    sections = [("string_offsets", string_offsets.tobytes()), ("string_data", bytes(string_data)),
+                ("positions", positions_rows.tobytes()), ("lines", lines.tobytes())]
+    sections += [(kind, tables[kind].tobytes()) for kind in tables]
+
+    # the offsets of the sections are relative to the end of the header (aligned to 8 bytes)
+    layout = {}
+    offset = 0
+    for (name, data) in sections:
+        layout[name] = (offset, len(data))
+        offset += len(data) + (-len(data) % 8)
+    header = json.dumps({"version" : BINARY_VERSION, "byteorder" : sys.byteorder, "mathhub" : mathhub_dir,
+                         "sections" : layout, "columns" : {kind : get_binary_columns(kind) for kind in tables}})
+
+    with open(path, "wb") as fp:
+        fp.write(BINARY_MAGIC)
+        fp.write(len(header).to_bytes(4, "little"))
+        fp.write(header.encode("utf-8"))
+        fp.write(b"\0" * (-fp.tell() % 8))
+        for (name, data) in sections:
+            fp.write(data)
+            fp.write(b"\0" * (-len(data) % 8))
+
+
+class BinarySnapshot(object):
+    """
+    A memory-mapped binary snapshot, which can be used like a DataGatherer that is not modified anymore:
+    The record lists (e.g. snapshot.defis) are sequences of records, which are decoded when they are accessed,
+    and there are index and lookup (see lmh_harvest.DataGatherer).
+    """
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.mm[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            raise Exception(f"{path} is not a binary snapshot")
+        header_length = int.from_bytes(self.mm[len(BINARY_MAGIC):len(BINARY_MAGIC) + 4], "little")
+        header = json.loads(self.mm[len(BINARY_MAGIC) + 4:len(BINARY_MAGIC) + 4 + header_length])
+        self.data_start = len(BINARY_MAGIC) + 4 + header_length
+        self.data_start += -self.data_start % 8
+        if header["version"] != BINARY_VERSION or header["byteorder"] != sys.byteorder:
+            raise Exception(f"{path} is not a binary snapshot (version {BINARY_VERSION}, {sys.byteorder} endian)")
+        self.mathhub_dir = header["mathhub"]
+
+        self.string_offsets = self.get_section(header, "string_offsets", "Q")
+        self.string_data = self.get_section(header, "string_data", "B")
+        self.positions_rows = self.get_section(header, "positions", "Q")
+        self.lines = self.get_section(header, "lines", "q")
+        for kind in lmh_records.RECORD_TYPES:
+            setattr(self, kind, RecordArray(self, kind, self.get_section(header, kind, "I")))
+
+        self.get_string = functools.lru_cache(maxsize = 2**16)(self.load_string)
+        self.get_positions = functools.lru_cache(maxsize = 256)(self.load_positions)
+        self.indexes = {}
+
+    def get_section(self, header, name, format_):
+        (offset, length) = header["sections"][name]
+        offset += self.data_start
+        return memoryview(self.mm)[offset:offset + length].cast(format_)
+
+    def load_string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]]).decode("utf-8")
+
+    def load_positions(self, positions_id):
+        (start, count, length) = self.positions_rows[3 * positions_id:3 * positions_id + 3]
+        return lmh_source.PositionIndex.from_line_starts(self.lines[start:start + count], length)
+
+    def decode_value(self, column, value):
+        if column in INTEGER_FIELDS:
+            return value
+        if column in JSON_FIELDS:
+            value = json.loads(self.get_string(value))
+            return types.MappingProxyType(value) if column == "params" else value
+        return self.get_string(value)
+
+    def index(self, kind, *fields):
+        """ returns the records of a kind partitioned by the values of the fields (see DataGatherer.index) """
+        if (kind, fields) not in self.indexes:
+            index = {}
+            for record in getattr(self, kind):
+                key = tuple(record[field] for field in fields) if len(fields) > 1 else record[fields[0]]
+                if key in index:
+                    index[key].append(record)
+                else:
+                    index[key] = [record]
+            self.indexes[(kind, fields)] = index
+        return self.indexes[(kind, fields)]
+
+    def lookup(self, kind, **key):
+        values = tuple(key.values())
+        return self.index(kind, *key).get(values if len(values) > 1 else values[0], [])
+
+
+class RecordArray(collections.abc.Sequence):
+    """ The records of a kind in a BinarySnapshot (e.g. snapshot.defis) """
+    def __init__(self, snapshot, kind, rows):
+        self.snapshot = snapshot
+        self.record_type = lmh_records.RECORD_TYPES[kind]
+        self.columns = get_binary_columns(kind)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows) // len(self.columns)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("record index out of range")
+        width = len(self.columns)
+        values = self.rows[i * width:(i + 1) * width].tolist()
+        entries = {column : self.snapshot.decode_value(column, value)
+                        for (column, value) in zip(self.columns, values) if column != "positions"}
+        if self.columns[0] == "positions":
+            return self.record_type(self.snapshot.get_positions(values[0]), **entries)
+        return self.record_type(**entries)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
@@ -0,0 +1,146 @@
+"""
+Helpers for working with the content of source files
+(used by lmh_harvest.py and lmhtools2).
+
+For a comparison of strip_comment_lines with the previous implementation
+run benchmarks/preprocess.py.
+"""
+
+from array import array
+from bisect import bisect_right
+import functools
+import io
+import re
+import types
+
+
+class PositionIndex(object):
+    """
+    Converts string offsets into (line, column) pairs (both starting at 1).
+    Only the offsets of the line starts are stored,
+    and positions are found with a binary search.
+    """
+    def __init__(self, string):
+        self.length = len(string)
+        self.line_starts = array("l", [0])
+        self.line_starts.extend(match.end() for match in PositionIndex.re_newline.finditer(string))
+
+    re_newline = re.compile("\n")
+
+    @classmethod
+    def from_line_starts(cls, line_starts, length):
+        """ creates a PositionIndex from stored line starts (see lmh_snapshot.py) """
+        index = cls.__new__(cls)
+        index.length = length
+        index.line_starts = array("l", line_starts)
+        return index
+
+    def __check(self, offset):
+        # like indexing a list of positions (the end of the string is permitted as well)
+        if not -self.length <= offset <= self.length:
+            raise IndexError("offset out of range")
+        return offset if offset >= 0 else offset + self.length
+
+    def get_position(self, offset):
+        """ returns (line, column) for an offset """
+        offset = self.__check(offset)
+        line = bisect_right(self.line_starts, offset)
+        return (line, offset - self.line_starts[line - 1] + 1)
+
+    def get_pos_str(self, offset):
+        """ returns "line:column" for an offset """
+        (line, col) = self.get_position(offset)
+        return f"{line}:{col}"
+
+    def get_positions(self, offsets):
+        """ returns (line, column) pairs for a sequence of offsets
+            (the offsets are converted in a single sorted sweep) """
+        offsets = [self.__check(offset) for offset in offsets]
+        positions = [None] * len(offsets)
+        line_starts = self.line_starts
+        line = 1
+        for i in sorted(range(len(offsets)), key = offsets.__getitem__):
+            offset = offsets[i]
+            while line < len(line_starts) and line_starts[line] <= offset:
+                line += 1
+            positions[i] = (line, offset - line_starts[line - 1] + 1)
+        return positions
+
+
+def decode_content(content):
+    """ decodes the content of a file (bytes, e.g. from git or an archive) like open(path, "r") would
+        (with the default encoding and universal newlines) """
+    return io.TextIOWrapper(io.BytesIO(content)).read()
+
+
+def strip_comment_lines(string, with_offset_map = False):
+    """
+    Removes the content of comment lines (lines starting with '%' after spaces and tabs),
+    but keeps the linebreaks to maintain line numbers.
+    The last line is only removed if it ends with a linebreak.
+    If with_offset_map is set, an OffsetMap to the original string is returned as well.
+    """
+    if "%" not in string:
+        return (string, OffsetMap([], [])) if with_offset_map else string
+    lines = string.split("\n")
+    stripped = []           # indices of the stripped lines
+    for i in range(len(lines) - 1):
+        if lines[i].lstrip(" \t").startswith("%"):
+            stripped.append(i)
+    if not with_offset_map:
+        for i in stripped:
+            lines[i] = ""
+        return "\n".join(lines)
+
+    # after every stripped line, the offsets are shifted
+    new_starts = []
+    old_starts = []
+    old_offset = 0
+    new_offset = 0
+    stripped = set(stripped)
+    for (i, line) in enumerate(lines):
+        if i in stripped:
+            # the linebreak of the line is at new_offset now
+            new_starts.append(new_offset)
+            old_starts.append(old_offset + len(line))
+            lines[i] = ""
+        old_offset += len(line) + 1
+        new_offset += len(lines[i]) + 1
+    return ("\n".join(lines), OffsetMap(new_starts, old_starts))
+
+
+class OffsetMap(object):
+    """ Maps offsets in a preprocessed string back to offsets in the original string """
+    def __init__(self, new_starts, old_starts):
+        # offsets in the preprocessed string from which on the original offsets are shifted
+        self.new_starts = array("l", new_starts)
+        self.old_starts = array("l", old_starts)
+
+    def get_original_offset(self, offset):
+        i = bisect_right(self.new_starts, offset)
+        if i == 0:
+            return offset
+        return self.old_starts[i - 1] + offset - self.new_starts[i - 1]
+
+
+@functools.lru_cache(maxsize=4096)
+def get_params(param_str):
+    """
+    Returns a dictionary of comma-separated key=value pairs.
+    The same parameter strings occur over and over again (e.g. 'mhrepos=smglom/sets'),
+    so the results are cached and shared. Therefore, they are read-only (MappingProxyType).
+    get_params.cache_info() tells how many calls were answered from the cache.
+    """
+    if param_str == None:
+        return get_params.no_params
+
+    return types.MappingProxyType({
+            param.group("key") : param.group("val")
+                for param in get_params.re_param.finditer(param_str)
+        })
+
+get_params.no_params = types.MappingProxyType({ })
+get_params.other_processes = {"hits" : 0, "misses" : 0}    # cache statistics of the workers (see lmh_parallel.py)
+get_params.re_param = re.compile(
+        r"(?P<key>[a-zA-Z0-9_-]+)"
+        r"(?:=(?P<val>(?:[^\{\},]+)|(?:\{[^\{\}]+\})))?")
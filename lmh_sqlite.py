@@ -0,0 +1,211 @@
+"""
+A DataGatherer that stores the records in an SQLite database instead of lists in memory,
+so that the whole of MathHub can be harvested with bounded memory.
+
+The records of a file are inserted together, and they are committed after every repository.
+The record lists (e.g. gatherer.defis) and the indexes (gatherer.index, gatherer.lookup)
+can be used like the ones of lmh_harvest.DataGatherer,
+but they query the database (with SQL indexes) whenever they are used.
+The database is cleared when a SqliteGatherer is created for it.
+"""
+
+import collections.abc
+import functools
+import json
+import pickle
+import sqlite3
+import types
+
+import lmh_harvest
+import lmh_records
+
+
+# fields whose values are converted for the database: field -> (encode, decode)
+CONVERSIONS = {
+    "params" : (lambda params : json.dumps(dict(params)), lambda s : types.MappingProxyType(json.loads(s))),
+    "noverb" : (json.dumps, json.loads),      # a list or a string
+    "implicit" : (int, bool),
+    "drefi" : (int, bool),
+}
+
+def encode(field, value):
+    return CONVERSIONS[field][0](value) if field in CONVERSIONS and value != None else value
+
+def decode(field, value):
+    return CONVERSIONS[field][1](value) if field in CONVERSIONS and value != None else value
+
+def get_columns(kind):
+    return lmh_records.RECORD_TYPES[kind].__slots__
+
+def quote(field):
+    return '"' + field + '"'
+
+def get_condition(fields):
+    # 'IS' instead of '=', so that None (NULL) values can be looked up as well
+    return " AND ".join(f"{quote(field)} IS ?" for field in fields)
+
+
+class SqliteGatherer(lmh_harvest.DataGatherer):
+    """ A DataGatherer that stores the records in an SQLite database (see module description) """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.added = None           # if it is a list, added records are recorded in it (for the cache)
+
+        self.batch = {}             # kind -> rows that haven't been inserted yet
+        self.batch_path = None      # the file of the records in the batch
+        self.batch_positions = None # the PositionIndex of that file
+        self.repo = None            # the repo since the last commit
+
+        for kind in lmh_records.RECORD_TYPES:
+            self.connection.execute(f"DROP TABLE IF EXISTS {kind}")
+            self.connection.execute(f"CREATE TABLE {kind} ({', '.join(quote(c) for c in get_columns(kind))})")
+            setattr(self, kind, RecordTable(self, kind))
+        self.connection.execute("DROP TABLE IF EXISTS positions")
+        self.connection.execute("CREATE TABLE positions (path TEXT PRIMARY KEY, data BLOB)")
+        for kind in lmh_harvest.DataGatherer.INDEXES:
+            for fields in lmh_harvest.DataGatherer.INDEXES[kind]:
+                self.create_index(kind, fields)
+        self.connection.commit()
+
+        self.get_positions = functools.lru_cache(maxsize = 64)(self.load_positions)
+
+    def intern(self, string):
+        # the strings are stored in the database anyway
+        return string
+
+    def intern_record(self, record):
+        return record
+
+    def create_index(self, kind, fields):
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS {kind}_by_{'_'.join(fields)} "
+                                f"ON {kind} ({', '.join(quote(field) for field in fields)})")
+
+    def add(self, kind, record):
+        """ adds a record of a kind (e.g. "defis") to the batch of the current file """
+        path = getattr(record, "path", None)
+        if path != self.batch_path:
+            self.flush()
+            self.batch_path = path
+        if record.repo != self.repo:
+            self.flush()
+            self.connection.commit()
+            self.repo = record.repo
+        if isinstance(record, lmh_records.PositionedRecord):
+            self.batch_positions = record.positions
+        if kind not in self.batch:
+            self.batch[kind] = []
+        self.batch[kind].append(tuple(encode(field, getattr(record, field)) for field in get_columns(kind)))
+        if self.added != None:
+            self.added.append((kind, record))
+
+    def flush(self):
+        """ inserts the batch into the database """
+        for kind in self.batch:
+            columns = get_columns(kind)
+            self.connection.executemany(f"INSERT INTO {kind} VALUES ({', '.join('?' * len(columns))})",
+                                        self.batch[kind])
+        if self.batch_positions != None:
+            self.connection.execute("INSERT OR REPLACE INTO positions VALUES (?, ?)",
+                                    (self.batch_path, pickle.dumps(self.batch_positions)))
+        self.batch = {}
+        self.batch_positions = None
+
+    def commit(self):
+        """ commits the records that were added so far (e.g. of the last repo after the harvest) """
+        self.flush()
+        self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def execute(self, sql, parameters = ()):
+        self.flush()
+        return self.connection.execute(sql, parameters)
+
+    def load_positions(self, path):
+        row = self.execute("SELECT data FROM positions WHERE path IS ?", (path,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def select(self, kind, fields = (), values = ()):
+        """ returns an iterator over the records of a kind with the given values of the fields """
+        columns = get_columns(kind)
+        record_type = lmh_records.RECORD_TYPES[kind]
+        positioned = issubclass(record_type, lmh_records.PositionedRecord)
+        sql = f"SELECT {', '.join(quote(c) for c in columns)} FROM {kind}"
+        if fields:
+            sql += " WHERE " + get_condition(fields)
+        sql += " ORDER BY rowid"
+        for row in self.execute(sql, [encode(field, value) for (field, value) in zip(fields, values)]):
+            entries = {column : decode(column, value) for (column, value) in zip(columns, row)}
+            if positioned:
+                yield record_type(self.get_positions(entries["path"]), **entries)
+            else:
+                yield record_type(**entries)
+
+    def index(self, kind, *fields):
+        """ returns the records of a kind partitioned by the values of the fields (see DataGatherer.index).
+            The returned RecordIndex queries the database when it is used. """
+        self.create_index(kind, fields)
+        return RecordIndex(self, kind, fields)
+
+
+class RecordTable(object):
+    """ The records of a kind in the database (e.g. gatherer.defis), which can be iterated like a list """
+    def __init__(self, gatherer, kind):
+        self.gatherer = gatherer
+        self.kind = kind
+
+    def __iter__(self):
+        return self.gatherer.select(self.kind)
+
+    def __len__(self):
+        return self.gatherer.execute(f"SELECT COUNT(*) FROM {self.kind}").fetchone()[0]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+
+class RecordIndex(collections.abc.Mapping):
+    """ An index of a SqliteGatherer (see SqliteGatherer.index).
+        The keys are in the order in which they occurred first (as for DataGatherer.index). """
+    def __init__(self, gatherer, kind, fields):
+        self.gatherer = gatherer
+        self.kind = kind
+        self.fields = fields
+
+    def get_values(self, key):
+        if len(self.fields) == 1:
+            return (key,)
+        if not isinstance(key, tuple) or len(key) != len(self.fields):
+            raise KeyError(key)
+        return key
+
+    def __getitem__(self, key):
+        records = list(self.gatherer.select(self.kind, self.fields, self.get_values(key)))
+        if not records:
+            raise KeyError(key)
+        return records
+
+    def __contains__(self, key):
+        try:
+            values = self.get_values(key)
+        except KeyError:
+            return False
+        sql = f"SELECT 1 FROM {self.kind} WHERE {get_condition(self.fields)} LIMIT 1"
+        encoded = [encode(field, value) for (field, value) in zip(self.fields, values)]
+        return self.gatherer.execute(sql, encoded).fetchone() != None
+
+    def __iter__(self):
+        columns = ", ".join(quote(field) for field in self.fields)
+        sql = f"SELECT {columns} FROM {self.kind} GROUP BY {columns} ORDER BY MIN(rowid)"
+        for row in self.gatherer.execute(sql):
+            values = tuple(decode(field, value) for (field, value) in zip(self.fields, row))
+            yield values if len(values) > 1 else values[0]
+
+    def __len__(self):
+        columns = ", ".join(quote(field) for field in self.fields)
+        return self.gatherer.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {self.kind} GROUP BY {columns})").fetchone()[0]
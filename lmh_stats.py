@@ -10,19 +10,15 @@ should be displayed during data collection.
 TODO: CREATE TABLE DATA INDEPENDENTLY OF PRESENTATION
 """
 
+import lmh_cache
+import lmh_incremental
 import lmh_harvest as harvest
+import lmh_snapshot
+import lmh_sqlite
+import lmh_tokenizer
 import os
 
 
-def partition(entries, key):
-    result = {}
-    for entry in entries:
-        k = key(entry)
-        if k not in result:
-            result[k] = []
-        result[k].append(entry)
-    return result
-
 def unique_list(l):
     return sorted(list(set(l)))
 
@@ -37,11 +33,11 @@ def print_stats(gatherer):
     repos = unique_list([e["repo"] for e in gatherer.sigfiles + gatherer.langfiles + gatherer.modules])
     langs = unique_list([e["lang"] for e in gatherer.langfiles])
 
-    sigf_part = partition(gatherer.sigfiles, lambda e : (e["repo"]))
-    langf_part = partition(gatherer.langfiles, lambda e : (e["repo"]))
-    symi_part = partition(gatherer.symis, lambda e : (e["repo"]))
-    defi_part = partition(gatherer.defis, lambda e : (e["repo"], e["lang"]))
-    trefi_part = partition(gatherer.trefis, lambda e : e["repo"])
+    sigf_part = gatherer.index("sigfiles", "repo")
+    langf_part = gatherer.index("langfiles", "repo")
+    symi_part = gatherer.index("symis", "repo")
+    defi_part = gatherer.index("defis", "repo", "lang")
+    trefi_part = gatherer.index("trefis", "repo")
 
     print(f"{'repo':20}{'modules':>9}{'aligned':>9}{'symbols':>9}{'aligned':>9}{'trefis':>9}"+"".join([f"{lang:>9}" for lang in langs])+f"{'views':>9}")
     print("-"*(20+9+9+9+9+9+9+9*len(langs)))
@@ -84,7 +80,7 @@ def print_stats(gatherer):
     symbols = len(set([(e["mod_name"], e["name"]) for e in gatherer.symis]))
     aligned_symbols = len(set([(e["mod_name"], e["name"]) for e in gatherer.symis if e["align"] and e["align"] != "noalign"]))
     for lang in langs:
-        verbs = len(set([(e["mod_name"], e["name"]) for e in gatherer.defis if e["lang"] == lang]))
+        verbs = len(set([(e["mod_name"], e["name"]) for e in gatherer.lookup("defis", lang=lang)]))
         symbols_withverb = len(set([(e["mod_name"], e["name"]) for e in gatherer.symis if e["noverb"] != "all" and lang not in e["noverb"]]))
         suffix += frac2str(verbs, symbols_withverb)
     modsigs = len([e for e in gatherer.sigfiles if e['type']=='modsig'])
@@ -100,11 +96,11 @@ def create_csv(gatherer):
     repos = unique_list([e["repo"] for e in gatherer.sigfiles + gatherer.langfiles + gatherer.modules])
     langs = unique_list([e["lang"] for e in gatherer.langfiles])
 
-    sigf_part = partition(gatherer.sigfiles, lambda e : (e["repo"]))
-    langf_part = partition(gatherer.langfiles, lambda e : (e["repo"]))
-    symi_part = partition(gatherer.symis, lambda e : (e["repo"]))
-    defi_part = partition(gatherer.defis, lambda e : (e["repo"], e["lang"]))
-    trefi_part = partition(gatherer.trefis, lambda e : e["repo"])
+    sigf_part = gatherer.index("sigfiles", "repo")
+    langf_part = gatherer.index("langfiles", "repo")
+    symi_part = gatherer.index("symis", "repo")
+    defi_part = gatherer.index("defis", "repo", "lang")
+    trefi_part = gatherer.index("trefis", "repo")
 
     with open("stats.csv", "w") as fp:
         fp.write("repo, modules, modules aligned, symbols, symbols aligned, total trefis, " + ", ".join([f"coverage {l}" for l in langs]) + ", " + ", ".join([f"synonymity {l}" for l in langs]) + ", views\n")
@@ -146,8 +142,8 @@ def create_csv(gatherer):
         coverages = []
         synonymity = []
         for lang in langs:
-            verbs = len(set([(e["mod_name"], e["name"]) for e in gatherer.defis if e["lang"] == lang]))
-            verb_syns = len(set([(e["mod_name"], e["name"], e["string"]) for e in gatherer.defis if e["lang"] == lang]))
+            verbs = len(set([(e["mod_name"], e["name"]) for e in gatherer.lookup("defis", lang=lang)]))
+            verb_syns = len(set([(e["mod_name"], e["name"], e["string"]) for e in gatherer.lookup("defis", lang=lang)]))
             symbols_withverb = len(set([(e["mod_name"], e["name"]) for e in gatherer.symis if e["noverb"] != "all" and lang not in e["noverb"]]))
             coverages += [str(verbs / symbols_withverb) if symbols_withverb > 0 else "n/a"]
             synonymity += [str(verb_syns / verbs) if verbs > 0 else "n/a"]
@@ -165,16 +161,51 @@ if __name__ == "__main__":
             epilog="Example call: lmh_stats.py -v0 /path/to/MathHub/smglom")
     parser.add_argument("-v", "--verbosity", type=int, default=1, choices=range(4), help="the verbosity (default: 1)")
     parser.add_argument("-c", "--csv", action="store_true", help="generate a CSV table")
-    parser.add_argument("DIRECTORY", nargs="+", help="git repo or higher level directory for which statistics are generated")
+    parser.add_argument("-t", "--tokenizer", choices=lmh_tokenizer.BACKENDS,
+            help="the tokenizer backend (default: regex, or the value of $LMH_TOKENIZER)")
+    parser.add_argument("-C", "--cache", metavar="DIR",
+            help="cache the harvest of files in DIR (e.g. .lmhcache; default: the value of $LMH_CACHE)")
+    parser.add_argument("-I", "--incremental", metavar="DIR",
+            help="only harvest the files of git repos that have changed since the last run with the same DIR (e.g. .lmhstate)")
+    parser.add_argument("-D", "--database", metavar="FILE",
+            help="store the harvested data in the SQLite database FILE instead of in memory")
+    parser.add_argument("-S", "--snapshot", metavar="FILE",
+            help="load the data from a snapshot (see lmh_harvest.py --snapshot) instead of harvesting it")
+    harvest.add_jobs_argument(parser)
+    harvest.add_dedup_argument(parser)
+    parser.add_argument("DIRECTORY", nargs="*", help="git repo or higher level directory for which statistics are generated")
     args = parser.parse_args()
+    if not args.DIRECTORY and not args.snapshot:
+        parser.error("a DIRECTORY or a --snapshot is required")
 
+    if args.tokenizer:
+        lmh_tokenizer.set_backend(args.tokenizer)
     if args.verbosity >= 2:
         print("GATHERING DATA\n")
     logger = harvest.SimpleLogger(args.verbosity)
-    mathhub_dir = harvest.get_mathhub_dir(os.path.abspath(args.DIRECTORY[0]))
-    ctx = harvest.HarvestContext(logger, harvest.DataGatherer(), mathhub_dir)
+    if args.snapshot and not args.DIRECTORY and not args.database:
+        # nothing is added to the data, so a binary snapshot can be used without copying it
+        (gatherer, mathhub_dir) = lmh_snapshot.open_snapshot(args.snapshot)
+    else:
+        gatherer = lmh_sqlite.SqliteGatherer(args.database) if args.database \
+                   else harvest.DataGatherer(indexes=harvest.DataGatherer.INDEXES)
+        if args.snapshot:
+            mathhub_dir = lmh_snapshot.load_snapshot(args.snapshot, gatherer)
+        else:
+            mathhub_dir = harvest.get_mathhub_dir(os.path.abspath(args.DIRECTORY[0]))
+    ctx = harvest.HarvestContext(logger, gatherer, mathhub_dir)
+    if args.cache:
+        ctx.cache = lmh_cache.HarvestCache(args.cache)
+    if args.incremental:
+        ctx.incremental = lmh_incremental.IncrementalHarvest(args.incremental)
+    ctx.jobs = args.jobs
+    if args.dedup:
+        ctx.dedup = harvest.FileDeduplicator()
     for directory in args.DIRECTORY:
         harvest.gather_data_for_all_repos(directory, ctx)
+    if args.database:
+        gatherer.commit()   # the records are only committed when the next repo starts
+    harvest.log_statistics(logger, ctx.cache, ctx.dedup, ctx.incremental, ctx.suppressed)
 
     if args.verbosity >= 2 or logger.something_was_logged:
         print("\n\nSTATISTICS\n")
@@ -0,0 +1,574 @@
+"""
+Tokenizer engine used by lmh_harvest.py and lmhtools2.
+
+Token lists are lists of pairs (regex, token_type).
+Originally, every regex of a token list was run over the whole string
+and the matches were sorted afterwards.
+Instead, the regexes of a token list are combined into a single scanner,
+which finds the candidate positions of all regexes in one pass over the string.
+Scanners are compiled once per token list and cached.
+As the candidates are found in order, the tokens can also be
+produced lazily while the string is scanned (see iter_tokens).
+
+The scanner only contains the 'heads' of the regexes, i.e. the part
+before the first open-ended sub-pattern (like the arguments of a macro).
+At every candidate position, the full regexes are matched as usual.
+This requires that every regex starts with a backslash
+(which is the case for all the sTeX macros and environments we are interested in).
+Otherwise, the tokenizer falls back to running the regexes one by one.
+
+Every regex also gets a literal anchor (e.g. '\\symdef' or '{mhmodnl}'),
+which occurs in every match of it.
+Before tokenizing a string, a quick substring test on the anchors
+determines which regexes can match at all and only these are scanned for.
+
+The {arg} groups at the end of the token regexes (see RE_ARG) are not matched by
+the regex engine: RE_ARG backtracks badly on malformed input (unbalanced braces, stray '$')
+and can't handle nested braces. Instead, only the part before the arguments is
+matched with a regex and the arguments are read by scan_arg (see ArgumentRegex).
+
+Alternatively, a hand-written lexer can be used as backend (see lmh_lexer.py).
+The backend can be selected with set_backend or the environment variable LMH_TOKENIZER.
+"""
+
+import heapq
+import itertools
+import os
+import re
+
+
+_re_quantifier = re.compile(r"(?:[*+?]|\{\d*,?\d*\})[?+]?")
+_re_group_opener = re.compile(r"\((?:\?:|\?P<\w+>)?")
+_re_open_ended = re.compile(r"(?<!\\)(?:\\\\)*(?:\[\^|\.)")
+_re_group_name = re.compile(r"(?<!\\)\(\?P([<=])(\w+)([>)])")
+_re_numbered_backref = re.compile(r"\\[1-9]")
+_re_arg_special = re.compile(r"[\{\}\$]")
+
+# the regex for macro arguments used by the token regexes (e.g. lmh_harvest.re_arg)
+RE_ARG = r"(?:[^\{\}\$]|(?:\$[^\$]+\$)|(\{[^\{\}\$]*\}))+"
+_re_arg_group = re.compile(r"\(\?P<(?P<name>\w+)>" + re.escape(RE_ARG) + r"\)")
+# like RE_ARG, but possessive, so it can't backtrack
+_RE_ARG_POSSESSIVE = r"(?:[^\{\}\$]++|\$[^\$]+\$|\{[^\{\}\$]*\})++"
+
+
+def _skip_class(pattern, i):
+    """ returns the index after the character class starting at pattern[i] """
+    i += 1
+    if pattern[i:i+1] == "^":
+        i += 1
+    if pattern[i:i+1] == "]":   # literal ']'
+        i += 1
+    while i < len(pattern) and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+    return i + 1
+
+def _split(pattern):
+    """ splits a pattern into its top-level alternatives,
+        each of which is a list of pairs (atom, quantifier) """
+    alternatives = [[]]
+    i = 0
+    while i < len(pattern):
+        start = i
+        c = pattern[i]
+        if c == "|":
+            alternatives.append([])
+            i += 1
+            continue
+        if c == "\\":
+            i += 2
+        elif c == "[":
+            i = _skip_class(pattern, i)
+        elif c == "(":
+            depth = 0
+            while i < len(pattern):
+                if pattern[i] == "\\":
+                    i += 2
+                    continue
+                if pattern[i] == "[":
+                    i = _skip_class(pattern, i)
+                    continue
+                if pattern[i] == "(":
+                    depth += 1
+                elif pattern[i] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        i += 1
+                        break
+                i += 1
+        else:
+            i += 1
+        atom = pattern[start:i]
+        quantifier = _re_quantifier.match(pattern, i)
+        if quantifier:
+            i = quantifier.end()
+        alternatives[-1].append((atom, quantifier.group() if quantifier else ""))
+    return alternatives
+
+def _get_head(pattern):
+    """ returns the head of a pattern without its leading backslash,
+        or None if the pattern doesn't start with a mandatory backslash """
+    alternatives = _split(pattern)
+    if len(alternatives) != 1 or not alternatives[0] or alternatives[0][0] != ("\\\\", ""):
+        return None
+    head = ""
+    for (atom, quantifier) in alternatives[0][1:]:
+        if _re_open_ended.search(atom):
+            break
+        head += atom + quantifier
+    return head
+
+def _literal_prefixes(pattern, limit = 64):
+    """ returns a set of strings, such that every match of the pattern
+        starts with one of them, and whether they are complete matches """
+    prefixes = set()
+    complete = True
+    for items in _split(pattern):
+        (alt_prefixes, alt_complete) = _literal_prefixes_seq(items, limit)
+        prefixes |= alt_prefixes
+        complete = complete and alt_complete
+    if len(prefixes) > limit:
+        return ({""}, False)
+    return (prefixes, complete)
+
+def _literal_prefixes_seq(items, limit):
+    prefixes = {""}
+    for (atom, quantifier) in items:
+        if atom[0] == "\\" and len(atom) == 2 and not atom[1].isalnum():
+            (options, complete) = ({atom[1]}, True)
+        elif len(atom) == 1 and atom not in ".^$":
+            (options, complete) = ({atom}, True)
+        elif atom[0] == "(" and (atom[1] != "?" or atom[:3] == "(?:" or atom[:4] == "(?P<"):
+            (options, complete) = _literal_prefixes(atom[_re_group_opener.match(atom).end():-1], limit)
+        else:
+            return (prefixes, False)
+        if quantifier in ["?", "??", "?+"]:
+            options = options | {""}
+        elif quantifier != "":
+            complete = False    # only the first repetition is considered
+            if quantifier[0] in "*{":
+                options = {""}
+        prefixes = {p + o for p in prefixes for o in options}
+        if len(prefixes) > limit:
+            return ({""}, False)
+        if not complete:
+            return (prefixes, False)
+    return (prefixes, True)
+
+def _get_anchors(pattern):
+    """ returns a list of strings, one of which occurs in every match of the pattern """
+    head = _get_head(pattern)
+    if head == None:
+        return [""]
+    # the literal prefixes of the head
+    prefixes = _literal_prefixes(head)[0]
+    prefixes = ["\\" + p for p in prefixes if not any(p != q and p.startswith(q) for q in prefixes)]
+    # literal strings required by the head
+    runs = [""]
+    for (atom, quantifier) in [("\\\\", "")] + _split(head)[0]:
+        if atom[0] == "\\" and len(atom) == 2 and not atom[1].isalnum():
+            literal = atom[1]
+        elif len(atom) == 1 and atom not in ".^$":
+            literal = atom
+        else:
+            literal = None
+        if literal and quantifier in ["", "+", "+?", "++"]:
+            runs[-1] += literal
+        if not literal or quantifier:
+            runs.append("")
+    longest_run = max(runs, key = len)
+    if len(longest_run) > min(len(p) for p in prefixes):
+        return [longest_run]
+    return prefixes
+
+def _scanner_branch(regex, index):
+    """ returns the head of a regex as a branch of the combined scanner
+        (or None if it can't be combined) """
+    if regex.flags != re.UNICODE or not isinstance(regex.pattern, str):
+        return None
+    head = _get_head(regex.pattern)
+    if head == None or _re_numbered_backref.search(head):
+        return None
+    # group names have to be unique in the combined scanner
+    head = _re_group_name.sub(lambda m : f"(?P{m.group(1)}{m.group(2)}_{index}{m.group(3)}", head)
+    return f"(?P<_t{index}>{head})"
+
+def _may_overlap(prefixes_a, prefixes_b):
+    """ checks if strings starting with prefixes from both sets can coincide """
+    return any(a.startswith(b) or b.startswith(a) for a in prefixes_a for b in prefixes_b)
+
+
+def scan_arg(string, pos):
+    """
+    Scans a macro argument starting at pos (after the opening brace)
+    and returns the position of the closing brace (or -1).
+    Like RE_ARG, math ($...$) is skipped as a whole and empty arguments aren't accepted,
+    but braces can be nested arbitrarily deep.
+    The closing braces of all groups that are scanned are remembered for the last string,
+    so every group is only scanned once (e.g. if a brace isn't closed,
+    the following tokens in the unclosed group don't scan to the end of the string again).
+    """
+    if scan_arg.cached_string is not string:
+        scan_arg.cached_string = string
+        scan_arg.closing = {}
+    closing = scan_arg.closing      # position of '{' -> position of the matching '}' (or -1)
+    end = closing.get(pos - 1)
+    if end == None:
+        end = _scan_group(string, pos - 1, closing)
+    return end if end > pos else -1
+
+scan_arg.cached_string = None
+scan_arg.closing = {}
+
+def _scan_group(string, start, closing):
+    """ returns the position of the brace closing the group starting at start (or -1)
+        and puts the closing braces of the scanned groups into closing """
+    opened = [start]
+    i = start + 1
+    search = _re_arg_special.search
+    while True:
+        special = search(string, i)
+        if not special:
+            break
+        i = special.start()
+        c = string[i]
+        if c == "$":
+            j = string.find("$", i + 1)
+            if j <= i + 1:
+                break
+            i = j + 1
+        elif c == "{":
+            end = closing.get(i)
+            if end == None:
+                opened.append(i)
+                i += 1
+            elif end < 0:
+                break
+            else:
+                i = end + 1
+        else:
+            closing[opened.pop()] = i
+            if not opened:
+                return i
+            i += 1
+    # none of the open groups can be closed
+    for j in opened:
+        closing[j] = -1
+    return -1
+
+
+class TokenMatch(object):
+    """ A match-like object for tokens that weren't matched by a single regex.
+        It supports the parts of the re.Match interface that are used by the harvesters. """
+    __slots__ = ["string", "re", "spans"]
+
+    def __init__(self, string, regex, spans):
+        self.string = string
+        self.re = regex
+        self.spans = spans          # group name (or 0) -> (start, end) or None
+
+    def __span(self, group):
+        if group not in self.spans:
+            raise IndexError("no such group")
+        return self.spans[group]
+
+    def group(self, *groups):
+        if not groups:
+            groups = (0,)
+        values = []
+        for group in groups:
+            span = self.__span(group)
+            values.append(self.string[span[0]:span[1]] if span else None)
+        return values[0] if len(values) == 1 else tuple(values)
+
+    def __getitem__(self, group):
+        return self.group(group)
+
+    def groupdict(self, default=None):
+        return {name : (self.group(name) if self.spans[name] else default)
+                    for name in self.spans if name != 0}
+
+    def start(self, group=0):
+        span = self.__span(group)
+        return span[0] if span else -1
+
+    def end(self, group=0):
+        span = self.__span(group)
+        return span[1] if span else -1
+
+    def span(self, group=0):
+        return self.__span(group) or (-1, -1)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} object; span={self.spans[0]}, match={self.group(0)!r}>"
+
+
+def _get_argument(items):
+    """ returns the group name if the items are '\\{(?P<name>RE_ARG)\\}' """
+    if len(items) != 3 or items[0] != ("\\{", "") or items[2] != ("\\}", "") or items[1][1]:
+        return None
+    group = _re_arg_group.fullmatch(items[1][0])
+    return group.group("name") if group else None
+
+def _split_arguments(pattern):
+    """ splits a pattern into the part before the {arg} groups at its end,
+        a list of (group name, optional, skip whitespace) for the arguments
+        and whether whitespace after the arguments is matched as well """
+    alternatives = _split(pattern)
+    if len(alternatives) != 1:
+        return None
+    items = alternatives[0]
+    trailing_ws = items[-1:] == [("\\s", "*")]
+    if trailing_ws:
+        items = items[:-1]
+    arguments = []
+    while items:
+        (atom, quantifier) = items[-1]
+        if quantifier == "?" and atom[0] == "(" and atom[1:3] != "?P":    # like (?:\s*\{(?P<arg1>...)\})?
+            inner = _split(atom[_re_group_opener.match(atom).end():-1])
+            inner = inner[0] if len(inner) == 1 else []
+            ws = inner[:1] == [("\\s", "*")]
+            name = _get_argument(inner[1:] if ws else inner)
+            if not name:
+                break
+            arguments.append((name, True, ws))
+            items = items[:-1]
+        else:
+            name = _get_argument(items[-3:])
+            if not name:
+                break
+            arguments.append((name, False, False))
+            items = items[:-3]
+    prefix = "".join(atom + quantifier for (atom, quantifier) in items)
+    if not arguments or RE_ARG in prefix:
+        return None
+    arguments.reverse()
+    return (prefix, arguments, trailing_ws)
+
+
+class ArgumentRegex(object):
+    """
+    Matches a token regex that ends with {arg} groups:
+    The part before the arguments is matched with a regex and the arguments are read by scan_arg.
+    As most arguments don't contain nested braces, a variant of the regex
+    with possessive argument patterns is tried first
+    (if the re module supports them, i.e. from Python 3.11 on).
+    Use ArgumentRegex.create, which returns None for other regexes.
+    """
+    def __init__(self, regex, prefix, arguments, trailing_ws):
+        self.re = regex
+        self.arguments = arguments
+        self.trailing_ws = trailing_ws
+        self.groups = list(regex.groupindex)
+        # the prefix is atomic: if the arguments don't match, the regex engine must not
+        # backtrack into it (e.g. drop optional parameters) and return a shorter match instead of scan_arg
+        fast = "(?>" + prefix + ")"
+        for (name, optional, ws) in arguments:
+            argument = r"\{(?P<" + name + ">" + _RE_ARG_POSSESSIVE + r")\}"
+            fast += r"(?:" + (r"\s*+" if ws else "") + argument + ")?+" if optional else argument
+        if arguments[-1][1]:
+            fast += r"(?!\s*\{)"    # otherwise an optional argument might need scan_arg
+        try:
+            self.fast = re.compile(fast + (r"\s*" if trailing_ws else ""), regex.flags)
+        except re.error:    # possessive quantifiers and atomic groups are not supported before Python 3.11
+            self.fast = None
+        if not arguments[0][1]:
+            prefix += r"(?=\{)"     # the prefix has to be followed by the first argument
+        self.prefix = re.compile(prefix, regex.flags)
+
+    @staticmethod
+    def create(regex):
+        if not isinstance(regex.pattern, str):
+            return None
+        split = _split_arguments(regex.pattern)
+        if not split:
+            return None
+        try:
+            return ArgumentRegex(regex, *split)
+        except re.error:
+            return None
+
+    def match(self, string, pos=0):
+        if self.fast != None:
+            match = self.fast.match(string, pos)
+            if match:
+                return match
+        head = self.prefix.match(string, pos)
+        if not head:
+            return None
+        spans = dict.fromkeys(self.groups)
+        for name in self.prefix.groupindex:
+            if head.start(name) >= 0:
+                spans[name] = head.span(name)
+        i = head.end()
+        n = len(string)
+        for (name, optional, ws) in self.arguments:
+            j = i
+            if ws:
+                while j < n and string[j].isspace():
+                    j += 1
+            end = scan_arg(string, j + 1) if string.startswith("{", j) else -1
+            if end < 0:
+                if optional:
+                    continue
+                return None
+            spans[name] = (j + 1, end)
+            i = end + 1
+        if self.trailing_ws:
+            while i < n and string[i].isspace():
+                i += 1
+        spans[0] = (pos, i)
+        return TokenMatch(string, self.re, spans)
+
+    def finditer(self, string):
+        pos = 0
+        while True:
+            head = self.prefix.search(string, pos)
+            if not head:
+                return
+            match = self.match(string, head.start())
+            if match:
+                yield match
+                pos = max(match.end(), head.start() + 1)
+            else:
+                pos = head.start() + 1
+
+
+class Tokenizer(object):
+    """ Finds the tokens of a token list in a string """
+    def __init__(self, regexes):
+        self.regexes = [(re.compile(regex), token_type) for (regex, token_type) in regexes]
+        self.matchers = [ArgumentRegex.create(regex) or regex for (regex, _) in self.regexes]
+        self.branches = [_scanner_branch(regex, i) for (i, (regex, _)) in enumerate(self.regexes)]
+        self.branch_index = {f"_t{i}" : i for i in range(len(self.regexes))}
+        self.anchors = [_get_anchors(regex.pattern) if isinstance(regex.pattern, str) and not regex.flags & re.IGNORECASE
+                            else [regex.pattern[:0]] for (regex, _) in self.regexes]
+        self.anchor_bits = {}   # anchor -> bit mask of the regexes that have it
+        for (i, anchors) in enumerate(self.anchors):
+            for anchor in anchors:
+                self.anchor_bits[anchor] = self.anchor_bits.get(anchor, 0) | (1 << i)
+        self.anchor_bits = sorted(self.anchor_bits.items())
+        self.scanners = {}      # bit mask -> (indices, scanner) for the regexes whose anchors occur
+        self.scanner = None
+        self.followers = []
+        if self.regexes and None not in self.branches:
+            self.scanner = self.__compile_scanner(range(len(self.regexes)))
+        if self.scanner:
+            # if the heads of several regexes match at the same position,
+            # the later regexes are found by a follower scanner
+            prefixes = [_literal_prefixes(_get_head(regex.pattern))[0] for (regex, _) in self.regexes]
+            for i in range(len(self.regexes)):
+                later = [j for j in range(i + 1, len(self.regexes)) if _may_overlap(prefixes[i], prefixes[j])]
+                self.followers.append(self.__compile_scanner(later) if later else None)
+                if later and not self.followers[-1]:
+                    self.scanner = None
+                    break
+
+    def __compile_scanner(self, indices):
+        """ scanner for the heads of the regexes with the given indices """
+        try:
+            return re.compile(r"\\(?=" + "|".join(self.branches[i] for i in indices) + ")")
+        except re.error:
+            return None
+
+    def __get_scanner(self, mask):
+        """ returns the indices of the regexes in the bit mask and a scanner for them """
+        if mask not in self.scanners:
+            indices = [i for i in range(len(self.regexes)) if mask & (1 << i)]
+            if len(indices) == len(self.regexes) or not self.scanner:
+                self.scanners[mask] = (indices, self.scanner)
+            else:
+                self.scanners[mask] = (indices, self.__compile_scanner(indices))
+        return self.scanners[mask]
+
+    def tokenize(self, string):
+        """ Returns tokens from a string as pairs (match, token_type),
+            sorted according to the match start (the order of the regexes breaks ties). """
+        return list(self.iter_tokens(string))
+
+    def iter_tokens(self, string):
+        """ Like tokenize, but yields the tokens one by one as they are found """
+        # only look for regexes whose anchors occur in the string
+        mask = 0
+        for (anchor, bits) in self.anchor_bits:
+            if anchor in string:
+                mask |= bits
+        (indices, scanner) = self.__get_scanner(mask)
+        statistics = tokenize.statistics
+        statistics["strings"] += 1
+        statistics["scans"] += len(indices)
+        statistics["skipped scans"] += len(self.regexes) - len(indices)
+        if not indices:
+            return
+
+        if not scanner:
+            # merge the matches of the regexes (heapq.merge breaks ties by the order of the regexes)
+            yield from heapq.merge(*[zip(self.matchers[i].finditer(string), itertools.repeat(self.regexes[i][1]))
+                                        for i in indices], key = lambda e : e[0].start())
+            return
+
+        regexes = self.regexes
+        matchers = self.matchers
+        followers = self.followers
+        branch_index = self.branch_index
+        # like with re.finditer, a regex can only match again after its previous match ended
+        blocked_until = [0] * len(regexes)
+        for candidate in scanner.finditer(string):
+            pos = candidate.start()
+            index = branch_index[candidate.lastgroup]
+            while True:
+                if pos >= blocked_until[index]:
+                    match = matchers[index].match(string, pos)
+                    if match:
+                        yield (match, regexes[index][1])
+                        blocked_until[index] = match.end()
+                follower = followers[index]
+                if not follower:
+                    break
+                candidate = follower.match(string, pos)
+                if not candidate:
+                    break
+                index = branch_index[candidate.lastgroup]
+
+
+BACKENDS = ["regex", "lexer"]
+
+def set_backend(backend):
+    """ selects the tokenizer backend ("regex" or "lexer") """
+    assert backend in BACKENDS
+    get_tokenizer.backend = backend
+
+def get_tokenizer(regexes):
+    """ returns the (cached) tokenizer for a token list """
+    key = (get_tokenizer.backend, tuple(regexes))
+    if key not in get_tokenizer.cache:
+        tokenizer = None
+        if get_tokenizer.backend == "lexer":
+            import lmh_lexer
+            tokenizer = lmh_lexer.Lexer(regexes)
+            if not tokenizer.supported:     # fall back to regexes
+                tokenizer = None
+        get_tokenizer.cache[key] = tokenizer or Tokenizer(regexes)
+    return get_tokenizer.cache[key]
+
+get_tokenizer.cache = {}
+get_tokenizer.backend = os.environ.get("LMH_TOKENIZER", "regex")
+if get_tokenizer.backend not in BACKENDS:
+    get_tokenizer.backend = "regex"
+
+
+def tokenize(string, regexes):
+    """
+    Assumes that regexes is a list of pairs (regex, token_type).
+    Returns tokens from a string as pairs (match, token_type),
+    sorted according to the match start.
+    """
+    return get_tokenizer(regexes).tokenize(string)
+
+def iter_tokens(string, regexes):
+    """
+    Like tokenize, but returns an iterator that finds the tokens lazily,
+    i.e. the match objects don't have to be kept in memory at the same time.
+    """
+    return get_tokenizer(regexes).iter_tokens(string)
+
+tokenize.statistics = {"strings" : 0, "scans" : 0, "skipped scans" : 0}
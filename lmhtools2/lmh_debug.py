@@ -13,4 +13,4 @@ harvester = Harvester(Logger(2), mh)
 harvester.load_files('^(MiKoMH|smglom)/.*$')
 
 harvester.logger.print_logs()
-
+harvester.logger.print_suppressed()
@@ -1,6 +1,6 @@
 from lmh_logging import *
 from regexes import *
-import re
+import lmh_source       # (in the parent directory, which is added to the path by regexes.py)
 import os
 
 
@@ -56,12 +56,12 @@ class TexNode(object):
         self.end_token = end_token
 
     def parse(self, tokens):
-        i = 0
-        while i < len(tokens):
-            match, tt = tokens[i]
+        ''' consumes tokens from the iterator up to the end of the node.
+            Returns False if parsing should be aborted (the node wasn't closed) '''
+        for (match, tt) in tokens:
             if tt == self.end_token:
                 self.end_match = match
-                return tokens[i+1:]
+                return True
 
             if tt == TOKEN_DEFI:
                 self.children.append(DEFI(self, match))
@@ -98,19 +98,17 @@ class TexNode(object):
                 self.children.append(OMGROUP(self, match))
 
             elif tt in ENV_END_TOKENS:
-                self.ctx.log(LogEntry(LOG_ERROR, f'Unexpected environment end: {match.group(0)}',
-                    self.lmhfile.get_position(match.start()), E_STEX_PARSE_ERROR))
-                return []
+                self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, lambda : self.lmhfile.get_position(match.start()),
+                    'Unexpected environment end: {}', match.group(0))
+                return False
 
             if tt in ENV_BEGIN_TOKENS:
-                tokens = self.children[-1].parse(tokens[i+1:])
-                i = 0
-            else:
-                i += 1
+                if not self.children[-1].parse(tokens):
+                    break
         if self.end_token:
-            self.ctx.log(LogEntry(LOG_ERROR, f'Environment started but not closed: {self.match.group(0)}',
-                self.position, E_STEX_PARSE_ERROR))
-        return []
+            self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, self.position,
+                'Environment started but not closed: {}', self.match.group(0))
+        return False
 
     def collect_children(self, collect, skip = []):
         for c in skip:
@@ -173,8 +171,8 @@ class TREFI(LmhMacro):
             assert not other_arg
             self.display = ' '.join(args)
         else:
-            self.ctx.log(LogEntry(LOG_ERROR, f'Use of atrefi is deprecated (and may result in errors)',
-                self.position, E_STEX_PARSE_ERROR))
+            self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, self.position,
+                'Use of atrefi is deprecated (and may result in errors)')
             self.display = other_arg
         if match.group('start').isupper():
             self.display = self.display.capitalize()
@@ -191,8 +189,8 @@ class TREFI(LmhMacro):
                 self.target_mod = params.split('?')[0]
                 self.symb = params.split('?')[1]
                 if not match.group('start').lower()[0] in ['m', 'd']:
-                    self.ctx.log(LogEntry(LOG_ERROR, f'Expected trefi or drefi for "{match.group()}"',
-                        self.position, E_STEX_PARSE_ERROR))
+                    self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, self.position,
+                        'Expected trefi or drefi for "{}"', match.group())
         if not self.target_mod:
             # by default, target module is is current module
             self.target_mod = self.position.modname
@@ -230,8 +228,8 @@ class IMPORTMHMODULE(LmhMacro):
 
         repo = self.position.repo
         if 'repos' in self.params:
-            self.ctx.log(LogEntry(LOG_WARN, f'"repos" is deprecated - use "mhrepos" instead',
-                self.position, E_STEX_PARSE_ERROR))
+            self.ctx.log_message(LOG_WARN, E_STEX_PARSE_ERROR, self.position,
+                '"repos" is deprecated - use "mhrepos" instead')
             repo = self.params['repos']
         if 'mhrepos' in self.params:
             repo = self.params['mhrepos']
@@ -242,8 +240,8 @@ class IMPORTMHMODULE(LmhMacro):
             dir_ = self.params['dir']
         r = self.ctx.find_repo(repo)
         if not r:
-            self.ctx.log(LogEntry(LOG_ERROR, f'Failed to find repo "{repo}" for "{match.group(0)}"',
-                self.position, E_STEX_PARSE_ERROR))
+            self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, self.position,
+                'Failed to find repo "{}" for "{}"', repo, match.group(0))
         if r and 'path' in self.params:
             path = os.path.join(r.path, 'source', self.params['path'] + '.tex')
             dir_ = '/'.join(self.params['path'].split('/')[:-1])
@@ -258,8 +256,8 @@ class USEMHMODULE(LmhMacro):
         self.params = get_params(match.group('params'))
         repo = self.position.repo
         if 'repos' in self.params:
-            self.ctx.log(LogEntry(LOG_WARN, f'"repos" is deprecated - use "mhrepos" instead',
-                self.position, E_STEX_PARSE_ERROR))
+            self.ctx.log_message(LOG_WARN, E_STEX_PARSE_ERROR, self.position,
+                '"repos" is deprecated - use "mhrepos" instead')
             repo = self.params['repos']
         if 'mhrepos' in self.params:
             repo = self.params['mhrepos']
@@ -270,8 +268,8 @@ class USEMHMODULE(LmhMacro):
             dir_ = self.params['dir']
         r = self.ctx.find_repo(repo)
         if not r:
-            self.ctx.log(LogEntry(LOG_ERROR, f'Failed to find repo "{repo}" for "{match.group(0)}"',
-                self.position, E_STEX_PARSE_ERROR))
+            self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, self.position,
+                'Failed to find repo "{}" for "{}"', repo, match.group(0))
         if r and 'path' in self.params:
             path = os.path.join(r.path, 'source', self.params['path'] + '.tex')
             dir_ = '/'.join(self.params['path'].split('/')[:-1])
@@ -342,8 +340,8 @@ class MODULE(LmhEnvironment):
             self.mod = self.params['id']
         else:
             self.mod = self.position.modname
-            self.ctx.log(LogEntry(LOG_ERROR, f'Module doesn\'t have "id" parameter', self.position,
-                E_STEX_PARSE_ERROR))
+            self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, self.position,
+                'Module doesn\'t have "id" parameter')
         self.position.modname = self.mod
         self.lang = 'mono'
 
@@ -394,7 +392,7 @@ class LmhFile(TexNode):
         self.__preprocess_string()
         self.__generate_offset_map()
 
-        self.parse(tokenize(self.string, REGEXES))
+        self.parse(iter_tokens(self.string, REGEXES))
         self.declared_symbols = []
 
         self.__determine_filetype()
@@ -423,30 +421,15 @@ class LmhFile(TexNode):
             self.filetype = 'empty'   # no relevant stex
 
 
-    commentregex = re.compile('(^|\n)[\t ]*\%[^\n]*\n')
     def __preprocess_string(self):
-        ''' removes comment lines, but keeps linebreaks to maintain line numbers
-            TODO: Implement this in a cleaner way!
-        '''
-        s = LmhFile.commentregex.sub('\\1\n', self.string)
-        while s != self.string:
-            self.string = s
-            s = LmhFile.commentregex.sub('\\1\n', self.string)
+        ''' removes comment lines, but keeps linebreaks to maintain line numbers '''
+        self.string = lmh_source.strip_comment_lines(self.string)
 
     def __generate_offset_map(self):
-        self.offset_map = []
-        linenumber = 1
-        charnumber = 1
-        for c in self.string:
-            self.offset_map.append((linenumber, charnumber))
-            if c == "\n":
-                linenumber += 1
-                charnumber = 1
-            else:
-                charnumber += 1
+        self.offset_map = lmh_source.PositionIndex(self.string)
 
     def __get_offset(self, index):
-        entry = self.offset_map[index]
+        entry = self.offset_map.get_position(index)
         return Offset(index=index, line=entry[0], col=entry[1])
 
     def get_position(self, index):
@@ -1,6 +1,7 @@
 from lmh_logging import *
 from lmh_elements import *
 from lmh_referencer import Referencer
+import lmh_repos      # (in the parent directory, which is added to the path by regexes.py)
 import os
 
 
@@ -27,6 +28,9 @@ class LmhContext(object):
     def log(self, entry):
         self.logger.log(entry)
 
+    def log_message(self, loglevel, entrytype, position, message, *args):
+        self.logger.log_message(loglevel, entrytype, position, message, *args)
+
     def set_repos(self, repos):
         self.repos = repos
 
@@ -137,7 +141,7 @@ class Harvester(object):
                     # elif file_name == 'localpaths.tex' or \
                     #        (file_name.startswith('all.') and len(file_name) < 12):
                     elif Harvester.skip_regex.match(file_name):
-                        self.logger.log_skip(f'Skipping {path}', repo.position)
+                        self.logger.log_skip('Skipping {}', repo.position, path)
                         continue
                     else:
                         yield path
@@ -156,25 +160,21 @@ class Harvester(object):
 
 
     def __collect_repos(self, directory=None):
-        ''' recursively finds git repos and collects them '''
+        ''' finds git repos and collects them '''
         if not directory:
             directory = self.mhdir
 
-        if os.path.isdir(os.path.join(directory, '.git')):  ## TODO: Is there a better way?
+        def skip(directory, subdir):
+            if subdir.lower() == 'meta-inf':
+                self.logger.log_skip('Skipping directory {}', Position(), directory)
+                return True
+            return False
+
+        inventory = lmh_repos.RepoInventory(lmh_repos.get_default_cache_file())
+        for repo_directory in inventory.find_repos(directory, skip):
             try:
-                self.repos.append(LmhRepo(directory, self.ctx))
+                self.repos.append(LmhRepo(repo_directory, self.ctx))
             except Exception as ex:
-                self.logger.log_fatal(f'An unexpected error occured while processing git repository {directory}:',
+                self.logger.log_fatal(f'An unexpected error occured while processing git repository {repo_directory}:',
                         ex, Position())
-            return
-
-        for subdir in os.listdir(directory):
-            if subdir.lower() == 'meta-inf':
-                self.logger.log_skip(f'Skipping directory {directory}', Position())
-                continue
-            subdirpath = os.path.join(directory, subdir)
-            if os.path.isdir(subdirpath):
-                self.__collect_repos(subdirpath)
-
-    
-
+        inventory.save()
@@ -21,6 +21,17 @@ E_DUPLICATE_MODULE = 5
 E_SYMB_LINK_ERROR = 6           # failed to link e.g. a trefi to a symbol
 E_FILENAME_MISMATCH = 7
 
+ENTRY_TYPE_NAMES = {
+    E_SKIP : "skip",
+    E_UNEXPECTED_EXCEPTION : "unexpected exception",
+    E_MISSING_MANIFEST : "missing manifest",
+    E_MANIFEST_ERROR : "manifest error",
+    E_STEX_PARSE_ERROR : "stex parse error",
+    E_DUPLICATE_MODULE : "duplicate module",
+    E_SYMB_LINK_ERROR : "symbol link error",
+    E_FILENAME_MISMATCH : "filename mismatch",
+}
+
 
 
 def exception_to_string(excp):
@@ -44,13 +55,29 @@ class Logger(object):
         self.loglevel = loglevel
 
         self.logs = []
+        self.suppressed = {}    # entry type -> number of entries below the log level
 
     def log(self, entry):
         if entry.loglevel >= self.loglevel:
             self.logs.append(entry)
-
-    def log_skip(self, message, position):
-        self.log(LogEntry(LOG_DEBUG, message, position, E_SKIP))
+        else:
+            self.suppressed[entry.entrytype] = self.suppressed.get(entry.entrytype, 0) + 1
+
+    def log_message(self, loglevel, entrytype, position, message, *args):
+        ''' Like log, but the LogEntry is only created if the log level is high enough.
+            In that case, the message is formatted with the args (str.format)
+            and the position is obtained by calling it, if it is a function. '''
+        if loglevel < self.loglevel:
+            self.suppressed[entrytype] = self.suppressed.get(entrytype, 0) + 1
+            return
+        if callable(position):
+            position = position()
+        if args:
+            message = message.format(*args)
+        self.logs.append(LogEntry(loglevel, message, position, entrytype))
+
+    def log_skip(self, message, position, *args):
+        self.log_message(LOG_DEBUG, E_SKIP, position, message, *args)
 
     def log_fatal(self, message, exception, position):
         self.log(LogEntry(LOG_FATAL, message + os.linesep + exception_to_string(exception),
@@ -60,3 +87,10 @@ class Logger(object):
         for entry in self.logs:
             print(f'{entry.position.toString()}: {entry.message}')
 
+    def print_suppressed(self):
+        ''' prints how many entries of each type were below the log level '''
+        if self.suppressed:
+            counts = ', '.join(f'{self.suppressed[entrytype]} {ENTRY_TYPE_NAMES.get(entrytype, entrytype)}'
+                               for entrytype in sorted(self.suppressed))
+            print(f'Suppressed entries below the log level: {counts}')
+
@@ -83,8 +83,8 @@ class Referencer(object):
             for sym in f.collect_children(collect=[SYMI, SYMDEF]):
                 p = sym.get_parent(goals=[MODSIG, MODULE])
                 if not p:
-                    self.ctx.log(LogEntry(LOG_ERROR, f'"{sym.match.group(0)}" is not inside a modsig or module',
-                        sym.position, E_STEX_PARSE_ERROR))
+                    self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, sym.position,
+                        '"{}" is not inside a modsig or module', sym.match.group(0))
                     continue
                 self.__put_symbol(Symbol(sym.symb, p.position.repo, p.position.directory, p.mod, [sym]))
             # defis
@@ -109,7 +109,8 @@ class Referencer(object):
                     if f and f.filetype == 'modsig':
                         s.modsig = f
                         continue
-                self.ctx.log(LogEntry(LOG_ERROR, f'File appears to be an mhmodnl, but I failed to find a corresponding modsig', s.position, E_SYMB_LINK_ERROR))
+                self.ctx.log_message(LOG_ERROR, E_SYMB_LINK_ERROR, s.position,
+                    'File appears to be an mhmodnl, but I failed to find a corresponding modsig')
 
 
         # STEP 3: LINK ALL REFERENCES
@@ -117,8 +118,8 @@ class Referencer(object):
             for m in f.collect_children([DEFI, TREFI]):
                 s = self.__get_symbol(m)
                 if not s:
-                    self.ctx.log(LogEntry(LOG_ERROR, f'Failed to link "{m.match.group(0)}" to a symbol',
-                        m.position, E_SYMB_LINK_ERROR))
+                    self.ctx.log_message(LOG_ERROR, E_SYMB_LINK_ERROR, m.position,
+                        'Failed to link "{}" to a symbol', m.match.group(0))
                     continue
                 if m in s.used: continue
                 s.used.append(m)
@@ -176,8 +177,8 @@ class Referencer(object):
         elif isinstance(x, DEFI) or isinstance(x, SYMI) or isinstance(x, SYMDEF):
             p = x.get_parent(goals=[MHMODNL, MODSIG, MODULE])
             if not p:
-                self.ctx.log(LogEntry(LOG_ERROR, f'Failed to found surrounding module',
-                    x.position, E_STEX_PARSE_ERROR))
+                self.ctx.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, x.position,
+                    'Failed to found surrounding module')
                 return None
             # key = (repo, p.position.directory if p.position.directory else '', mod
             for s in self.symbols[symb]:
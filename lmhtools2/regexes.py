@@ -1,5 +1,12 @@
 from lmh_logging import *
+import os
 import re
+import sys
+
+# the tokenizer engine and the parameter parsing are shared with ../lmh_harvest.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import lmh_source
+import lmh_tokenizer
 
 
 LANGS = ['de', 'en', 'zhs', 'zht', 'ro', 'tu', 'ru', 'fi', 'fr']
@@ -66,6 +73,7 @@ re_end_mhmodnl = re.compile(
         r"\\end\s*\{mhmodnl\}"
         )
 
+# when tokenizing, arguments are read by lmh_tokenizer.scan_arg instead (which supports nested braces)
 re_arg = r"(?:[^\{\}\$]|(?:\$[^\$]+\$)|(\{[^\{\}\$]*\}))+"
 
 re_defi = re.compile(
@@ -228,26 +236,18 @@ def tokenize(string, regexes):
     Assumes that regexes is a list of pairs (regex, token_type).
     Returns tokens from a string as pairs (match, token_type),
     sorted according to the match start.
+    The tokens are found in a single pass (see ../lmh_tokenizer.py).
     '''
-    tokens = []
-    for (regex, token_type) in regexes:
-        tokens += [(match, token_type) for match in re.finditer(regex, string)]
-    return sorted(tokens, key = lambda e : e[0].start())
-
+    return lmh_tokenizer.tokenize(string, regexes)
 
-def get_params(param_str):
-    ''' returns dictionary of comma-separated key=value pairs '''
-    if param_str == None:
-        return { }
+def iter_tokens(string, regexes):
+    ''' Like tokenize, but the tokens are found lazily while they are consumed '''
+    return lmh_tokenizer.iter_tokens(string, regexes)
 
-    return {
-            param.group("key") : param.group("val")
-                for param in re.finditer(get_params.re_param, param_str)
-        }
 
-get_params.re_param = re.compile(
-        r"(?P<key>[a-zA-Z0-9_-]+)"
-        r"(?:=(?P<val>(?:[^\{\},]+)|(?:\{[^\{\}]+\})))?")
+def get_params(param_str):
+    ''' returns (read-only) dictionary of comma-separated key=value pairs (cached, see ../lmh_source.py) '''
+    return lmh_source.get_params(param_str)
 
 
 def get_args(match, is_symi, ctx, position):
@@ -267,9 +267,8 @@ def get_args(match, is_symi, ctx, position):
 
     arity = {"i" : 1, "ii" : 2, "iii" : 3, "iv" : 4}[match.group("arity")]
     if len(args) != arity:
-        ctx.logger.log(LogEntry(LOG_ERROR,
-            f"Arity mismatch (needs {one_plus}{arity} arguments, but found {one_plus}{len(args)}): '{match.group(0)}'",
-            position, E_STEX_PARSE_ERROR))
+        ctx.logger.log_message(LOG_ERROR, E_STEX_PARSE_ERROR, position,
+            "Arity mismatch (needs {0}{1} arguments, but found {0}{2}): '{3}'", one_plus, arity, len(args), match.group(0))
     return (args, other_arg)
 
 
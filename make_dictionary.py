@@ -22,7 +22,9 @@ LANG2LABEL = {
 
 import os
 import re
+import lmh_cache
 import lmh_harvest as harvest
+import lmh_snapshot
 
 class Dictionary(object):
     """ Container for collecting the dictionary content"""
@@ -113,14 +115,30 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Script for creating a multi-lingual dictionary from e.g. smglom",
             epilog="Example call: ")    # TODO: example call
     parser.add_argument("LANGUAGES", help="languages to be included in dictionary (example value: en,de,ro")
-    parser.add_argument("DIRECTORY", nargs="+", help="git repo or higher level directory for which dictionary is generated")
+    parser.add_argument("-C", "--cache", metavar="DIR",
+            help="cache the harvest of files in DIR (e.g. .lmhcache; default: the value of $LMH_CACHE)")
+    parser.add_argument("-S", "--snapshot", metavar="FILE",
+            help="load the data from a snapshot (see lmh_harvest.py --snapshot) instead of harvesting it")
+    parser.add_argument("DIRECTORY", nargs="*", help="git repo or higher level directory for which dictionary is generated")
 
     args = parser.parse_args()
+    if not args.DIRECTORY and not args.snapshot:
+        parser.error("a DIRECTORY or a --snapshot is required")
 
-    mathhub_dir = harvest.get_mathhub_dir(args.DIRECTORY[0])
     languages = re.split("[-,_+.]", args.LANGUAGES)
     logger = harvest.SimpleLogger(0)   # for now: 0 verbosity
-    ctx = harvest.HarvestContext(logger, harvest.DataGatherer(), mathhub_dir)
+    if args.snapshot and not args.DIRECTORY:
+        # nothing is added to the data, so a binary snapshot can be used without copying it
+        (gatherer, mathhub_dir) = lmh_snapshot.open_snapshot(args.snapshot)
+    else:
+        gatherer = harvest.DataGatherer()
+        if args.snapshot:
+            mathhub_dir = lmh_snapshot.load_snapshot(args.snapshot, gatherer)
+        else:
+            mathhub_dir = harvest.get_mathhub_dir(args.DIRECTORY[0])
+    ctx = harvest.HarvestContext(logger, gatherer, mathhub_dir)
+    if args.cache:
+        ctx.cache = lmh_cache.HarvestCache(args.cache)
     for directory in args.DIRECTORY:
         harvest.gather_data_for_all_repos(directory, ctx)
     
@@ -18,6 +18,8 @@ run this from https://gl.mathhub.info/smglom/meta-inf/applications (i.e. create
 """
 
 
+import lmh_cache
+import lmh_incremental
 import lmh_harvest as harvest
 import re
 import os
@@ -50,10 +52,11 @@ re_trefi2 = re.compile(   # stuff like \trefi[?
         )
 
 def findSurroundingEnvironment(string, startregex, endregex, offset):
-    begins = [(harvest.get_file_position(string, match.end()), match.end(), 'b') for match in re.finditer(startregex, string)]
-    ends = [(harvest.get_file_position(string, match.start()), match.start(), 'e') for match in re.finditer(endregex, string)]
+    """ offset is an integer offset into string """
+    begins = [(match.end(), 'b') for match in re.finditer(startregex, string)]
+    ends = [(match.start(), 'e') for match in re.finditer(endregex, string)]
     # TODO: Write a simpler/shorter/more readable algorithm...
-    a = sorted(begins + ends, key = lambda t : t[1])
+    a = sorted(begins + ends, key = lambda t : t[0])
     if not a: return None
     lastOpen = []
     before = True
@@ -61,7 +64,7 @@ def findSurroundingEnvironment(string, startregex, endregex, offset):
     right = None
     for i in range(len(a)):
         if a[i][0] <= offset:
-            if a[i][2] == 'b':
+            if a[i][1] == 'b':
                 lastOpen.append(i)
             else:
                 if not lastOpen:
@@ -75,7 +78,7 @@ def findSurroundingEnvironment(string, startregex, endregex, offset):
                     return None
                 left = lastOpen[-1]
                 toClose = 0
-            if a[i][2] == 'e':
+            if a[i][1] == 'e':
                 if toClose:
                     toClose -= 1
                 else:
@@ -87,7 +90,7 @@ def findSurroundingEnvironment(string, startregex, endregex, offset):
     if left == None or right == None:
         return None
     else:
-        return string[a[left][1]:a[right][1]]
+        return string[a[left][0]:a[right][0]]
 
 
 
@@ -111,7 +114,7 @@ class Glossary(object):
         self.uselinks = uselinks
 
     def fillDefi(self, defi):
-        defistr = defi["path"] + defi["offset"]   # unique for each defi
+        defistr = (defi["path"], defi["pos"])   # unique for each defi
         if defistr in self.covered_defis:
             return
         self.covered_defis.add(defistr)
@@ -123,12 +126,12 @@ class Glossary(object):
             if "\\begin{module}" in fstr:
                 isModule = True
 
-        offset = defi["offset"]
-        defstr = findSurroundingDefinition(filestr, harvest.pos_str_to_int_tuple(offset))
+        # the harvested offsets refer to the preprocessed file content as well
+        defstr = findSurroundingDefinition(filestr, defi["pos"])
         isError = False
         if not defstr:
             isError = True
-            defstr = "\\textcolor{red}{\\textbf{Error: The \\\\defi does not appear to be inside a definition environment. line " + offset + "}}"
+            defstr = "\\textcolor{red}{\\textbf{Error: The \\\\defi does not appear to be inside a definition environment. line " + defi["offset"] + "}}"
 
         repopath = os.path.relpath(os.path.realpath(defi["path"]), self.mathhub_dir).split(os.sep)
         postpath = None
@@ -238,6 +241,12 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Script for creating a glossary from e.g. smglom")
     parser.add_argument("LANGUAGE", help="language of the glossary (e.g. en)")
+    parser.add_argument("-C", "--cache", metavar="DIR",
+            help="cache the harvest of files in DIR (e.g. .lmhcache; default: the value of $LMH_CACHE)")
+    parser.add_argument("-I", "--incremental", metavar="DIR",
+            help="only harvest the files of git repos that have changed since the last run with the same DIR (e.g. .lmhstate)")
+    harvest.add_jobs_argument(parser)
+    harvest.add_dedup_argument(parser)
     parser.add_argument("DIRECTORY", nargs="+", help="git repo or higher level directory from which the glossary is generated")
 
     args = parser.parse_args()
@@ -246,6 +255,13 @@ if __name__ == "__main__":
     lang = args.LANGUAGE
     logger = harvest.SimpleLogger(0)   # for now: 0 verbosity
     ctx = harvest.HarvestContext(logger, harvest.DataGatherer(), mathhub_dir)
+    if args.cache:
+        ctx.cache = lmh_cache.HarvestCache(args.cache)
+    if args.incremental:
+        ctx.incremental = lmh_incremental.IncrementalHarvest(args.incremental)
+    ctx.jobs = args.jobs
+    if args.dedup:
+        ctx.dedup = harvest.FileDeduplicator()
     for directory in args.DIRECTORY:
         harvest.gather_data_for_all_repos(directory, ctx)
     
@@ -1,4 +1,5 @@
 import lmh_harvest as harvest
+import lmh_repos
 import os
 import sys
 import shutil
@@ -29,26 +30,15 @@ os.mkdir(TARGET)
 # STEP 1: Get archives
 
 def getArchives(directory, archives):
-    if os.path.isdir(os.path.join(directory, ".git")):  ## TODO: Is there a better way?
-        mf = os.path.join(directory, 'META-INF', 'MANIFEST.MF')
-        if os.path.isfile(mf):
-            with open(mf, 'r') as fp:
-                k = None
-                for line in fp:
-                    if line.startswith('id: '):
-                        k = line.strip().split(' ')[1]
-                        break
-                if k:
-                    archives[k] = os.path.realpath(directory)
+    inventory = lmh_repos.RepoInventory(lmh_repos.get_default_cache_file())
+    for repo in inventory.find_repos(directory):
+        manifest = inventory.get_manifest(repo)
+        if manifest != None:
+            if manifest.get('id'):
+                archives[manifest['id']] = os.path.realpath(repo)
         else:
-            archives[os.path.relpath(directory, MATHHUB)] = os.path.realpath(directory)
-
-    for subdir in os.listdir(directory):
-        if subdir == "meta-inf":
-            continue
-        subdirpath = os.path.join(directory, subdir)
-        if os.path.isdir(subdirpath):
-            getArchives(subdirpath, archives)
+            archives[os.path.relpath(repo, MATHHUB)] = os.path.realpath(repo)
+    inventory.save()
 
 ARCHIVES = {}
 getArchives(MATHHUB, ARCHIVES)
@@ -83,7 +73,7 @@ while tobeprocessed:
         with open(f, 'r') as fp:
             s = fp.read()
         s = harvest.preprocess_string(s)
-        for (match, token_type) in harvest.parse(s, harvest.regexes):
+        for (match, token_type) in harvest.iter_parse(s, harvest.regexes):
             # if token_type == harvest.TOKEN_IMPORTMHMODULE:
             if token_type in {harvest.TOKEN_IMPORTMHMODULE, harvest.TOKEN_USEMHMODULE, harvest.TOKEN_MHINPUTREF}:
                 params = harvest.get_params(match.group("params"))
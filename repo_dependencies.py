@@ -35,7 +35,7 @@ REGEXES = [
 def gather_repos(path, REPOS):
     with open(path, "r") as fp:
         string = harvest.preprocess_string(fp.read())
-        tokens = harvest.parse(string, REGEXES)
+        tokens = harvest.iter_parse(string, REGEXES)
         for (match, token_type) in tokens:
             if token_type in [harvest.TOKEN_GUSE, harvest.TOKEN_GIMPORT, TOKEN_MHINPUTREF]:
                 # repo is optional argument